@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import City, Qualification, Role, Candidate, Industry, Skill, Proposal, Recharge, Package
+from django.utils import timezone
+from .models import City, Qualification, Role, Candidate, Industry, Skill, Proposal, Recharge, Package, \
+    JobRecommendation, RecommendationRun, OutgoingEmail, JobAlert, \
+    StoredResume, ResumeText
+from .recharge import apply_recharge
 
 admin.site.register(City)
 admin.site.register(Qualification)
@@ -9,4 +13,32 @@ admin.site.register(Role)
 admin.site.register(Skill)
 admin.site.register(Proposal)
 admin.site.register(Package)
-admin.site.register(Recharge)
+admin.site.register(JobRecommendation)
+admin.site.register(RecommendationRun)
+admin.site.register(JobAlert)
+admin.site.register(StoredResume)
+admin.site.register(ResumeText)
+
+
+@admin.register(Recharge)
+class RechargeAdmin(admin.ModelAdmin):
+    readonly_fields = ('package_details',)
+
+    def save_model(self, request, obj, form, change):
+        # new recharges extend the validity of the user like a purchase does
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            apply_recharge(obj)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_on', 'sent_on')
+    list_filter = ('status',)
+    actions = ('requeue',)
+
+    def requeue(self, request, queryset):
+        queryset.exclude(status__in=[OutgoingEmail.SENT, OutgoingEmail.SENDING]).update(
+            status=OutgoingEmail.QUEUED, attempts=0, next_attempt_on=timezone.now())
+    requeue.short_description = 'Queue the selected emails again'
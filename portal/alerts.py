@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.urls import reverse
+from django.utils import timezone
+from recruiter.models import Job
+from .models import Candidate, JobAlert, OutgoingEmail
+
+
+# candidates whose digests are queued in one transaction
+DEFAULT_BATCH_SIZE = 100
+# jobs listed in one digest, the rest are only counted
+DIGEST_MAX_JOBS = 20
+# unmatched jobs older than this are marked matched without alerts, nobody wants a digest of stale jobs
+MATCH_MAX_AGE = timezone.timedelta(days=7)
+
+
+def digest_interval():
+    # a candidate gets at most one digest per interval, alerts arriving in between wait for the next one
+    return timezone.timedelta(hours=getattr(settings, 'JOB_ALERT_INTERVAL_HOURS', 24))
+
+
+def matching_candidates(job):
+    # a single set-based candidate query: candidates in the city of the job having its role and at least one of its skills,
+    # criteria the job leaves blank are skipped, a job with neither role nor skills matches nobody
+    skill_ids = list(job.skills.values_list('id', flat=True))
+    if job.role_id is None and not skill_ids:
+        return Candidate.objects.none()
+    candidates = Candidate.objects.exclude(email__isnull=True).exclude(email='')
+    if job.city_id is not None:
+        candidates = candidates.filter(city_id=job.city_id)
+    if job.role_id is not None:
+        candidates = candidates.annotate(has_role=Exists(Candidate.roles.through.objects.filter(
+            candidate_id=OuterRef('pk'), role_id=job.role_id))).filter(has_role=True)
+    if skill_ids:
+        candidates = candidates.annotate(has_skill=Exists(Candidate.skills.through.objects.filter(
+            candidate_id=OuterRef('pk'), skill_id__in=skill_ids))).filter(has_skill=True)
+    return candidates
+
+
+def match_new_jobs():
+    # turns every job not matched yet into pending alerts, returns the number of alerts created
+    created = 0
+    now = timezone.now()
+    Job.objects.filter(alerts_matched_on__isnull=True, posted_on__lt=now - MATCH_MAX_AGE) \
+        .update(alerts_matched_on=now)
+    for job in Job.objects.filter(alerts_matched_on__isnull=True).order_by('id'):
+        with transaction.atomic():
+            # claiming the job makes a second worker skip it instead of alerting twice
+            if not Job.objects.filter(id=job.id, alerts_matched_on__isnull=True).update(alerts_matched_on=now):
+                continue
+            alerts = [JobAlert(candidate_id=candidate_id, job_id=job.id)
+                      for candidate_id in matching_candidates(job).values_list('id', flat=True).iterator()]
+            JobAlert.objects.bulk_create(alerts, batch_size=500)
+        created += len(alerts)
+    return created
+
+
+def digest_email(candidate, alerts, site_url):
+    # an unsaved outbox row, the send_queued_mail worker delivers it
+    lines = ['Hello {},'.format(candidate.full_name or candidate.email), '',
+             'New jobs matching your profile on Shadab Manpowers:', '']
+    for alert in alerts[:DIGEST_MAX_JOBS]:
+        job = alert.job
+        lines.append('- {} {}{}'.format(job.headline, '({}) '.format(job.city) if job.city_id else '',
+                                        site_url + reverse('portal:job_details', args=[job.id])))
+    if len(alerts) > DIGEST_MAX_JOBS:
+        lines.append('and {} more'.format(len(alerts) - DIGEST_MAX_JOBS))
+    subject = '{} new job{} for you'.format(len(alerts), '' if len(alerts) == 1 else 's')
+    return OutgoingEmail(subject=subject, body='\n'.join(lines), to=candidate.email,
+                         from_email=settings.EMAIL_HOST_USER or settings.DEFAULT_FROM_EMAIL)
+
+
+def due_candidate_ids(now, after_id, batch_size):
+    recently_alerted = JobAlert.objects.filter(sent_on__gt=now - digest_interval()).values('candidate_id')
+    return list(JobAlert.objects.filter(sent_on__isnull=True, candidate_id__gt=after_id)
+                .exclude(candidate_id__in=recently_alerted).order_by('candidate_id')
+                .values_list('candidate_id', flat=True).distinct()[:batch_size])
+
+
+def queue_digests(batch_size=DEFAULT_BATCH_SIZE):
+    # one digest per due candidate, queued into the OutgoingEmail outbox which retries a failed address with
+    # backoff and dead letters it, so one bad address never holds back the others; returns the digests queued
+    site_url = getattr(settings, 'JOB_ALERT_SITE_URL', '').rstrip('/')
+    now = timezone.now()
+    queued = last_id = 0
+    while True:
+        candidate_ids = due_candidate_ids(now, last_id, batch_size)
+        if not candidate_ids:
+            return queued
+        last_id = candidate_ids[-1]
+        alerts = {}
+        for alert in JobAlert.objects.filter(sent_on__isnull=True, candidate_id__in=candidate_ids) \
+                .select_related('candidate', 'job', 'job__city').order_by('candidate_id', '-job__posted_on'):
+            alerts.setdefault(alert.candidate_id, []).append(alert)
+        # the digests and their sent_on mark are committed together, a crash neither loses nor repeats one
+        with transaction.atomic():
+            OutgoingEmail.objects.bulk_create(
+                [digest_email(candidate_alerts[0].candidate, candidate_alerts, site_url)
+                 for candidate_alerts in alerts.values()])
+            for candidate_alerts in alerts.values():
+                JobAlert.objects.filter(id__in=[alert.id for alert in candidate_alerts]).update(sent_on=now)
+        queued += len(alerts)
@@ -1,21 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import connections, transaction
+from django.db.models.functions import Lower
+from .search_cache import LocalGenerations, bump_generation
+
+
+# expression indexes django 2.0 cannot declare on a model, created after migrate like the job search index
+LOGIN_INDEXES = (('auth_user_email_lower_idx', 'email'), ('auth_user_username_lower_idx', 'username'))
+USER_CACHE_TTL = 30
+USER_CACHE_MAX_ENTRIES = 10000
+# seconds a process trusts the generation of a cached user before reading the shared cache again,
+# a password change or deactivation is seen at once by the worker that saved it, by the others after at most this long
+USER_CHECK_INTERVAL = 5
+
+
+def create_login_indexes(connection):
+    table = connection.ops.quote_name(User._meta.db_table)
+    with connection.cursor() as cursor:
+        for name, column in LOGIN_INDEXES:
+            cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} (LOWER({}))'.format(
+                connection.ops.quote_name(name), table, connection.ops.quote_name(column)))
+
+
+def create_login_indexes_after_migrate(sender, using='default', *args, **kwargs):
+    if sender.label == 'auth':
+        create_login_indexes(connections[using])
+
+
+def find_login_users(username):
+    # one seek on the LOWER(email) or LOWER(username) index, usernames may hold an @ too
+    value = (username or '').strip().lower()
+    fields = ('email', 'username') if '@' in value else ('username',)
+    for field in fields:
+        users = list(User.objects.annotate(login_key=Lower(field)).filter(login_key=value).order_by('id'))
+        if users:
+            return users
+    return []
+
+
+def user_generation_name(user_id):
+    return 'user:{}'.format(user_id)
+
+
+class UserCache(object):
+    # process local {user id: (expiry, generation, field values)}, every hit builds a fresh User so requests
+    # share nothing, an entry cached under an older shared generation of its user is a miss
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._field_names = [field.attname for field in User._meta.concrete_fields]
+        self.generations = LocalGenerations(USER_CHECK_INTERVAL, max_entries)
+
+    def generation(self, user_id):
+        return self.generations.get(user_generation_name(user_id))
+
+    def get(self, user_id, generation):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != generation:
+                self.misses += 1
+                return None
+            self.hits += 1
+            db, values = entry[2]
+        return User.from_db(db, self._field_names, values)
+
+    def set(self, user, generation):
+        values = [getattr(user, name) for name in self._field_names]
+        with self._lock:
+            self._entries[user.pk] = (time.monotonic() + self.ttl, generation, (user._state.db, values))
+            self._entries.move_to_end(user.pk)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.generations.clear()
+
+
+user_cache = UserCache()
+
+
+def invalidate_cached_user(instance, *args, **kwargs):
+    # any save, a new password or is_active toggled included, drops the cached copy of this process now
+    # and, once committed, moves the shared generation on so the other workers drop theirs too
+    user_id = instance.pk
+    name = user_generation_name(user_id)
+    user_cache.invalidate(user_id)
+
+    def committed():
+        bump_generation(name)
+        user_cache.generations.forget(name)
+        user_cache.invalidate(user_id)
+    transaction.on_commit(committed)
 
 
 class EmailAuthenticate(object):
 
     def authenticate(self, username=None, password=None, **kwargs):
-        try:
-            user = User.objects.get(Q(email=username) | Q(username=username))
-        except User.DoesNotExist:
+        users = find_login_users(username)
+        if not users:
+            # same hashing time as a wrong password, so unknown logins cannot be told apart
+            User().set_password(password)
             return None
 
-        if user.check_password(password):
-            return user
+        for user in users:
+            if user.check_password(password):
+                return user
         return None
 
     def get_user(self, user_id):
+        # the generation is read before the row, so a change committed in between leaves an entry that is already stale
+        generation = user_cache.generation(user_id)
+        user = user_cache.get(user_id, generation)
+        if user is not None:
+            return user
         try:
-            return User.objects.get(pk=user_id)
+            user = User.objects.get(pk=user_id)
         except User.DoesNotExist:
             return None
+        user_cache.set(user, generation)
+        return user
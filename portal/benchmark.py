@@ -0,0 +1,121 @@
+import math
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Candidate, Proposal, Recharge
+from recruiter.models import Recruiter, Job, CandidateLike
+from . import urls as portal_urls
+from recruiter import urls as recruiter_urls
+
+
+DEFAULT_REQUESTS = 20
+# GETs that change state or need a signed token, they are not replayed
+SKIPPED_URLS = {
+    'portal:logout', 'portal:activate', 'portal:password_reset_confirm', 'portal:recharge_make',
+    'recruiter:logout', 'recruiter:activate', 'recruiter:candidate_like', 'recruiter:candidate_unlike',
+    'recruiter:recharge_make',
+}
+
+
+def table_sizes():
+    return {model._meta.label_lower: model.objects.count()
+            for model in (User, Candidate, Recruiter, Job, Proposal, CandidateLike, Recharge)}
+
+
+def percentile(values, percent):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(percent / 100 * len(ordered))) - 1, 0)]
+
+
+def benchmark_users(prefix=''):
+    # the busiest subscribed candidate and recruiter, with the objects their urls point at
+    candidate = Candidate.objects.filter(user__username__startswith=prefix, recharge_validity__isnull=False) \
+        .select_related('user').order_by('-proposals_sent_count', 'id').first()
+    recruiter = Recruiter.objects.filter(user__username__startswith=prefix, recharge_validity__isnull=False) \
+        .select_related('user').order_by('-proposals_received_count', 'id').first()
+    if candidate is None or recruiter is None:
+        return None
+    sent = Proposal.objects.filter(posted_by=candidate).order_by('id').first()
+    received = Proposal.objects.filter(job__posted_by=recruiter).order_by('id').first()
+    job = recruiter.job_set.order_by('id').first()
+    return {
+        'portal': (candidate.user, {'candidate': candidate, 'job': sent.job if sent else job, 'proposal': sent}),
+        'recruiter': (recruiter.user, {'candidate': candidate, 'job': job, 'proposal': received}),
+    }
+
+
+def url_kwargs(name, groups, objects):
+    # job_id -> objects['job'].pk, and pk of job_details -> objects['job'].pk
+    kwargs = {}
+    for group in groups:
+        obj = objects.get(name.split('_')[0] if group == 'pk' else group[:-len('_id')])
+        if obj is None:
+            return None
+        kwargs[group] = obj.pk
+    return kwargs
+
+
+def benchmark_urls(users):
+    # (url name, path, user) of every named url of both apps
+    for namespace, module in (('portal', portal_urls), ('recruiter', recruiter_urls)):
+        user, objects = users[namespace]
+        for pattern in module.urlpatterns:
+            name = '{}:{}'.format(namespace, pattern.name)
+            if not pattern.name or name in SKIPPED_URLS:
+                continue
+            kwargs = url_kwargs(pattern.name, pattern.pattern.regex.groupindex, objects)
+            if kwargs is not None:
+                yield name, reverse(name, kwargs=kwargs), user
+
+
+def benchmark_client(user):
+    # logged in as user, and allowed to scrape /metrics
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    client = Client(**({'HTTP_AUTHORIZATION': 'Bearer {}'.format(token)} if token else {}))
+    client.force_login(user)
+    return client
+
+
+def timed_get(client, path):
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(path)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+    return response.status_code, (time.perf_counter() - start) * 1000, len(queries)
+
+
+def run_benchmark(requests=DEFAULT_REQUESTS, prefix=''):
+    # {url name: latency percentiles and query counts}, one warm up request per url is not counted.
+    # call within setup_test_environment(), the test client needs 'testserver' in ALLOWED_HOSTS
+    users = benchmark_users(prefix)
+    if users is None:
+        return None
+    results = {}
+    clients = {}
+    for name, path, user in benchmark_urls(users):
+        if user.pk not in clients:
+            clients[user.pk] = benchmark_client(user)
+        client = clients[user.pk]
+        try:
+            timed_get(client, path)
+        except Exception as error:
+            # a broken view is reported, the others are still measured
+            results[name] = {'path': path, 'error': '{}: {}'.format(type(error).__name__, error)}
+            continue
+        samples = [timed_get(client, path) for i in range(requests)]
+        latencies = [ms for status, ms, queries in samples]
+        query_counts = [queries for status, ms, queries in samples]
+        results[name] = {
+            'path': path, 'status': samples[-1][0], 'requests': requests,
+            'p50_ms': round(percentile(latencies, 50), 3), 'p95_ms': round(percentile(latencies, 95), 3),
+            'max_ms': round(max(latencies), 3), 'queries': percentile(query_counts, 50),
+            'max_queries': max(query_counts),
+        }
+    return results
@@ -0,0 +1,262 @@
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+
+try:
+    import fcntl
+except ImportError:  # windows, only the single process dev server runs there
+    fcntl = None
+
+
+# every facet lives in its own file: a header, then one row of bits per value id,
+# bit n of a row is set when the item (candidate) with id n has that value
+HEADER = struct.Struct('<4sII')
+MAGIC = b'BMX1'
+ALL = 'all'
+
+
+def bits_to_ids(bits):
+    ids = []
+    digits = bin(bits)[:1:-1]
+    position = digits.find('1')
+    while position != -1:
+        ids.append(position)
+        position = digits.find('1', position + 1)
+    return ids
+
+
+def _grow(size, needed):
+    while size < needed:
+        size *= 2
+    return size
+
+
+class BitmapIndex(object):
+
+    def __init__(self, name, facets):
+        self.name = name
+        self.facets = (ALL,) + tuple(facets)
+        self._maps = {}
+
+    @property
+    def directory(self):
+        return getattr(settings, 'BITMAP_INDEX_DIR', os.path.join(settings.BASE_DIR, 'bitmap_index'))
+
+    def path(self, facet):
+        return os.path.join(self.directory, '{}_{}.bitmap'.format(self.name, facet))
+
+    def exists(self):
+        return all(os.path.exists(self.path(facet)) for facet in self.facets)
+
+    def _map(self, facet):
+        # reopen when another process replaced the file with a bigger one, or BITMAP_INDEX_DIR changed
+        path = self.path(facet)
+        key = (path, os.stat(path).st_ino)
+        cached = self._maps.get(facet)
+        if cached is None or cached[0] != key:
+            if cached is not None:
+                cached[1].close()
+            with open(path, 'r+b') as index_file:
+                mapped = mmap.mmap(index_file.fileno(), 0)
+            cached = (key, mapped)
+            self._maps[facet] = cached
+        mapped = cached[1]
+        magic, row_bytes, rows = HEADER.unpack_from(mapped, 0)
+        return mapped, row_bytes, rows
+
+    @contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.directory, '{}.lock'.format(self.name)), 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _write_file(self, facet, row_bytes, rows):
+        # rows is a list of bytes-like of length row_bytes, written next to the old file then swapped in
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as index_file:
+            index_file.write(HEADER.pack(MAGIC, row_bytes, len(rows)))
+            for row in rows:
+                index_file.write(row)
+        os.replace(temp_path, self.path(facet))
+
+    def row(self, facet, value):
+        mapped, row_bytes, rows = self._map(facet)
+        if value is None or value >= rows:
+            return 0
+        start = HEADER.size + value * row_bytes
+        return int.from_bytes(mapped[start:start + row_bytes], 'little')
+
+    def all_of(self, facet, values):
+        bits = self.row(ALL, 0)
+        for value in values:
+            bits &= self.row(facet, value)
+        return bits
+
+    def any_of(self, facet, values):
+        bits = 0
+        for value in values:
+            bits |= self.row(facet, value)
+        return bits
+
+    def _ensure_capacity(self, facet, value, item_id):
+        mapped, row_bytes, rows = self._map(facet)
+        if value < rows and item_id < row_bytes * 8:
+            return
+        new_row_bytes = _grow(row_bytes, item_id // 8 + 1)
+        new_rows = _grow(max(rows, 1), value + 1)
+        old_rows = [mapped[HEADER.size + i * row_bytes:HEADER.size + (i + 1) * row_bytes] for i in range(rows)]
+        padding = bytes(new_row_bytes - row_bytes)
+        self._write_file(facet, new_row_bytes,
+                         [old + padding for old in old_rows] + [bytes(new_row_bytes)] * (new_rows - rows))
+
+    def set(self, facet, value, item_ids, on=True):
+        if value is None or not self.exists():
+            return
+        with self._write_lock():
+            for item_id in item_ids:
+                self._ensure_capacity(facet, value, item_id)
+                mapped, row_bytes, rows = self._map(facet)
+                position = HEADER.size + value * row_bytes + item_id // 8
+                mask = 1 << (item_id % 8)
+                mapped[position] = mapped[position] | mask if on else mapped[position] & ~mask & 0xff
+
+    def clear_item(self, facet, item_id):
+        if not self.exists():
+            return
+        with self._write_lock():
+            mapped, row_bytes, rows = self._map(facet)
+            if item_id >= row_bytes * 8:
+                return
+            mask = ~(1 << (item_id % 8)) & 0xff
+            for value in range(rows):
+                position = HEADER.size + value * row_bytes + item_id // 8
+                mapped[position] &= mask
+
+    def clear_value(self, facet, value):
+        if not self.exists():
+            return
+        with self._write_lock():
+            mapped, row_bytes, rows = self._map(facet)
+            if value < rows:
+                start = HEADER.size + value * row_bytes
+                mapped[start:start + row_bytes] = bytes(row_bytes)
+
+    def build(self, facet, pairs):
+        # pairs of (value id, item id), replaces the whole facet file
+        pairs = [(value, item_id) for value, item_id in pairs if value is not None]
+        row_bytes = _grow(64, max([item_id for value, item_id in pairs] + [0]) // 8 + 1)
+        rows = [bytearray(row_bytes) for i in range(max([value for value, item_id in pairs] + [0]) + 1)]
+        for value, item_id in pairs:
+            rows[value][item_id // 8] |= 1 << (item_id % 8)
+        with self._write_lock():
+            self._write_file(facet, row_bytes, rows)
+
+
+class CandidateBitmapIndex(BitmapIndex):
+    # filter name -> facet, only filter sets limited to these can be answered from the index
+    filter_facets = {'skills': 'skill', 'without_skills': 'skill', 'roles': 'role',
+                     'city': 'city', 'qualification': 'qualification'}
+
+    def __init__(self):
+        super().__init__('candidate', ('skill', 'role', 'city', 'qualification'))
+
+    def rebuild(self):
+        from portal.models import Candidate
+        os.makedirs(self.directory, exist_ok=True)
+        candidates = list(Candidate.objects.values_list('id', 'city_id', 'qualification_id'))
+        self.build(ALL, [(0, pk) for pk, city_id, qualification_id in candidates])
+        self.build('city', [(city_id, pk) for pk, city_id, qualification_id in candidates])
+        self.build('qualification', [(qualification_id, pk) for pk, city_id, qualification_id in candidates])
+        self.build('skill', Candidate.skills.through.objects.values_list('skill_id', 'candidate_id'))
+        self.build('role', Candidate.roles.through.objects.values_list('role_id', 'candidate_id'))
+        return len(candidates)
+
+    def match_filterset(self, filterset):
+        # ordered candidate ids, or None when some active filter is not indexed
+        if not self.exists() or not filterset.is_bound or not filterset.form.is_valid():
+            return None
+        data = filterset.form.cleaned_data
+        active = dict((name, value) for name, value in data.items() if value not in (None, '') and
+                      (not hasattr(value, '__iter__') or len(value)))
+        if any(name not in self.filter_facets for name in active):
+            return None
+        bits = self.all_of('skill', [skill.pk for skill in active.get('skills', [])])
+        if active.get('roles'):
+            bits &= self.any_of('role', [role.pk for role in active['roles']])
+        if active.get('city'):
+            bits &= self.row('city', active['city'].pk)
+        if active.get('qualification'):
+            bits &= self.row('qualification', active['qualification'].pk)
+        if active.get('without_skills'):
+            bits &= ~self.any_of('skill', [skill.pk for skill in active['without_skills']])
+        return tuple(bits_to_ids(bits))
+
+
+candidate_bitmap_index = CandidateBitmapIndex()
+
+
+# the files are outside the database transaction, the signal handlers below only touch them
+# once the change is committed, so a rolled back save leaves no bits behind. the values are
+# taken when the signal fires, the instance may have changed or lost its pk by the commit
+
+def _update_candidate(pk, city_id, qualification_id):
+    if not candidate_bitmap_index.exists():
+        return
+    candidate_bitmap_index.set(ALL, 0, [pk])
+    for facet, value in (('city', city_id), ('qualification', qualification_id)):
+        candidate_bitmap_index.clear_item(facet, pk)
+        candidate_bitmap_index.set(facet, value, [pk])
+
+
+def _remove_candidate(pk):
+    for facet in candidate_bitmap_index.facets:
+        candidate_bitmap_index.clear_item(facet, pk)
+
+
+def index_candidate(instance, sender, *args, **kwargs):
+    pk, city_id, qualification_id = instance.pk, instance.city_id, instance.qualification_id
+    transaction.on_commit(lambda: _update_candidate(pk, city_id, qualification_id))
+
+
+def unindex_candidate(instance, sender, *args, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: _remove_candidate(pk))
+
+
+def _update_candidate_m2m(facet, pk, action, reverse, pk_set):
+    if not candidate_bitmap_index.exists():
+        return
+    if action == 'post_clear':
+        if reverse:
+            candidate_bitmap_index.clear_value(facet, pk)
+        else:
+            candidate_bitmap_index.clear_item(facet, pk)
+    elif reverse:
+        # skill.candidate_set.add(...), pk_set holds candidate ids
+        candidate_bitmap_index.set(facet, pk, pk_set, on=action == 'post_add')
+    else:
+        for value in pk_set:
+            candidate_bitmap_index.set(facet, value, [pk], on=action == 'post_add')
+
+
+def index_candidate_m2m(facet):
+    def handler(instance, action, reverse, pk_set, *args, **kwargs):
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        pk, pk_set = instance.pk, set(pk_set or ())
+        transaction.on_commit(lambda: _update_candidate_m2m(facet, pk, action, reverse, pk_set))
+    return handler
+
+
+index_candidate_skills = index_candidate_m2m('skill')
+index_candidate_roles = index_candidate_m2m('role')
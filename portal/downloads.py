@@ -0,0 +1,116 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ChunkedFileResponse(FileResponse):
+    # FileResponse reads 4 KB at a time, fewer bigger reads when no wsgi.file_wrapper takes over
+    block_size = 64 * 1024
+
+
+class RangeFile(object):
+    # read() of one byte range of a file, without fileno() so file_wrapper implementations fall back to read()
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    # (start, end) of a single byte range, None to ignore the header, False for an unsatisfiable range
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # the last n bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _attachment(response, filename, content_type, etag=None, last_modified=None):
+    response['Content-Type'] = content_type
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename.replace('"', ''))
+    # only the user allowed to see the file may cache it
+    response['Cache-Control'] = 'private, max-age=3600'
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def protected_file_response(request, storage, name, filename):
+    # call only after the access check: hands the transfer to the front-end server when
+    # SENDFILE_BACKEND is set, streams it from python with Range and conditional GET support otherwise
+    path = storage.path(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    backend = getattr(settings, 'SENDFILE_BACKEND', None)
+    if backend == 'x-accel-redirect':
+        # nginx: an internal location aliased to MEDIA_ROOT, it answers ranges and conditionals itself
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL.rstrip('/') + '/' + name
+        return _attachment(response, filename, content_type)
+    if backend == 'x-sendfile':
+        # apache mod_xsendfile and lighttpd
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return _attachment(response, filename, content_type)
+
+    stat = os.stat(path)
+    last_modified = int(stat.st_mtime)
+    # content addressed names are the hash of the file, a strong validator without reading it
+    etag = quote_etag(os.path.splitext(os.path.basename(name))[0] + '-' + str(stat.st_size))
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    byte_range = None
+    if request.method == 'GET' and 'HTTP_RANGE' in request.META and _if_range_passes(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+        return response
+    if byte_range is None:
+        response = ChunkedFileResponse(open(path, 'rb'))
+        response['Content-Length'] = stat.st_size
+    else:
+        start, end = byte_range
+        response = ChunkedFileResponse(RangeFile(open(path, 'rb'), start, end - start + 1), status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, stat.st_size)
+    response['Accept-Ranges'] = 'bytes'
+    return _attachment(response, filename, content_type, etag, last_modified)
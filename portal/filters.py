@@ -1,15 +1,75 @@
+import hashlib
 import django_filters
-from recruiter.models import Job
+from django.core.cache import cache
+from django.db.models import Count
+from recruiter.models import Job, JOB_TYPE_CHOICES
 from portal.models import Qualification
+from .reference_data import REFERENCE_FILTER_OVERRIDES
+from .search import search_jobs
+from .search_cache import normalize_filter_params, get_generation
+
+
+JOB_FACET_FIELDS = ('role', 'industry', 'city', 'experience', 'job_type')
+JOB_FACET_CACHE_TIMEOUT = 60
+
+
+def filter_cache_key(prefix, filterset, generation):
+    digest = hashlib.md5(repr(normalize_filter_params(filterset)).encode('utf-8')).hexdigest()
+    return '{}:{}:{}'.format(prefix, generation, digest)
 
 
 class JobFilter(django_filters.FilterSet):
 
     paginate_by = 1
+    q = django_filters.CharFilter(label='keywords', method='filter_keywords')
     salary_from = django_filters.NumberFilter(label='salary from', field_name='salary_from', lookup_expr='gte')
     salary_upto = django_filters.NumberFilter(label='salary upto', field_name='salary_upto', lookup_expr='lte')
+    experience_years = django_filters.NumberFilter(label='years of experience', method='filter_experience_years')
 
     class Meta:
         model = Job
         fields = ['role', 'industry', 'city', 'experience', 'salary_from', 'salary_upto']
+        filter_overrides = REFERENCE_FILTER_OVERRIDES
         paginate_by = 1
+
+    def filter_keywords(self, queryset, name, value):
+        return search_jobs(queryset, value)
+
+    def filter_experience_years(self, queryset, name, value):
+        # jobs whose required experience range contains the given years
+        return queryset.filter(experience_min__lte=value, experience_max__gte=value)
+
+    def get_facets(self):
+        # {facet: {value: number of matching jobs}}, one GROUP BY query per facet
+        key = filter_cache_key('portal:job_facets', self, get_generation('job'))
+        facets = cache.get(key)
+        if facets is None:
+            queryset = self.qs.order_by()
+            facets = {}
+            for field in JOB_FACET_FIELDS:
+                facets[field] = dict(queryset.values_list(field).annotate(total=Count('id')).order_by())
+            cache.set(key, facets, JOB_FACET_CACHE_TIMEOUT)
+        return facets
+
+    @property
+    def facets(self):
+        if not hasattr(self, '_facets'):
+            self._facets = self.get_facets()
+        return self._facets
+
+    @property
+    def job_type_facets(self):
+        counts = self.facets['job_type']
+        return [(label, counts[value]) for value, label in JOB_TYPE_CHOICES if counts.get(value)]
+
+    def add_facet_counts(self):
+        # show the number of matching jobs next to every dropdown option
+        facets = self.facets
+        for name in ('role', 'industry', 'city'):
+            field = self.form.fields[name]
+            counts = facets[name]
+            field.label_from_instance = lambda obj, counts=counts: '{} ({})'.format(obj, counts.get(obj.pk, 0))
+        field = self.form.fields['experience']
+        counts = facets['experience']
+        field.choices = [(value, '{} ({})'.format(label, counts.get(value, 0)) if value else label)
+                         for value, label in field.choices]
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import Candidate, Proposal, Skill, Role, Industry, City, Qualification
+from .reference_data import CachedModelMultipleChoiceField, REFERENCE_FIELD_CLASSES
 
 
 class SignUpForm(UserCreationForm):
@@ -14,8 +15,8 @@ class SignUpForm(UserCreationForm):
 
 class UpdateProfileForm(forms.ModelForm):
 
-    skills = forms.ModelMultipleChoiceField(required=False, queryset=Skill.objects.all())
-    roles = forms.ModelMultipleChoiceField(required=False, queryset=Role.objects.all())
+    skills = CachedModelMultipleChoiceField(required=False, queryset=Skill.objects.all())
+    roles = CachedModelMultipleChoiceField(required=False, queryset=Role.objects.all())
     address = forms.CharField(required=False, widget=forms.Textarea(attrs={'rows': 4, 'cols': 40}))
     details = forms.CharField(required=False, widget=forms.Textarea(attrs={'rows': 4, 'cols': 40}))
     resume = forms.FileField(required=False, widget=forms.FileInput(), label='Upload New')
@@ -40,11 +41,12 @@ class UpdateProfileForm(forms.ModelForm):
             self.fields["details"].initial = candidate.details
             self.fields["address"].initial = candidate.address
             if candidate.resume:
-                self.fields["resume"].initial = candidate.resume.file
+                self.fields["resume"].initial = candidate.resume
 
     class Meta:
         model = Candidate
         exclude = ['email', 'user', 'email_confirmed', 'last_recharge', 'recharge_validity']
+        field_classes = REFERENCE_FIELD_CLASSES
 
 
 class ProposalForm(forms.ModelForm):
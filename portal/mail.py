@@ -0,0 +1,108 @@
+import uuid
+from django.conf import settings
+from django.contrib.auth.forms import PasswordResetForm
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.template import loader
+from django.utils import timezone
+from .models import OutgoingEmail
+
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+# a failed message waits RETRY_BASE_SECONDS * 2 ** (attempts - 1), but never more than RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 60 * 60
+# a row still claimed after this long belongs to a worker that died mid-batch, it is claimed again
+CLAIM_TIMEOUT_SECONDS = 15 * 60
+
+
+def queue_mail(subject, message, recipient_list, from_email=None, html_message=None):
+    # the request only pays for an INSERT, the send_queued_mail worker talks to the mail server
+    return OutgoingEmail.objects.create(
+        subject=subject, body=message, html_body=html_message or '', to='\n'.join(recipient_list),
+        from_email=from_email or settings.EMAIL_HOST_USER or settings.DEFAULT_FROM_EMAIL)
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    # same emails as the stock form, queued instead of sent from the request
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = loader.render_to_string(html_email_template_name, context) if html_email_template_name else None
+        queue_mail(subject, body, [to_email], from_email=from_email, html_message=html_body)
+
+
+def retry_delay(attempts):
+    return timezone.timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.recipients,
+                                     connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _failed(email, error, max_attempts, now):
+    email.attempts += 1
+    email.last_error = '{}: {}'.format(type(error).__name__, error)
+    if email.attempts >= max_attempts:
+        # dead letters stay in the table for the admin to inspect and requeue
+        email.status = OutgoingEmail.DEAD
+    else:
+        email.status = OutgoingEmail.QUEUED
+        email.next_attempt_on = now + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_on'])
+
+
+def claim_batch(batch_size, now):
+    # the UPDATE only takes rows that are still claimable, so two workers never get the same message
+    claimable = Q(status=OutgoingEmail.QUEUED, next_attempt_on__lte=now) | \
+        Q(status=OutgoingEmail.SENDING, claimed_on__lt=now - timezone.timedelta(seconds=CLAIM_TIMEOUT_SECONDS))
+    ids = list(OutgoingEmail.objects.filter(claimable).order_by('next_attempt_on', 'id')
+               .values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    OutgoingEmail.objects.filter(claimable, id__in=ids).update(
+        status=OutgoingEmail.SENDING, claimed_by=token, claimed_on=now)
+    return list(OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING, claimed_by=token)
+                .order_by('next_attempt_on', 'id'))
+
+
+def send_queued(batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS, connection=None):
+    # sends one batch of due messages over a single connection, returns (sent, failed)
+    now = timezone.now()
+    batch = claim_batch(batch_size, now)
+    if not batch:
+        return 0, 0
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        # mail server unreachable, the whole batch backs off
+        for email in batch:
+            _failed(email, error, max_attempts, now)
+        return 0, len(batch)
+    sent = failed = 0
+    try:
+        for email in batch:
+            try:
+                build_message(email, connection).send()
+            except Exception as error:
+                _failed(email, error, max_attempts, now)
+                failed += 1
+            else:
+                email.attempts += 1
+                email.status = OutgoingEmail.SENT
+                email.sent_on = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['attempts', 'status', 'sent_on', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
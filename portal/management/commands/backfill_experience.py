@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from portal.models import Candidate, backfill_experience_ranges
+from recruiter.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Fill experience_min/experience_max of candidates and jobs from their experience bucket'
+
+    def handle(self, *args, **options):
+        for model in (Candidate, Job):
+            updated = backfill_experience_ranges(model)
+            self.stdout.write(self.style.SUCCESS('Updated {} {}'.format(updated, model._meta.verbose_name_plural)))
@@ -0,0 +1,62 @@
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from portal.models import Candidate, Package, Recharge
+from portal.recharge import make_recharge
+
+
+class Command(BaseCommand):
+    help = 'Fire parallel recharges at one throwaway candidate and check that no validity extension is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--recharges', type=int, default=25, help='recharges per thread')
+        parser.add_argument('--days', type=int, default=30, help='validity days of the package')
+
+    def handle(self, *args, **options):
+        threads, recharges, days = options['threads'], options['recharges'], options['days']
+        user = User.objects.create(username='recharge-benchmark-{}'.format(int(time.time() * 1000)))
+        Candidate.objects.create(user=user, full_name='Recharge Benchmark')
+        package = Package.objects.create(name='Recharge Benchmark', available=False, user_type='Candidate', price=0,
+                                         validity_days=days, description='benchmark_recharges')
+        start = timezone.now() + timezone.timedelta(days=1)
+        Candidate.objects.filter(user=user).update(recharge_validity=start)
+        errors = []
+
+        def recharge_in_thread():
+            try:
+                thread_user = User.objects.select_related('candidate').get(pk=user.pk)
+                for i in range(recharges):
+                    make_recharge(thread_user, package)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=recharge_in_thread) for i in range(threads)]
+        began = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+
+        try:
+            made = Recharge.objects.filter(user=user).count()
+            validity = Candidate.objects.filter(user=user).values_list('recharge_validity', flat=True).get()
+            expected = start + timezone.timedelta(days=days * made)
+            self.stdout.write('{} recharges from {} threads in {:.2f}s ({:.0f}/s), {} failed'.format(
+                made, threads, elapsed, made / elapsed if elapsed else 0, len(errors)))
+            for error in errors[:5]:
+                self.stdout.write('  {}: {}'.format(type(error).__name__, error))
+            if validity != expected:
+                raise CommandError('validity is {}, expected {}: {} days lost'.format(
+                    validity, expected, (expected - validity).days))
+            self.stdout.write(self.style.SUCCESS('validity {} matches all {} recharges'.format(validity, made)))
+        finally:
+            Candidate.objects.filter(user=user).delete()
+            user.delete()
+            package.delete()
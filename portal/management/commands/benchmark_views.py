@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from portal.benchmark import run_benchmark, table_sizes, DEFAULT_REQUESTS
+from portal.synthetic import SYNTHETIC_PREFIX
+
+
+class Command(BaseCommand):
+    help = 'Request every url of both apps through the test client and report latency and queries per view as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='timed requests per url')
+        parser.add_argument('--prefix', default=SYNTHETIC_PREFIX, help='username prefix of the seed_synthetic users')
+        parser.add_argument('--output', help='write the report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        # the test environment also swaps in the locmem email backend, nothing is sent
+        setup_test_environment()
+        try:
+            # the replayed requests are not traffic, they stay out of the /metrics counters
+            with override_settings(METRICS_DIR=None, METRICS_TOKEN='benchmark'):
+                views = run_benchmark(requests=options['requests'], prefix=options['prefix'])
+        finally:
+            teardown_test_environment()
+        if views is None:
+            raise CommandError('no subscribed candidate and recruiter named {}*, run seed_synthetic first'.format(
+                options['prefix']))
+        report = json.dumps({'database': connection.vendor, 'sizes': table_sizes(), 'requests': options['requests'],
+                             'views': views}, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,20 @@
+import os
+from django.core.management.base import BaseCommand
+from portal.recommendations import compute_recommendations, DEFAULT_TOP, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Compute the top recommended jobs of every candidate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='jobs to keep per candidate')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='candidates per work unit')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='worker processes')
+        parser.add_argument('--incremental', action='store_true',
+                            help='only candidates changed and jobs posted since the last run')
+
+    def handle(self, *args, **options):
+        run = compute_recommendations(top=options['top'], chunk_size=options['chunk_size'],
+                                      processes=options['processes'], incremental=options['incremental'])
+        self.stdout.write(self.style.SUCCESS('{} recommendations for {} candidates in {}'.format(
+            'Incremental' if run.incremental else 'Full', run.candidates, run.finished_on - run.started_on)))
@@ -0,0 +1,21 @@
+import os
+from django.core.management.base import BaseCommand
+from portal.resume_text import extract_pending, reset_resume_texts, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Extract the text of new and changed resumes and index it for candidate search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='candidates per batch')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='extraction processes')
+        parser.add_argument('--backfill', action='store_true',
+                            help='relink and reindex every candidate, reusing the texts already extracted')
+        parser.add_argument('--reextract', action='store_true', help='with --backfill, extract every file again')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            reset_resume_texts(reextract=options['reextract'])
+        candidates, extracted = extract_pending(batch_size=options['batch_size'], processes=options['processes'])
+        self.stdout.write(self.style.SUCCESS('Updated {} candidates, extracted {} files'.format(
+            candidates, extracted)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from portal.resumes import collect_garbage, collect_untracked, recount_resume_refs, DEFAULT_GRACE
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored resumes no candidate references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=DEFAULT_GRACE.total_seconds() / 3600,
+                            help='keep unreferenced files younger than this')
+        parser.add_argument('--recount', action='store_true', help='recount the references from the candidates first')
+        parser.add_argument('--untracked', action='store_true',
+                            help='also walk the resume directory for files without a reference count')
+
+    def handle(self, *args, **options):
+        grace = timezone.timedelta(hours=options['grace_hours'])
+        if options['recount']:
+            self.stdout.write('Fixed {} reference counts'.format(recount_resume_refs()))
+        deleted = collect_garbage(grace)
+        if options['untracked']:
+            deleted += collect_untracked(grace)
+        self.stdout.write(self.style.SUCCESS('Deleted {} resumes'.format(deleted)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from portal.bitmap_index import candidate_bitmap_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the memory mapped skill/role/city/qualification bitmaps of candidates'
+
+    def handle(self, *args, **options):
+        count = candidate_bitmap_index.rebuild()
+        self.stdout.write(self.style.SUCCESS('Indexed {} candidates into {}'.format(
+            count, candidate_bitmap_index.directory)))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from portal.search import rebuild_job_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of jobs'
+
+    def handle(self, *args, **options):
+        count = rebuild_job_index()
+        self.stdout.write(self.style.SUCCESS('Indexed {} jobs'.format(count)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recruiter.models import COUNTERS
+
+
+class Command(BaseCommand):
+    help = 'Recount the stored activity counters and repair the ones that drifted'
+
+    def handle(self, *args, **options):
+        for model, field, counted_model, lookup in COUNTERS:
+            actual = counted_model.objects.filter(**{lookup: OuterRef('pk')}).order_by() \
+                .values(lookup).annotate(total=Count('pk')).values('total')
+            drifted = model.objects.annotate(actual=Coalesce(Subquery(actual, output_field=IntegerField()), 0)) \
+                .exclude(**{field: F('actual')})
+            fixed = 0
+            for pk, value in drifted.values_list('pk', 'actual'):
+                fixed += model.objects.filter(pk=pk).update(**{field: value})
+            self.stdout.write(self.style.SUCCESS('Fixed {} {}.{}'.format(fixed, model._meta.model_name, field)))
@@ -0,0 +1,34 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from portal.models import Role, Skill, Industry, Qualification, City
+from portal.reference_data import invalidate_reference_data
+from portal.search_cache import bump_generation
+from portal.synthetic import seed, DEFAULT_SIZES, DEFAULT_CHUNK_SIZE, SYNTHETIC_PASSWORD, SYNTHETIC_PREFIX
+
+
+class Command(BaseCommand):
+    help = 'Bulk create synthetic users, candidates, recruiters, jobs, proposals, likes and recharges for load testing'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument('--{}'.format(name), type=int, default=default)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per bulk insert')
+        parser.add_argument('--prefix', default=SYNTHETIC_PREFIX,
+                            help='username prefix, must differ from the one of an earlier run')
+        parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed gives the same data')
+
+    def handle(self, *args, **options):
+        created = seed(prefix=options['prefix'], chunk_size=options['chunk_size'], random_seed=options['seed'],
+                       **{name: options[name] for name in DEFAULT_SIZES})
+        for label, count in created.items():
+            self.stdout.write('Created {} {}'.format(count, label))
+        # bulk_create skips the signals keeping counters, indexes and caches up to date
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_job_index', stdout=self.stdout)
+        call_command('rebuild_candidate_bitmap_index', stdout=self.stdout)
+        bump_generation('job')
+        bump_generation('candidate')
+        for model in (Role, Skill, Industry, Qualification, City):
+            invalidate_reference_data(model)
+        self.stdout.write(self.style.SUCCESS('Users are {}-c<n> and {}-r<n>, password "{}"'.format(
+            options['prefix'], options['prefix'], SYNTHETIC_PASSWORD)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from portal.alerts import match_new_jobs, queue_digests, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Match the newly posted jobs to candidates and queue the due job alert digests for send_queued_mail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='candidates whose digests are queued in one transaction')
+        parser.add_argument('--match-only', action='store_true', help='create the alerts without queueing digests')
+
+    def handle(self, *args, **options):
+        created = match_new_jobs()
+        queued = 0 if options['match_only'] else queue_digests(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} new alerts, {} digests queued'.format(created, queued)))
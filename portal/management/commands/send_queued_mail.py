@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from portal.mail import send_queued, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='messages sent over one mail server connection')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                            help='attempts before a message is marked dead')
+        parser.add_argument('--forever', action='store_true', help='keep polling the queue instead of exiting')
+        parser.add_argument('--interval', type=float, default=10, help='seconds between polls with --forever')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued(batch_size=options['batch_size'], max_attempts=options['max_attempts'])
+            total_sent += sent
+            total_failed += failed
+            if (sent or failed) and options['verbosity'] > 1:
+                self.stdout.write('Sent {}, failed {}'.format(sent, failed))
+            # a batch with no successes means the server is down or the due messages are exhausted
+            if not sent:
+                if not options['forever']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Sent {}, failed {}'.format(total_sent, total_failed)))
@@ -0,0 +1,154 @@
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from .models import Candidate
+from .search_cache import get_generation
+from .reference_data import attach_reference_data
+
+
+# weight of every criterion in the final score, they add up to 1, criteria the job leaves blank score 0
+MATCH_WEIGHTS = {'skills': 0.35, 'role': 0.2, 'qualification': 0.15, 'city': 0.15, 'industry': 0.05,
+                 'experience': 0.1}
+# experience fit drops by this much per year the candidate is outside the required range
+EXPERIENCE_PENALTY_PER_YEAR = 0.25
+MISSING = -1
+
+
+class CandidateSnapshot(object):
+    # columnar copy of the candidate features used for scoring, one row per candidate
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        rows = list(Candidate.objects.order_by('id').values_list(
+            'id', 'city_id', 'qualification_id', 'industry_id', 'experience_min', 'experience_max'))
+        self.size = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.ids = np.array(columns[0], dtype=np.int64)
+        self.city = self._column(columns[1])
+        self.qualification = self._column(columns[2])
+        self.industry = self._column(columns[3])
+        self.experience_min = self._column(columns[4])
+        self.experience_max = self._column(columns[5])
+        self.skill_ids, self.skill_rows = self._pairs(Candidate.skills.through.objects.values_list(
+            'candidate_id', 'skill_id'))
+        self.role_ids, self.role_rows = self._pairs(Candidate.roles.through.objects.values_list(
+            'candidate_id', 'role_id'))
+
+    @staticmethod
+    def _column(values):
+        return np.array([MISSING if value is None else value for value in values], dtype=np.int64)
+
+    def _pairs(self, pairs):
+        # m2m as two parallel arrays sorted by related id: related id, candidate row number
+        pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        rows = np.minimum(np.searchsorted(self.ids, pairs[:, 0]), max(self.size - 1, 0))
+        # drop rows of candidates created after the candidate list was read
+        known = self.ids[rows] == pairs[:, 0] if self.size else np.zeros(len(pairs), dtype=bool)
+        rows, values = rows[known], pairs[known, 1]
+        order = np.argsort(values, kind='mergesort')
+        return values[order], rows[order]
+
+    def _count_matches(self, values, rows, wanted):
+        # number of wanted ids every candidate has, reading only the slices of those ids
+        wanted = np.array(sorted(wanted), dtype=np.int64)
+        starts = np.searchsorted(values, wanted, side='left')
+        ends = np.searchsorted(values, wanted, side='right')
+        matched = [rows[start:end] for start, end in zip(starts, ends)]
+        if not matched:
+            return np.zeros(self.size)
+        return np.bincount(np.concatenate(matched), minlength=self.size).astype(np.float64)
+
+    def score(self, job, skill_ids, qualification_ids):
+        score = np.zeros(self.size)
+        if not self.size:
+            return score
+        if skill_ids:
+            score += MATCH_WEIGHTS['skills'] * (
+                self._count_matches(self.skill_ids, self.skill_rows, skill_ids) / len(skill_ids))
+        if job.role_id is not None:
+            score += MATCH_WEIGHTS['role'] * np.minimum(
+                self._count_matches(self.role_ids, self.role_rows, [job.role_id]), 1)
+        if qualification_ids:
+            score += MATCH_WEIGHTS['qualification'] * np.isin(
+                self.qualification, np.array(list(qualification_ids), dtype=np.int64))
+        if job.city_id is not None:
+            score += MATCH_WEIGHTS['city'] * (self.city == job.city_id)
+        if job.industry_id is not None:
+            score += MATCH_WEIGHTS['industry'] * (self.industry == job.industry_id)
+        if job.experience_min is not None:
+            known = self.experience_min != MISSING
+            # years between the candidate range and the job range, 0 when they overlap
+            gap = np.maximum(np.maximum(job.experience_min - self.experience_max,
+                                        self.experience_min - job.experience_max), 0)
+            fit = np.clip(1 - gap * EXPERIENCE_PENALTY_PER_YEAR, 0, 1)
+            score += MATCH_WEIGHTS['experience'] * np.where(known, fit, 0)
+        return score
+
+    def top(self, job, k=10, skill_ids=None, qualification_ids=None):
+        # [(candidate id, score)], best first, candidates scoring 0 left out
+        if skill_ids is None:
+            skill_ids = set(job.skills.values_list('id', flat=True))
+        if qualification_ids is None:
+            qualification_ids = set(job.qualifications.values_list('id', flat=True))
+        score = self.score(job, skill_ids, qualification_ids)
+        k = min(k, self.size)
+        if not k:
+            return []
+        best = np.argpartition(-score, k - 1)[:k]
+        best = best[np.lexsort((self.ids[best], -score[best]))]
+        return [(int(self.ids[row]), round(float(score[row]), 4)) for row in best if score[row] > 0]
+
+
+_snapshot = None
+_rebuilding = False
+_snapshot_lock = threading.Lock()
+
+
+def rebuild_candidate_snapshot(generation):
+    global _snapshot
+    snapshot = CandidateSnapshot(generation)
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def forget_candidate_snapshot():
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def _rebuild_in_background(generation):
+    global _rebuilding
+    try:
+        rebuild_candidate_snapshot(generation)
+    finally:
+        with _snapshot_lock:
+            _rebuilding = False
+        # the connections this thread opened
+        connections.close_all()
+
+
+def get_candidate_snapshot():
+    # built on the request path only the first time, after a change of the candidate search generation
+    # the old snapshot keeps answering while one thread per process builds the new one.
+    # without MATCHING_REBUILD_IN_BACKGROUND the request waits for the new snapshot
+    global _rebuilding
+    generation = get_generation('candidate')
+    with _snapshot_lock:
+        snapshot = _snapshot
+        stale = snapshot is not None and snapshot.generation != generation
+        if stale and not getattr(settings, 'MATCHING_REBUILD_IN_BACKGROUND', True):
+            snapshot = None
+        elif stale and not _rebuilding:
+            _rebuilding = True
+            threading.Thread(target=_rebuild_in_background, args=(generation,), daemon=True).start()
+    return snapshot if snapshot is not None else rebuild_candidate_snapshot(generation)
+
+
+def best_matches(job, k=10):
+    matches = get_candidate_snapshot().top(job, k)
+    candidates = Candidate.objects.in_bulk([pk for pk, score in matches])
+    attach_reference_data(candidates.values(), 'city', 'qualification')
+    return [(candidates[pk], score) for pk, score in matches if pk in candidates]
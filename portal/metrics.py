@@ -0,0 +1,307 @@
+import bisect
+import collections
+import hmac
+import ipaddress
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.db.models import Count
+
+try:
+    import fcntl
+except ImportError:  # windows, only the single process dev server runs there
+    fcntl = None
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'smp_'
+# seconds between two writes of the snapshot of a worker, /metrics lags behind by at most this long
+METRICS_FLUSH_INTERVAL = 1.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SNAPSHOT_NAME_RE = re.compile(r'^(\d+)-(\d+)\.json$')
+# the counters of the workers that are gone, added up so the totals never go down
+RETIRED_NAME = 'retired.json'
+RETIRE_LOCK_NAME = '.retire.lock'
+# headers a reverse proxy adds, a request carrying one is not trusted for its REMOTE_ADDR
+PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP', 'HTTP_FORWARDED')
+
+
+def metrics_directory():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+class Histogram(object):
+    # counts per bucket, the last one is +Inf, cumulated only when rendered
+
+    def __init__(self, buckets, counts=None, total=0.0):
+        self.buckets = buckets
+        self.counts = counts or [0] * (len(buckets) + 1)
+        self.sum = total
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, counts, total):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.sum += total
+
+
+def cache_stats():
+    # {cache: (hits, misses)} of the process local caches
+    from .backend import user_cache
+    from .reference_data import reference_data
+    from .search_cache import job_search_cache, candidate_search_cache
+    return {'job_search': (job_search_cache.hits, job_search_cache.misses),
+            'candidate_search': (candidate_search_cache.hits, candidate_search_cache.misses),
+            'user': (user_cache.hits, user_cache.misses),
+            'reference_data': (reference_data.hits, reference_data.loads)}
+
+
+class ProcessMetrics(object):
+    # the counters of one worker, written now and then to METRICS_DIR/<pid>-<start>.json,
+    # /metrics adds up the files of all workers
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.started = int(time.time() * 1000)
+        self.requests = collections.Counter()
+        self.latency = {}
+        self.queries = {}
+        self.flushed = 0.0
+
+    def _check_fork(self):
+        # a worker forked from a master that already counted starts from zero
+        if self.pid != os.getpid():
+            self._reset()
+
+    def observe_request(self, view, method, status, seconds, queries):
+        with self._lock:
+            self._check_fork()
+            self.requests[(view, method, str(status))] += 1
+            self.latency.setdefault(view, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault(view, Histogram(QUERY_BUCKETS)).observe(queries)
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'requests': [list(key) + [count] for key, count in self.requests.items()],
+                'latency': {view: [histogram.counts, histogram.sum] for view, histogram in self.latency.items()},
+                'queries': {view: [histogram.counts, histogram.sum] for view, histogram in self.queries.items()},
+                'caches': cache_stats(),
+            }
+
+    def path(self, directory):
+        return os.path.join(directory, '{}-{}.json'.format(self.pid, self.started))
+
+    def flush(self, directory=None, force=True):
+        directory = directory or metrics_directory()
+        if not directory or not force and time.monotonic() - self.flushed < METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed = time.monotonic()
+        _write_json(self.path(directory), self.snapshot())
+
+
+process_metrics = ProcessMetrics()
+
+
+def _write_json(path, data):
+    # readers only ever see a complete file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(prefix='.metrics-', dir=directory)
+    with os.fdopen(descriptor, 'w') as output:
+        json.dump(data, output)
+    os.replace(temporary, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as input_file:
+            return json.load(input_file)
+    except (OSError, ValueError):
+        return None
+
+
+def empty_snapshot():
+    return {'requests': [], 'latency': {}, 'queries': {}, 'caches': {}}
+
+
+def merge_snapshot(total, snapshot):
+    # adds the counters of snapshot to total, both in the json form written by ProcessMetrics.flush
+    requests = collections.Counter({tuple(row[:3]): row[3] for row in total['requests']})
+    for view, method, status, count in snapshot['requests']:
+        requests[(view, method, status)] += count
+    total['requests'] = [list(key) + [count] for key, count in requests.items()]
+    for key in ('latency', 'queries'):
+        for view, (counts, histogram_sum) in snapshot[key].items():
+            mine = total[key].get(view, [[0] * len(counts), 0.0])
+            total[key][view] = [[a + b for a, b in zip(mine[0], counts)], mine[1] + histogram_sum]
+    for cache, (hits, misses) in snapshot['caches'].items():
+        mine = total['caches'].get(cache, [0, 0])
+        total['caches'][cache] = [mine[0] + hits, mine[1] + misses]
+    return total
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # runs, as another user
+        pass
+    return True
+
+
+def worker_snapshots(directory):
+    # {snapshot file name: (pid, start)} of the workers that wrote to directory
+    snapshots = {}
+    for name in os.listdir(directory):
+        match = SNAPSHOT_NAME_RE.match(name)
+        if match:
+            snapshots[name] = (int(match.group(1)), int(match.group(2)))
+    return snapshots
+
+
+def _retire_dead_workers(directory, snapshots):
+    # merges the snapshots of the workers that are gone into RETIRED_NAME and removes them, returns the live ones.
+    # a worker is gone when its pid no longer runs, or runs a newer worker. METRICS_DIR is local to the host,
+    # so are the pids
+    latest = {}
+    for pid, started in snapshots.values():
+        latest[pid] = max(started, latest.get(pid, started))
+    dead = sorted(name for name, (pid, started) in snapshots.items()
+                  if started < latest[pid] or pid != os.getpid() and not _process_alive(pid))
+    if not dead:
+        return sorted(snapshots)
+    retired = _read_json(os.path.join(directory, RETIRED_NAME)) or dict(empty_snapshot(), workers=[])
+    # a file is only merged once, even when an earlier call stopped before removing it
+    retired['workers'] = [name for name in retired['workers'] if name in snapshots]
+    for name in dead:
+        snapshot = _read_json(os.path.join(directory, name))
+        if name not in retired['workers'] and snapshot is not None:
+            merge_snapshot(retired, snapshot)
+            retired['workers'].append(name)
+    _write_json(os.path.join(directory, RETIRED_NAME), retired)
+    for name in dead:
+        os.remove(os.path.join(directory, name))
+    return sorted(set(snapshots) - set(dead))
+
+
+def collect(directory=None):
+    # the snapshots of the live workers and the retired counters added up, with the number of live workers
+    directory = directory or metrics_directory()
+    total = empty_snapshot()
+    processes = 0
+    if directory and os.path.isdir(directory):
+        # one reader at a time, another one could retire a worker between reading RETIRED_NAME and its snapshot
+        with open(os.path.join(directory, RETIRE_LOCK_NAME), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            live = _retire_dead_workers(directory, worker_snapshots(directory))
+            for name in [RETIRED_NAME] + live:
+                snapshot = _read_json(os.path.join(directory, name))
+                if snapshot is not None:
+                    merge_snapshot(total, snapshot)
+                    processes += name != RETIRED_NAME
+    latency = {view: Histogram(LATENCY_BUCKETS, counts, histogram_sum)
+               for view, (counts, histogram_sum) in total['latency'].items()}
+    queries = {view: Histogram(QUERY_BUCKETS, counts, histogram_sum)
+               for view, (counts, histogram_sum) in total['queries'].items()}
+    requests = collections.Counter({tuple(row[:3]): row[3] for row in total['requests']})
+    return {'requests': requests, 'latency': latency, 'queries': queries,
+            'caches': {cache: tuple(counts) for cache, counts in total['caches'].items()}, 'processes': processes}
+
+
+def email_queue_depth():
+    from .models import OutgoingEmail
+    depth = {status: 0 for status, label in OutgoingEmail.STATUSES}
+    depth.update(OutgoingEmail.objects.order_by().values_list('status').annotate(total=Count('id')))
+    return depth
+
+
+def _labels(**labels):
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, histograms):
+    for view, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(name, _labels(view=view, le=bound), cumulative)
+        yield '{}_sum{} {}'.format(name, _labels(view=view), _number(histogram.sum))
+        yield '{}_count{} {}'.format(name, _labels(view=view), cumulative)
+
+
+def render_metrics(collected, queue_depth):
+    # prometheus text exposition format 0.0.4
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+        lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+        lines.extend(PREFIX + sample for sample in samples)
+
+    family('http_requests_total', 'counter', 'Requests by url name, method and status.', (
+        'http_requests_total{} {}'.format(_labels(view=view, method=method, status=status), count)
+        for (view, method, status), count in sorted(collected['requests'].items())))
+    family('http_request_duration_seconds', 'histogram', 'Time from the first middleware to the response.',
+           _histogram_lines('http_request_duration_seconds', collected['latency']))
+    family('db_queries_per_request', 'histogram', 'Database queries run by one request.',
+           _histogram_lines('db_queries_per_request', collected['queries']))
+    family('cache_hits_total', 'counter', 'Hits of the process local caches, summed over the workers.', (
+        'cache_hits_total{} {}'.format(_labels(cache=cache), hits)
+        for cache, (hits, misses) in sorted(collected['caches'].items())))
+    family('cache_misses_total', 'counter', 'Misses of the process local caches, summed over the workers.', (
+        'cache_misses_total{} {}'.format(_labels(cache=cache), misses)
+        for cache, (hits, misses) in sorted(collected['caches'].items())))
+    family('email_queue_depth', 'gauge', 'Outgoing emails by status.', (
+        'email_queue_depth{} {}'.format(_labels(status=status), count) for status, count in sorted(queue_depth.items())))
+    family('metrics_processes', 'gauge', 'Live workers the counters are summed from, with the retired ones.',
+           ['metrics_processes {}'.format(collected['processes'])])
+    return '\n'.join(lines) + '\n'
+
+
+def is_internal_ip(address):
+    # INTERNAL_IPS may hold single addresses and networks like '10.0.0.0/8'
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    for allowed in getattr(settings, 'INTERNAL_IPS', ()):
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def scrape_allowed(request):
+    # a scraper on an INTERNAL_IPS address talking to the workers directly, or anyone with the METRICS_TOKEN.
+    # behind the reverse proxy every request comes from its address, so a forwarded request needs the token
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        expected = 'Bearer {}'.format(token).encode()
+        if hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), expected):
+            return True
+    if any(header in request.META for header in PROXY_HEADERS):
+        return False
+    return is_internal_ip(request.META.get('REMOTE_ADDR', ''))
@@ -0,0 +1,148 @@
+import atexit
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import SimpleLazyObject
+from .metrics import metrics_directory, process_metrics
+from .query_profiler import DEFAULT_N_PLUS_ONE_THRESHOLD, UNRESOLVED, QueryRecorder, record_profile
+from .search_cache import LocalGenerations, bump_generation
+
+
+PROFILE_SESSION_KEY = '_portal_profile'
+PROFILE_ROLES = ('candidate', 'recruiter')
+# seconds a process trusts the profile generation of a user before reading the shared cache again,
+# a change is seen at once by the worker that made it, by the others after at most this long
+PROFILE_CHECK_INTERVAL = 5
+PROFILE_GENERATIONS_MAX_ENTRIES = 10000
+
+profile_generations = LocalGenerations(PROFILE_CHECK_INTERVAL, PROFILE_GENERATIONS_MAX_ENTRIES)
+
+
+def profile_generation_name(user_id):
+    return 'profile:{}'.format(user_id)
+
+
+def invalidate_profile(user_id):
+    # the next request of that user reloads role and recharge validity instead of trusting its session,
+    # only once the change is committed so that reload cannot read the old row
+    name = profile_generation_name(user_id)
+
+    def committed():
+        bump_generation(name)
+        profile_generations.forget(name)
+    transaction.on_commit(committed)
+
+
+def invalidate_new_profile(instance, created=True, *args, **kwargs):
+    # a candidate or recruiter profile created or deleted changes the role of its user
+    if created:
+        invalidate_profile(instance.user_id)
+
+
+class CachedProfile(object):
+
+    def __init__(self, role=None, valid_until=None):
+        self.role = role
+        self.valid_until = valid_until
+
+    def has_subscription(self, role=None):
+        if role is not None and role != self.role:
+            return False
+        return self.valid_until is not None and self.valid_until > timezone.now()
+
+
+def load_profile(user):
+    # one query for both profiles, only paid when the session copy is missing or stale
+    fields = [field for role in PROFILE_ROLES for field in (role + '__id', role + '__recharge_validity')]
+    row = get_user_model()._default_manager.filter(pk=user.pk).values_list(*fields).first() or [None] * len(fields)
+    for position, role in enumerate(PROFILE_ROLES):
+        if row[2 * position] is not None:
+            return CachedProfile(role, row[2 * position + 1])
+    return CachedProfile()
+
+
+def get_profile(request):
+    user = request.user
+    if not user.is_authenticated:
+        return CachedProfile()
+    generation = profile_generations.get(profile_generation_name(user.pk))
+    cached = request.session.get(PROFILE_SESSION_KEY)
+    if cached and cached['user'] == user.pk and cached['generation'] == generation:
+        return CachedProfile(cached['role'], parse_datetime(cached['valid_until']) if cached['valid_until'] else None)
+    profile = load_profile(user)
+    request.session[PROFILE_SESSION_KEY] = {
+        'user': user.pk, 'generation': generation, 'role': profile.role,
+        'valid_until': profile.valid_until.isoformat() if profile.valid_until else None}
+    return profile
+
+
+class ProfileMiddleware(object):
+    # request.profile: role and recharge validity of the logged in user, kept in the session
+    # so the subscription gates of both apps run without touching the database
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        return self.get_response(request)
+
+
+class QueryProfileMiddleware(object):
+    # with QUERY_PROFILER_ENABLED, the query count, sql time and repeated statements of every request
+    # go to the portal.query_profiler log and to portal.query_profiler.query_profiles, keyed by url name.
+    # disabled it removes itself from the chain. queries of streamed response bodies run after it and are missed
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_PROFILER_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        record_profile(recorder.profile(
+            resolver_match.view_name if resolver_match else UNRESOLVED, self.threshold, method=request.method,
+            status=response.status_code, ms=round((time.perf_counter() - start) * 1000, 3)))
+        return response
+
+
+class MetricsMiddleware(object):
+    # latency, status and query count of every request for the /metrics endpoint, see portal.metrics.
+    # without a METRICS_DIR to share the counters of the workers through it removes itself from the chain
+
+    def __init__(self, get_response):
+        self.directory = metrics_directory()
+        if not self.directory:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        atexit.register(process_metrics.flush, self.directory)
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count_query))
+            response = self.get_response(request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        process_metrics.observe_request(resolver_match.view_name if resolver_match else UNRESOLVED, request.method,
+                                        response.status_code, time.perf_counter() - start, queries[0])
+        process_metrics.flush(self.directory, force=False)
+        return response
@@ -1,13 +1,48 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, ExpressionWrapper, F, Value, When
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.signals import post_save
-from django.http import Http404
+from django.db.models.signals import pre_save, post_save, post_delete, post_init, post_migrate, m2m_changed
 from django.utils import timezone
 from django.conf import settings
+from .search import unindex_candidate_resume, create_candidate_resume_index_after_migrate
+from .search_cache import invalidate_candidate_search
+from .middleware import invalidate_profile, invalidate_new_profile
+from .backend import invalidate_cached_user, create_login_indexes_after_migrate
+from .storage import resume_storage
+from .reference_data import invalidate_reference_data
+from .bitmap_index import index_candidate, unindex_candidate, index_candidate_skills, index_candidate_roles
 User._meta.get_field('email')._unique = True
 
 
+class ManagedFieldsMixin(object):
+    # managed fields are only ever written with update(), by signal handlers (the activity counters)
+    # or by background jobs, a plain save() of a stale instance must not overwrite them
+    managed_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.managed_fields]
+        super().save(*args, **kwargs)
+
+
+def extend_recharge_validity(model, user_id, days):
+    # a single UPDATE computes the new validity in the database and keeps the row locked until commit,
+    # so parallel recharges queue up instead of overwriting each other's extension
+    now = timezone.now()
+    extension = timezone.timedelta(days=days)
+    with transaction.atomic():
+        model.objects.filter(user_id=user_id).update(last_recharge=now, recharge_validity=Case(
+            When(recharge_validity__gt=now, then=ExpressionWrapper(F('recharge_validity') + extension,
+                                                                   output_field=models.DateTimeField())),
+            default=Value(now + extension), output_field=models.DateTimeField()))
+        validity = model.objects.filter(user_id=user_id).values_list('last_recharge', 'recharge_validity').get()
+    # usually called inside apply_recharge's transaction, the profile generation is bumped once that commits
+    invalidate_profile(user_id)
+    return validity
+
+
 class Role(models.Model):
     name = models.CharField(max_length=200)
     details = models.TextField(blank=True)
@@ -66,8 +101,39 @@ EXPERIENCE_CHOICES = (('', 'Any'),
                       ('8-10', '8-10 years'),
                       ('10+', '10+ years'),)
 
+# upper bound stored for open ended buckets like '10+', keeps range queries free of NULL checks
+EXPERIENCE_OPEN_MAX = 99
+
+
+def experience_range(experience):
+    # '2-4' -> (2, 4), '10+' -> (10, EXPERIENCE_OPEN_MAX), '' -> (None, None)
+    experience = (experience or '').strip()
+    if not experience:
+        return None, None
+    if experience.endswith('+'):
+        return int(experience[:-1]), EXPERIENCE_OPEN_MAX
+    low, _, high = experience.partition('-')
+    return int(low), int(high or low)
+
+
+class ResumeText(models.Model):
+    # text extracted from one resume file, shared by every candidate uploading the same content
+    sha256 = models.CharField(max_length=64, unique=True)
+    text = models.TextField(blank=True)
+    tokens = models.TextField(blank=True, help_text='distinct search tokens of text')
+    error = models.CharField(max_length=255, blank=True)
+    extracted_on = models.DateTimeField()
+
+    def __str__(self):
+        return "{} - {}".format(self.sha256, self.error or len(self.text))
+
+
+class Candidate(ManagedFieldsMixin, models.Model):
+    # proposals_sent_count is kept by the proposal signals, the resume text fields are set by portal.resume_text,
+    # the recharge fields by extend_recharge_validity
+    managed_fields = ('proposals_sent_count', 'resume_text', 'resume_text_source', 'last_recharge',
+                      'recharge_validity')
 
-class Candidate(models.Model):
     user = models.OneToOneField(User, on_delete=models.PROTECT)
     first_name = models.CharField(max_length=50, blank=True, verbose_name='first name')
     last_name = models.CharField(max_length=50, blank=True, verbose_name='last name')
@@ -85,18 +151,34 @@ class Candidate(models.Model):
                                  verbose_name='industry', help_text='industry of work and experience')
     experience = models.CharField(max_length=150, choices=EXPERIENCE_CHOICES, blank=True,
                                   verbose_name='experience', help_text='total experience')
+    experience_min = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    experience_max = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
 
     address = models.TextField(blank=True, verbose_name='current address',
                                help_text='address ex.(flat no./building name/street name/locality)')
     city = models.ForeignKey(City, on_delete=models.PROTECT, blank=True, null=True,
                              verbose_name='current city')
 
-    resume = models.FileField(null=True, blank=True, upload_to='resumes/')
+    resume = models.FileField(null=True, blank=True, upload_to='resumes/', storage=resume_storage)
     details = models.TextField(blank=True, help_text='anything extra about yourself')
     email_confirmed = models.BooleanField(default=False)
 
     last_recharge = models.DateTimeField(blank=True, null=True)
     recharge_validity = models.DateTimeField(blank=True, null=True)
+    profile_updated_on = models.DateTimeField(auto_now=True, null=True)
+    proposals_sent_count = models.PositiveIntegerField(default=0, editable=False)
+    # linked by portal.resume_text for the resume named resume_text_source
+    resume_text = models.ForeignKey('ResumeText', on_delete=models.SET_NULL, blank=True, null=True, editable=False)
+    resume_text_source = models.CharField(max_length=100, blank=True, default='', editable=False)
+
+    class Meta:
+        # one index per common CandidateFilter combination, see recruiter.tests
+        indexes = [models.Index(fields=['experience_min', 'experience_max'], name='candidate_experience_idx'),
+                   models.Index(fields=['experience_max', 'experience_min'], name='candidate_experience_max_idx'),
+                   models.Index(fields=['city', 'qualification'], name='candidate_city_qual_idx'),
+                   models.Index(fields=['industry', 'experience'], name='candidate_industry_exp_idx'),
+                   models.Index(fields=['qualification', 'experience'], name='candidate_qual_exp_idx'),
+                   models.Index(fields=['experience', 'city'], name='candidate_exp_city_idx')]
 
     def __str__(self):
         return "{0} {1}".format(self.first_name, self.last_name)
@@ -116,24 +198,108 @@ class Candidate(models.Model):
             return False
 
     def add_recharge(self, package_validity_days):
-        validity_days = timezone.timedelta(days=package_validity_days)
-        self.last_recharge = timezone.now()
-        if not self.recharge_validity or self.recharge_validity < timezone.now():
-            self.recharge_validity = (timezone.now() + validity_days)
-        elif self.recharge_validity > timezone.now():
-            self.recharge_validity += validity_days
-        self.save()
+        self.last_recharge, self.recharge_validity = extend_recharge_validity(
+            type(self), self.user_id, package_validity_days)
 
     def has_subscription(self):
         return self.recharge_validity is not None and self.recharge_validity > timezone.now()
 
-    @property
-    def get_resume_link(self):
-        if self.resume:
-            print(self.resume)
-            return self.resume.url
-        else:
-            return ''
+
+def set_experience_range(instance, sender, *args, **kwargs):
+    instance.experience_min, instance.experience_max = experience_range(instance.experience)
+
+
+def backfill_experience_ranges(model):
+    # one UPDATE per bucket, also usable from a RunPython data migration.
+    # rows already holding their range are left alone, a second run updates nothing
+    updated = 0
+    for value, label in EXPERIENCE_CHOICES:
+        experience_min, experience_max = experience_range(value)
+        updated += model.objects.filter(experience=value) \
+            .exclude(experience_min=experience_min, experience_max=experience_max) \
+            .update(experience_min=experience_min, experience_max=experience_max)
+    return updated
+
+
+class StoredResume(models.Model):
+    # one file of resume_storage and the number of candidates pointing at it, see gc_resumes
+    name = models.CharField(max_length=100, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+    updated_on = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} - {}".format(self.name, self.refs)
+
+
+def change_resume_refs(name, delta):
+    if not name:
+        return
+    now = timezone.now()
+    if delta > 0:
+        StoredResume.objects.get_or_create(name=name)
+        StoredResume.objects.filter(name=name).update(refs=F('refs') + delta, updated_on=now)
+    else:
+        StoredResume.objects.filter(name=name, refs__gte=-delta).update(refs=F('refs') + delta, updated_on=now)
+
+
+def _resume_name(value):
+    return getattr(value, 'name', value) or None
+
+
+def remember_resume(instance, *args, **kwargs):
+    # the resume the row had when loaded, unknown when the field was deferred
+    if 'resume' in instance.__dict__:
+        instance._stored_resume = _resume_name(instance.__dict__['resume'])
+
+
+def load_stored_resume(instance, update_fields=None, *args, **kwargs):
+    if instance._state.adding or hasattr(instance, '_stored_resume'):
+        return
+    if update_fields is None or 'resume' in update_fields:
+        instance._stored_resume = type(instance).objects.filter(pk=instance.pk) \
+            .values_list('resume', flat=True).first() or None
+
+
+def count_resume(instance, created, update_fields=None, *args, **kwargs):
+    if update_fields is not None and 'resume' not in update_fields:
+        return
+    old = None if created else getattr(instance, '_stored_resume', None)
+    new = _resume_name(instance.resume)
+    if old != new:
+        change_resume_refs(new, 1)
+        change_resume_refs(old, -1)
+    instance._stored_resume = new
+
+
+def uncount_resume(instance, *args, **kwargs):
+    change_resume_refs(getattr(instance, '_stored_resume', None), -1)
+
+
+pre_save.connect(set_experience_range, sender=Candidate)
+# the commit hooks run in the order they are queued: the bitmap index is written before the search
+# generation moves on, or another worker could cache the old ids under the new generation
+post_save.connect(index_candidate, sender=Candidate)
+post_delete.connect(unindex_candidate, sender=Candidate)
+m2m_changed.connect(index_candidate_skills, sender=Candidate.skills.through)
+m2m_changed.connect(index_candidate_roles, sender=Candidate.roles.through)
+post_save.connect(invalidate_candidate_search, sender=Candidate)
+post_delete.connect(invalidate_candidate_search, sender=Candidate)
+m2m_changed.connect(invalidate_candidate_search, sender=Candidate.skills.through)
+m2m_changed.connect(invalidate_candidate_search, sender=Candidate.roles.through)
+post_init.connect(remember_resume, sender=Candidate)
+pre_save.connect(load_stored_resume, sender=Candidate)
+post_save.connect(count_resume, sender=Candidate)
+post_delete.connect(uncount_resume, sender=Candidate)
+post_save.connect(invalidate_new_profile, sender=Candidate)
+post_delete.connect(invalidate_new_profile, sender=Candidate)
+post_save.connect(invalidate_cached_user, sender=User)
+post_delete.connect(invalidate_cached_user, sender=User)
+post_migrate.connect(create_login_indexes_after_migrate)
+post_delete.connect(unindex_candidate_resume, sender=Candidate)
+post_migrate.connect(create_candidate_resume_index_after_migrate)
+for reference_model in (Role, Skill, Industry, Qualification, City):
+    post_save.connect(invalidate_reference_data, sender=reference_model)
+    post_delete.connect(invalidate_reference_data, sender=reference_model)
 
 
 class Proposal(models.Model):
@@ -141,12 +307,56 @@ class Proposal(models.Model):
     posted_by = models.ForeignKey(Candidate, on_delete=models.CASCADE)
     message = models.TextField(blank=True, help_text='proposal message')
     on = models.DateTimeField(auto_now_add=True)
+    read_on = models.DateTimeField(blank=True, null=True, editable=False, help_text='first opened by the recruiter')
 
     def __str__(self):
         return "{} for {}".format(self.posted_by, self.job.headline)
 
     class Meta:
         unique_together = ('job', 'posted_by')
+        # keyset pages of both proposal inboxes, see portal.pagination
+        indexes = [models.Index(fields=['posted_by', 'on'], name='proposal_candidate_on_idx'),
+                   models.Index(fields=['on'], name='proposal_on_idx')]
+
+
+class JobRecommendation(models.Model):
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
+    job = models.ForeignKey('recruiter.Job', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return "{} - {} - {}".format(self.candidate, self.job, self.score)
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = ('candidate', 'rank')
+
+
+class JobAlert(models.Model):
+    # a job matching the profile of a candidate, waiting for the next digest of that candidate
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
+    job = models.ForeignKey('recruiter.Job', on_delete=models.CASCADE)
+    created_on = models.DateTimeField(auto_now_add=True)
+    sent_on = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "{} - {} - {}".format(self.candidate, self.job, self.sent_on)
+
+    class Meta:
+        unique_together = ('candidate', 'job')
+        # pending alerts by candidate, and the last digest of every candidate for the rate limit
+        indexes = [models.Index(fields=['sent_on', 'candidate'], name='jobalert_sent_candidate_idx')]
+
+
+class RecommendationRun(models.Model):
+    started_on = models.DateTimeField()
+    finished_on = models.DateTimeField(blank=True, null=True)
+    incremental = models.BooleanField(default=False)
+    candidates = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} - {}".format(self.started_on, self.candidates)
 
 
 class Package(models.Model):
@@ -171,29 +381,40 @@ class Recharge(models.Model):
         return "{} - {} - {}".format(self.user, self.package, self.on)
 
 
-def add_recharge_to_user(instance, created, sender, *args, **kwargs):
-    if created:
-        package = instance.package
-        user_type = package.user_type
-        if user_type == 'Candidate':
-            instance.user.candidate.add_recharge(package_validity_days=package.validity_days)
-        elif user_type == 'Recruiter':
-            instance.user.recruiter.add_recharge(package_validity_days=package.validity_days)
-        else:
-            raise Http404
-
+def package_details(package):
+    return "Name : {} \nPrice : {} \nValidity Days : {}\nDescription : {}".format(
+        package.name, package.price, package.validity_days, package.description)
+
+
+class OutgoingEmail(models.Model):
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUSES = ((QUEUED, 'Queued'), (SENDING, 'Sending'), (SENT, 'Sent'), (DEAD, 'Dead'))
+
+    to = models.TextField(help_text='Recipients, one per line')
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    sent_on = models.DateTimeField(blank=True, null=True)
+    # the send_queued call that claimed the row, see portal.mail.claim_batch
+    claimed_by = models.CharField(max_length=32, blank=True, editable=False)
+    claimed_on = models.DateTimeField(blank=True, null=True, editable=False)
 
-post_save.connect(add_recharge_to_user, sender=Recharge)
-
-
-def save_package_details(instance, sender, *args, **kwargs):
-    if instance.package:
-        package = instance.package
-        correct_package_details = "Name : {} \nPrice : {} \nValidity Days : {}\nDescription : {}".format(
-            package.name, package.price, package.validity_days, package.description)
-        if instance.package_details != correct_package_details:
-            instance.package_details = correct_package_details
-            instance.save()
+    def __str__(self):
+        return "{} - {} - {}".format(self.to.replace('\n', ', '), self.subject, self.status)
 
+    @property
+    def recipients(self):
+        return [address for address in self.to.splitlines() if address]
 
-post_save.connect(save_package_details, sender=Recharge)
+    class Meta:
+        # the worker reads the due queued rows oldest first
+        indexes = [models.Index(fields=['status', 'next_attempt_on'], name='outgoingemail_due_idx')]
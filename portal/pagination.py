@@ -0,0 +1,168 @@
+import base64
+import binascii
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+CURSOR_PARAM = 'cursor'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, a cursor has to match its row exactly
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, list(values)], cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    # (direction, values), or None for a missing or tampered cursor so the first page is served
+    if not token:
+        return None
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def querystring_without_cursor(request):
+    params = request.GET.copy()
+    params.pop(CURSOR_PARAM, None)
+    params.pop('page', None)
+    return params.urlencode()
+
+
+class CursorPage(object):
+    # the part of django's Page the templates use, plus opaque cursors for the neighbouring pages
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor=None, previous_cursor=None, count=None):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+
+def _ordering_field(model, name):
+    parts = name.split('__')
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(parts[-1])
+
+
+def _ordering_value(obj, name):
+    for part in name.split('__'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+
+
+def keyset_filter(ordering, values, forward=True):
+    # rows after (or before) the row holding values, for an ordering like ('-posted_on', '-id')
+    condition = None
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') == forward else 'gt'
+        step = Q(**{'{}__{}'.format(name, lookup): values[position]})
+        for previous, value in zip(ordering[:position], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition = step if condition is None else condition | step
+    return condition
+
+
+def paginate_by_cursor(queryset, ordering, token, per_page, count=False):
+    # the fields of ordering must not be null and the last one must be unique, usually 'id'
+    cursor = decode_cursor(token)
+    values = None
+    if cursor is not None and len(cursor[1]) == len(ordering):
+        try:
+            values = [_ordering_field(queryset.model, field.lstrip('-')).to_python(value)
+                      for field, value in zip(ordering, cursor[1])]
+        except ValidationError:
+            values = None
+    forward = values is None or cursor[0] == NEXT
+    total = queryset.count() if count else None
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values, forward))
+    # one row past the page tells whether there is more, without counting
+    rows = list(queryset.order_by(*(ordering if forward else _reverse_ordering(ordering)))[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+    has_next = more if forward else True
+    has_previous = values is not None if forward else more
+
+    def cursor_of(direction, row):
+        return encode_cursor(direction, [_ordering_value(row, field.lstrip('-')) for field in ordering])
+
+    return CursorPage(rows, has_next and bool(rows), has_previous and bool(rows),
+                      next_cursor=cursor_of(NEXT, rows[-1]) if has_next and rows else None,
+                      previous_cursor=cursor_of(PREVIOUS, rows[0]) if has_previous and rows else None,
+                      count=total)
+
+
+def paginate_sequence(items, token, per_page):
+    # cached search results are already an ordered tuple in memory, the cursor is a position in it
+    cursor = decode_cursor(token)
+    start = 0
+    if cursor is not None and len(cursor[1]) == 1 and isinstance(cursor[1][0], int):
+        start = min(max(cursor[1][0], 0), len(items))
+    has_next = start + per_page < len(items)
+    has_previous = start > 0
+    return CursorPage(items[start:start + per_page], has_next, has_previous,
+                      next_cursor=encode_cursor(NEXT, [start + per_page]) if has_next else None,
+                      previous_cursor=encode_cursor(PREVIOUS, [max(start - per_page, 0)]) if has_previous else None,
+                      count=len(items))
+
+
+class CursorPaginationMixin(object):
+    # for ListView, pages on a keyset of cursor_ordering instead of OFFSET, count_total adds a COUNT per page
+    cursor_ordering = ('-id',)
+    count_total = False
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_by_cursor(queryset, self.get_cursor_ordering(), self.request.GET.get(CURSOR_PARAM),
+                                  page_size, count=self.count_total)
+        return None, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['querystring'] = querystring_without_cursor(self.request)
+        return context
@@ -0,0 +1,105 @@
+import collections
+import json
+import logging
+import re
+import threading
+import time
+from django.conf import settings
+
+
+logger = logging.getLogger('portal.query_profiler')
+
+# a statement shape run more often than this in one request is reported as an N+1
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+DEFAULT_BUFFER_SIZE = 1000
+TOP_SHAPES = 5
+UNRESOLVED = '<unresolved>'
+
+STRING_RE = re.compile(r"'(?:''|[^'])*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def normalize_sql(sql):
+    # the statement without its values, "id IN (%s, %s)" and "id IN (%s)" are the same shape
+    sql = STRING_RE.sub('?', sql.replace('%s', '?'))
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryRecorder(object):
+    # connection.execute_wrapper() callback counting and timing the statements of one request
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = collections.Counter()
+        self.shape_durations = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            shape = normalize_sql(sql)
+            self.count += 1
+            self.duration += elapsed
+            self.shapes[shape] += 1
+            self.shape_durations[shape] += elapsed
+
+    def profile(self, view, threshold, **extra):
+        top = [{'sql': shape, 'count': count, 'ms': round(self.shape_durations[shape] * 1000, 3)}
+               for shape, count in self.shapes.most_common(TOP_SHAPES)]
+        record = {'view': view, 'queries': self.count, 'sql_ms': round(self.duration * 1000, 3), 'top': top,
+                  'n_plus_one': [shape for shape, count in self.shapes.items() if count > threshold]}
+        record.update(extra)
+        return record
+
+
+class QueryProfileBuffer(object):
+    # the last profiles of this process, summary() aggregates them per url name
+
+    def __init__(self, size=DEFAULT_BUFFER_SIZE):
+        self._records = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def summary(self):
+        views = {}
+        for record in self.records():
+            view = views.setdefault(record['view'], {'requests': 0, 'queries': 0, 'max_queries': 0, 'sql_ms': 0.0,
+                                                     'n_plus_one_requests': 0, 'n_plus_one': collections.Counter()})
+            view['requests'] += 1
+            view['queries'] += record['queries']
+            view['max_queries'] = max(view['max_queries'], record['queries'])
+            view['sql_ms'] += record['sql_ms']
+            if record['n_plus_one']:
+                view['n_plus_one_requests'] += 1
+                view['n_plus_one'].update(record['n_plus_one'])
+        for view in views.values():
+            view['avg_queries'] = round(view['queries'] / view['requests'], 2)
+            view['sql_ms'] = round(view['sql_ms'], 3)
+            view['n_plus_one'] = [shape for shape, count in view['n_plus_one'].most_common(TOP_SHAPES)]
+        return views
+
+
+query_profiles = QueryProfileBuffer(getattr(settings, 'QUERY_PROFILER_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+
+
+def record_profile(record):
+    query_profiles.add(record)
+    # one json object per line, warnings for the requests with an N+1
+    logger.log(logging.WARNING if record['n_plus_one'] else logging.INFO, json.dumps(record, sort_keys=True))
@@ -0,0 +1,17 @@
+from django.db import transaction
+from .models import Recharge, package_details
+
+
+def apply_recharge(recharge):
+    # one transaction: extend the profile validity, then insert the recharge once with its package snapshot
+    package = recharge.package
+    profile = getattr(recharge.user, package.user_type.lower())
+    with transaction.atomic():
+        profile.add_recharge(package_validity_days=package.validity_days)
+        recharge.package_details = package_details(package)
+        recharge.save(force_insert=True)
+    return recharge
+
+
+def make_recharge(user, package):
+    return apply_recharge(Recharge(user=user, package=package))
@@ -0,0 +1,248 @@
+import collections
+import multiprocessing
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from recruiter.models import Job
+from .matching import MATCH_WEIGHTS, EXPERIENCE_PENALTY_PER_YEAR, MISSING
+from .models import Candidate, JobRecommendation, RecommendationRun
+
+
+DEFAULT_TOP = 10
+DEFAULT_CHUNK_SIZE = 500
+# loaded chunks waiting for or inside the pool, per worker process, bounds the memory of a run
+PENDING_CHUNKS_PER_PROCESS = 2
+# jobs scored at once, a worker holds at most chunk size x JOB_BLOCK_SIZE scores whatever the number of jobs
+JOB_BLOCK_SIZE = 1000
+
+
+def _column(values):
+    return np.array([MISSING if value is None else value for value in values], dtype=np.int64)
+
+
+def _vocabulary(values):
+    return dict((value, column) for column, value in enumerate(sorted(set(values))))
+
+
+def _pairs(pairs):
+    # (row, column) pairs sorted by row, as two arrays
+    pairs = sorted(pairs)
+    return (np.array([row for row, column in pairs], dtype=np.int64),
+            np.array([column for row, column in pairs], dtype=np.int64))
+
+
+class JobBlock(object):
+    # the rows start:stop of a JobMatrix, with the m2m as dense 0/1 matrices, what score_chunk reads
+
+    def __init__(self, job_matrix, start, stop):
+        for name in ('ids', 'role', 'industry', 'city', 'experience_min', 'experience_max', 'role_column'):
+            setattr(self, name, getattr(job_matrix, name)[start:stop])
+        size = len(self.ids)
+        rows, columns = job_matrix.skill_pairs
+        first, last = np.searchsorted(rows, [start, stop])
+        self.skills = np.zeros((size, len(job_matrix.skill_vocabulary)), dtype=np.float32)
+        self.skills[rows[first:last] - start, columns[first:last]] = job_matrix.skill_weights[first:last]
+        rows, columns = job_matrix.qualification_pairs
+        first, last = np.searchsorted(rows, [start, stop])
+        self.qualifications = np.zeros((size, len(job_matrix.qualification_vocabulary) + 1), dtype=np.float32)
+        self.qualifications[rows[first:last] - start, columns[first:last]] = 1
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class JobMatrix(object):
+    # features of the jobs to recommend, one row per job, m2m as (row, column) pairs so the memory grows
+    # with the links, not with jobs x skills. blocks() gives the dense matrices a few rows at a time
+
+    def __init__(self, jobs):
+        rows = list(jobs.order_by('id').values_list(
+            'id', 'role_id', 'industry_id', 'city_id', 'experience_min', 'experience_max'))
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.ids = np.array(columns[0], dtype=np.int64)
+        self.role = _column(columns[1])
+        self.industry = _column(columns[2])
+        self.city = _column(columns[3])
+        self.experience_min = _column(columns[4])
+        self.experience_max = _column(columns[5])
+        row_of = dict((job_id, row) for row, job_id in enumerate(columns[0]))
+
+        skill_pairs = list(Job.skills.through.objects.filter(job__in=jobs).values_list('job_id', 'skill_id'))
+        self.skill_vocabulary = _vocabulary(skill_id for job_id, skill_id in skill_pairs)
+        self.skill_pairs = _pairs((row_of[job_id], self.skill_vocabulary[skill_id]) for job_id, skill_id in skill_pairs)
+        # every row sums to 1 so candidate skills x skills.T is the share of the job skills covered
+        totals = np.bincount(self.skill_pairs[0], minlength=len(rows))
+        self.skill_weights = (1 / totals[self.skill_pairs[0]]).astype(np.float32)
+
+        qualification_pairs = list(Job.qualifications.through.objects.filter(job__in=jobs).values_list(
+            'job_id', 'qualification_id'))
+        self.qualification_vocabulary = _vocabulary(q_id for job_id, q_id in qualification_pairs)
+        self.qualification_pairs = _pairs((row_of[job_id], self.qualification_vocabulary[qualification_id])
+                                          for job_id, qualification_id in qualification_pairs)
+
+        self.role_vocabulary = _vocabulary(role for role in columns[1] if role is not None)
+        self.role_column = np.array([self.role_vocabulary.get(role, -1) for role in columns[1]], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def blocks(self, size=None):
+        size = size or JOB_BLOCK_SIZE
+        for start in range(0, len(self), size):
+            yield JobBlock(self, start, start + size)
+
+
+def load_candidate_chunk(candidate_ids, job_matrix, existing=False):
+    # everything a worker needs to score a chunk of candidates, as plain arrays
+    candidate_ids = sorted(candidate_ids)
+    wanted = set(candidate_ids)
+    in_range = {'id__gte': candidate_ids[0], 'id__lte': candidate_ids[-1]}
+    rows = [row for row in Candidate.objects.filter(**in_range).order_by('id').values_list(
+        'id', 'city_id', 'qualification_id', 'industry_id', 'experience_min', 'experience_max') if row[0] in wanted]
+    columns = list(zip(*rows)) if rows else [()] * 6
+    row_of = dict((candidate_id, row) for row, candidate_id in enumerate(columns[0]))
+
+    skills = np.zeros((len(rows), len(job_matrix.skill_vocabulary)), dtype=np.float32)
+    for candidate_id, skill_id in Candidate.skills.through.objects.filter(
+            candidate_id__gte=candidate_ids[0], candidate_id__lte=candidate_ids[-1]).values_list(
+            'candidate_id', 'skill_id'):
+        if candidate_id in row_of and skill_id in job_matrix.skill_vocabulary:
+            skills[row_of[candidate_id], job_matrix.skill_vocabulary[skill_id]] = 1
+    roles = np.zeros((len(rows), len(job_matrix.role_vocabulary) + 1), dtype=bool)
+    for candidate_id, role_id in Candidate.roles.through.objects.filter(
+            candidate_id__gte=candidate_ids[0], candidate_id__lte=candidate_ids[-1]).values_list(
+            'candidate_id', 'role_id'):
+        if candidate_id in row_of and role_id in job_matrix.role_vocabulary:
+            roles[row_of[candidate_id], job_matrix.role_vocabulary[role_id]] = True
+
+    chunk = {'ids': np.array(columns[0], dtype=np.int64), 'city': _column(columns[1]),
+             'qualification': np.array([job_matrix.qualification_vocabulary.get(q, -1) for q in columns[2]],
+                                       dtype=np.int64),
+             'industry': _column(columns[3]), 'experience_min': _column(columns[4]),
+             'experience_max': _column(columns[5]), 'skills': skills, 'roles': roles, 'existing': {}}
+    if existing:
+        for candidate_id, job_id, score in JobRecommendation.objects.filter(
+                candidate_id__gte=candidate_ids[0], candidate_id__lte=candidate_ids[-1]).values_list(
+                'candidate_id', 'job_id', 'score'):
+            if candidate_id in row_of:
+                chunk['existing'].setdefault(candidate_id, []).append((job_id, score))
+    return chunk
+
+
+def score_chunk(chunk, jobs):
+    # candidates x jobs score matrix of a JobBlock, same weights as portal.matching
+    score = MATCH_WEIGHTS['skills'] * chunk['skills'].dot(jobs.skills.T)
+    has_role = jobs.role_column >= 0
+    score += MATCH_WEIGHTS['role'] * (chunk['roles'][:, jobs.role_column] & has_role[None, :])
+    score += MATCH_WEIGHTS['qualification'] * jobs.qualifications[:, chunk['qualification']].T
+    score += MATCH_WEIGHTS['city'] * ((chunk['city'][:, None] == jobs.city[None, :]) & (jobs.city != MISSING))
+    score += MATCH_WEIGHTS['industry'] * ((chunk['industry'][:, None] == jobs.industry[None, :]) &
+                                          (jobs.industry != MISSING))
+    known = (chunk['experience_min'][:, None] != MISSING) & (jobs.experience_min[None, :] != MISSING)
+    gap = np.maximum(np.maximum(jobs.experience_min[None, :] - chunk['experience_max'][:, None],
+                                chunk['experience_min'][:, None] - jobs.experience_max[None, :]), 0)
+    score += MATCH_WEIGHTS['experience'] * np.where(known, np.clip(1 - gap * EXPERIENCE_PENALTY_PER_YEAR, 0, 1), 0)
+    return score
+
+
+def recommend_chunk(chunk, job_matrix, top):
+    # {candidate id: [(job id, score)] best first}, merged with chunk['existing'] when given
+    recommendations = dict((int(candidate_id), dict(chunk['existing'].get(int(candidate_id), [])))
+                           for candidate_id in chunk['ids'])
+    for block in job_matrix.blocks():
+        score = score_chunk(chunk, block)
+        k = min(top, len(block))
+        best = np.argpartition(-score, k - 1, axis=1)[:, :k]
+        for row, candidate_id in enumerate(chunk['ids']):
+            merged = recommendations[int(candidate_id)]
+            merged.update((int(block.ids[column]), float(score[row, column]))
+                          for column in best[row] if score[row, column] > 0)
+            # the best top of the blocks so far, the next block can only push them out
+            recommendations[int(candidate_id)] = dict(_best(merged, top))
+    return dict((candidate_id, _best(merged, top)) for candidate_id, merged in recommendations.items())
+
+
+def _best(scores, top):
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top]
+
+
+_worker_job_matrix = None
+
+
+def _init_worker(job_matrix):
+    global _worker_job_matrix
+    _worker_job_matrix = job_matrix
+
+
+def _recommend_chunk_in_worker(args):
+    chunk, top = args
+    return recommend_chunk(chunk, _worker_job_matrix, top)
+
+
+def save_recommendations(recommendations):
+    with transaction.atomic():
+        JobRecommendation.objects.filter(candidate_id__in=list(recommendations)).delete()
+        JobRecommendation.objects.bulk_create(
+            JobRecommendation(candidate_id=candidate_id, job_id=job_id, score=round(score, 4), rank=rank)
+            for candidate_id, jobs in recommendations.items()
+            for rank, (job_id, score) in enumerate(jobs, start=1))
+
+
+def iter_id_chunks(queryset, chunk_size):
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def _save_chunk(recommendations):
+    save_recommendations(recommendations)
+    return len(recommendations)
+
+
+def run_chunks(candidates, job_matrix, top, chunk_size, processes, merge=False):
+    # chunks are loaded on this thread, one at a time, and results saved in order
+    chunks = (load_candidate_chunk(ids, job_matrix, existing=merge) for ids in iter_id_chunks(candidates, chunk_size))
+    count = 0
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(job_matrix,))
+        # pool.imap would drain the generator on its own thread, loading every chunk at once
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                if len(pending) >= processes * PENDING_CHUNKS_PER_PROCESS:
+                    count += _save_chunk(pending.popleft().get())
+                pending.append(pool.apply_async(_recommend_chunk_in_worker, ((chunk, top),)))
+            while pending:
+                count += _save_chunk(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for chunk in chunks:
+            count += _save_chunk(recommend_chunk(chunk, job_matrix, top))
+    return count
+
+
+def compute_recommendations(top=DEFAULT_TOP, chunk_size=DEFAULT_CHUNK_SIZE, processes=1, incremental=False):
+    run = RecommendationRun.objects.create(started_on=timezone.now(), incremental=incremental)
+    last_run = RecommendationRun.objects.filter(finished_on__isnull=False).exclude(id=run.id) \
+        .order_by('-started_on').first()
+    if incremental and last_run is not None:
+        # changed profiles get a full recompute, everybody else only merges in the new jobs
+        changed = Candidate.objects.filter(profile_updated_on__gte=last_run.started_on)
+        count = run_chunks(changed, JobMatrix(Job.objects.all()), top, chunk_size, processes)
+        new_jobs = Job.objects.filter(posted_on__gte=last_run.started_on)
+        if new_jobs.exists():
+            unchanged = Candidate.objects.exclude(profile_updated_on__gte=last_run.started_on)
+            count += run_chunks(unchanged, JobMatrix(new_jobs), top, chunk_size, processes, merge=True)
+    else:
+        run.incremental = False
+        count = run_chunks(Candidate.objects.all(), JobMatrix(Job.objects.all()), top, chunk_size, processes)
+    run.candidates = count
+    run.finished_on = timezone.now()
+    run.save()
+    return run
@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import OrderedDict
+import django_filters
+from django import forms
+from django.db import models, transaction
+from django_filters import fields as filter_fields
+from django_filters.filterset import remote_queryset
+from django.core.exceptions import ValidationError
+from .search_cache import get_generation, bump_generation
+
+
+# seconds a process trusts its copy before comparing generations again, changes made
+# in the same process are seen at once, changes of other processes after at most this long
+REFERENCE_CHECK_INTERVAL = 5
+
+
+def reference_generation_name(model):
+    return 'reference:{}'.format(model._meta.label_lower)
+
+
+class ReferenceDataCache(object):
+    # process local copy of the small lookup tables (Role, Skill, City, ...), {pk: instance} per model,
+    # reloaded whole when the generation of the model moves on
+
+    def __init__(self, check_interval=REFERENCE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.hits = 0
+        self.loads = 0
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _table(self, model):
+        now = time.monotonic()
+        entry = self._tables.get(model)
+        if entry is not None and now - entry[1] < self.check_interval:
+            self.hits += 1
+            return entry[2]
+        generation = get_generation(reference_generation_name(model))
+        if entry is None or entry[0] != generation:
+            ordering = model._meta.ordering or ['pk']
+            objects = model._default_manager.order_by(*ordering)
+            entry = (generation, now, OrderedDict((obj.pk, obj) for obj in objects))
+            self.loads += 1
+        else:
+            self.hits += 1
+            entry = (generation, now, entry[2])
+        with self._lock:
+            self._tables[model] = entry
+        return entry[2]
+
+    def all(self, model):
+        return list(self._table(model).values())
+
+    def get(self, model, pk):
+        return self._table(model).get(pk)
+
+    def forget(self, model):
+        with self._lock:
+            self._tables.pop(model, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.loads = 0
+
+
+reference_data = ReferenceDataCache()
+
+
+def invalidate_reference_data(sender, *args, **kwargs):
+    # this process drops its copy at once, the other workers once the change is committed,
+    # a bump before the commit would let them reload the old rows under the new generation
+    def committed():
+        bump_generation(reference_generation_name(sender))
+        reference_data.forget(sender)
+    reference_data.forget(sender)
+    transaction.on_commit(committed)
+
+
+def attach_reference_data(objects, *fields):
+    # fills the foreign key caches of objects from the reference cache instead of select_related(),
+    # e.g. attach_reference_data(jobs, 'city') before a template shows {{ job.city }}
+    for obj in objects:
+        for name in fields:
+            field = obj._meta.get_field(name)
+            value = getattr(obj, field.attname)
+            related = reference_data.get(field.related_model, value) if value is not None else None
+            # a row newer than the local copy is left to the usual lazy load
+            if value is None or related is not None:
+                field.set_cached_value(obj, related)
+    return objects
+
+
+def _cached(queryset):
+    # only unfiltered querysets can be answered from the cache
+    return not queryset.query.has_filters()
+
+
+def _cached_field(field):
+    return _cached(field.queryset) and field.to_field_name in (None, field.queryset.model._meta.pk.name)
+
+
+class CachedModelChoiceIterator(forms.models.ModelChoiceIterator):
+
+    def __iter__(self):
+        if not _cached(self.queryset):
+            yield from super().__iter__()
+            return
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        # the null choice of django_filters fields
+        if getattr(self.field, 'null_label', None) is not None:
+            yield (self.field.null_value, self.field.null_label)
+        for obj in reference_data.all(self.queryset.model):
+            yield self.choice(obj)
+
+    def __len__(self):
+        return sum(1 for choice in self)
+
+
+def _lookup(field, value):
+    try:
+        pk = field.queryset.model._meta.pk.to_python(value)
+    except ValidationError:
+        pk = None
+    obj = reference_data.get(field.queryset.model, pk) if pk is not None else None
+    if obj is None:
+        raise ValidationError(field.error_messages['invalid_choice'], code='invalid_choice',
+                              params={'value': value})
+    return obj
+
+
+class ReferenceChoiceMixin(object):
+    # choices and validation of a lookup table from reference_data, no query per render or submit
+    iterator = CachedModelChoiceIterator
+
+    def to_python(self, value):
+        if not _cached_field(self) or getattr(self, 'null_label', None) is not None and value == self.null_value:
+            return super().to_python(value)
+        if value in self.empty_values:
+            return None
+        return _lookup(self, value)
+
+
+class ReferenceMultipleChoiceMixin(object):
+    iterator = CachedModelChoiceIterator
+
+    def _check_values(self, value):
+        # the selected instances as a list, where the stock field returns a queryset
+        if not _cached_field(self) or getattr(self, 'null_label', None) is not None and self.null_value in value:
+            return super()._check_values(value)
+        try:
+            values = list(dict.fromkeys(str(item) for item in value))
+        except TypeError:
+            raise ValidationError(self.error_messages['list'], code='list')
+        return [_lookup(self, item) for item in values]
+
+
+class CachedModelChoiceField(ReferenceChoiceMixin, forms.ModelChoiceField):
+    pass
+
+
+class CachedModelMultipleChoiceField(ReferenceMultipleChoiceMixin, forms.ModelMultipleChoiceField):
+    pass
+
+
+class CachedFilterModelChoiceField(ReferenceChoiceMixin, filter_fields.ModelChoiceField):
+    pass
+
+
+class CachedFilterModelMultipleChoiceField(ReferenceMultipleChoiceMixin, filter_fields.ModelMultipleChoiceField):
+    pass
+
+
+class CachedModelChoiceFilter(django_filters.ModelChoiceFilter):
+    field_class = CachedFilterModelChoiceField
+
+
+class CachedModelMultipleChoiceFilter(django_filters.ModelMultipleChoiceFilter):
+    field_class = CachedFilterModelMultipleChoiceField
+
+
+# for Meta.field_classes of model forms with these foreign keys and many to many fields
+REFERENCE_FIELD_CLASSES = {
+    'role': CachedModelChoiceField, 'industry': CachedModelChoiceField, 'city': CachedModelChoiceField,
+    'qualification': CachedModelChoiceField, 'qualifications': CachedModelMultipleChoiceField,
+    'skills': CachedModelMultipleChoiceField, 'roles': CachedModelMultipleChoiceField,
+}
+
+# for Meta.filter_overrides of filter sets whose relations all point at lookup tables
+REFERENCE_FILTER_OVERRIDES = {
+    models.ForeignKey: {'filter_class': CachedModelChoiceFilter,
+                        'extra': lambda field: {'queryset': remote_queryset(field)}},
+    models.ManyToManyField: {'filter_class': CachedModelMultipleChoiceFilter,
+                             'extra': lambda field: {'queryset': remote_queryset(field)}},
+}
@@ -0,0 +1,207 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import unicodedata
+import zipfile
+import zlib
+from xml.etree import ElementTree
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Candidate, ResumeText
+from .search import index_candidate_resumes
+from .search_cache import bump_generation
+from .storage import resume_storage
+
+
+DEFAULT_BATCH_SIZE = 200
+# text kept per resume, the rest of very long files is dropped
+MAX_TEXT_LENGTH = 100000
+HASH_CHUNK_SIZE = 64 * 1024
+CONTENT_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+PDF_STREAM_RE = re.compile(rb'<<(.*?)>>\s*stream\r?\n(.*?)\r?\nendstream', re.S)
+PDF_TEXT_BLOCK_RE = re.compile(rb'BT(.*?)ET', re.S)
+# (string) Tj, (string) ' and [(string) 12 (string)] TJ
+PDF_STRING_RE = re.compile(rb'\((?:\\.|[^\\)])*\)|\[(?:[^\]])*\]\s*TJ', re.S)
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f', b'(': b'(', b')': b')',
+               b'\\': b'\\'}
+
+
+def extract_plain_text(path):
+    with open(path, 'rb') as resume:
+        return resume.read(MAX_TEXT_LENGTH * 4).decode('utf-8', errors='replace')
+
+
+def extract_docx_text(path):
+    # the w:t runs of word/document.xml, one line per w:p paragraph
+    paragraphs = []
+    with zipfile.ZipFile(path) as docx, docx.open('word/document.xml') as document:
+        for event, element in ElementTree.iterparse(document):
+            if element.tag == WORD_NAMESPACE + 'p':
+                paragraphs.append(''.join(run.text or '' for run in element.iter(WORD_NAMESPACE + 't')))
+                element.clear()
+    return '\n'.join(paragraphs)
+
+
+def _pdf_string(literal):
+    literal = literal[1:-1]
+    out = bytearray()
+    position = 0
+    while position < len(literal):
+        byte = literal[position:position + 1]
+        if byte == b'\\' and position + 1 < len(literal):
+            following = literal[position + 1:position + 2]
+            octal = re.match(rb'[0-7]{1,3}', literal[position + 1:position + 4])
+            if octal:
+                out.append(int(octal.group(), 8) & 0xff)
+                position += 1 + len(octal.group())
+                continue
+            out += PDF_ESCAPES.get(following, following)
+            position += 2
+            continue
+        out += byte
+        position += 1
+    return out.decode('latin-1')
+
+
+def extract_pdf_text(path):
+    # text shown by the Tj/TJ operators of the content streams, good enough for keyword search of
+    # resumes written by word processors, not a layout preserving PDF parser
+    with open(path, 'rb') as resume:
+        data = resume.read()
+    chunks = []
+    for dictionary, stream in PDF_STREAM_RE.findall(data):
+        if b'FlateDecode' in dictionary:
+            try:
+                stream = zlib.decompress(stream)
+            except zlib.error:
+                continue
+        elif b'/Filter' in dictionary:
+            continue
+        for block in PDF_TEXT_BLOCK_RE.findall(stream):
+            for shown in PDF_STRING_RE.findall(block):
+                if shown.startswith(b'['):
+                    chunks.append(''.join(_pdf_string(part) for part in re.findall(rb'\((?:\\.|[^\\)])*\)', shown)))
+                else:
+                    chunks.append(_pdf_string(shown))
+            chunks.append('\n')
+    return ' '.join(chunks)
+
+
+EXTRACTORS = {'.txt': extract_plain_text, '.text': extract_plain_text, '.md': extract_plain_text,
+              '.docx': extract_docx_text, '.pdf': extract_pdf_text}
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ' '.join(text.split())[:MAX_TEXT_LENGTH]
+
+
+def tokenize(text):
+    # distinct tokens in order of first appearance
+    return list(dict.fromkeys(token for token in TOKEN_RE.findall(text) if len(token) > 1))
+
+
+def _known_hash(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if CONTENT_HASH_RE.match(stem) else None
+
+
+def content_hash(name, path):
+    # content addressed names already are the hash, older uploads are hashed
+    if _known_hash(name):
+        return _known_hash(name)
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as resume:
+        for chunk in iter(lambda: resume.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def extract_resume(args):
+    # runs in the worker processes: (name, sha256, normalized text, error)
+    name, path, sha256 = args
+    if not os.path.exists(path):
+        return name, None, '', 'missing file'
+    try:
+        sha256 = sha256 or content_hash(name, path)
+        extractor = EXTRACTORS.get(os.path.splitext(name)[1].lower())
+        if extractor is None:
+            return name, sha256, '', 'unsupported file type'
+        return name, sha256, normalize_text(extractor(path)), ''
+    except Exception as error:
+        return name, sha256, '', '{}: {}'.format(type(error).__name__, error)[:255]
+
+
+def pending_candidates():
+    # candidates whose resume changed since its text was linked, including removed resumes
+    return Candidate.objects.annotate(current_resume=Coalesce('resume', Value(''))) \
+        .exclude(resume_text_source=F('current_resume'))
+
+
+def process_batch(rows, pool=None):
+    # rows of (candidate id, resume name), returns the number of files extracted
+    by_name = {}
+    for candidate_id, name in rows:
+        by_name.setdefault(name, []).append(candidate_id)
+    known = dict(ResumeText.objects.filter(sha256__in=[_known_hash(name) for name in by_name if _known_hash(name)])
+                 .values_list('sha256', 'id'))
+    text_of = {}
+    work = []
+    for name in by_name:
+        if not name:
+            text_of[name] = None
+        elif known.get(_known_hash(name)):
+            # same content already extracted for someone else, or before a rebuild
+            text_of[name] = known[_known_hash(name)]
+        else:
+            work.append((name, resume_storage.path(name), _known_hash(name)))
+    results = pool.imap_unordered(extract_resume, work) if pool is not None else map(extract_resume, work)
+    for name, sha256, text, error in results:
+        if sha256 is None:
+            # missing file, nothing to link until the candidate uploads again
+            text_of[name] = None
+            continue
+        resume_text, created = ResumeText.objects.get_or_create(sha256=sha256, defaults={
+            'text': text, 'tokens': ' '.join(tokenize(text)), 'error': error, 'extracted_on': timezone.now()})
+        text_of[name] = resume_text.id
+    for name, candidate_ids in by_name.items():
+        # the resume guard skips candidates who uploaded something else meanwhile
+        resume_is = Q(resume=name) | Q(resume__isnull=True) if not name else Q(resume=name)
+        Candidate.objects.filter(resume_is, id__in=candidate_ids).update(resume_text_id=text_of[name],
+                                                                          resume_text_source=name)
+    index_candidate_resumes([candidate_id for candidate_id, name in rows])
+    bump_generation('candidate')
+    return len(work)
+
+
+def extract_pending(batch_size=DEFAULT_BATCH_SIZE, processes=1):
+    # (candidates updated, files extracted), safe to rerun at any time
+    candidates = extracted = 0
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        last_id = 0
+        while True:
+            rows = list(pending_candidates().filter(id__gt=last_id).order_by('id')
+                        .values_list('id', 'current_resume')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            extracted += process_batch(rows, pool)
+            candidates += len(rows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return candidates, extracted
+
+
+def reset_resume_texts(reextract=False):
+    # makes every candidate pending again, reextract also forgets the stored texts
+    Candidate.objects.exclude(resume_text_source='').update(resume_text_source='')
+    if reextract:
+        ResumeText.objects.all().delete()
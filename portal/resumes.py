@@ -0,0 +1,68 @@
+import os
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import Candidate, StoredResume
+from .storage import resume_storage
+
+
+# unreferenced files younger than this are kept, an upload may be on its way to being saved on a candidate
+DEFAULT_GRACE = timezone.timedelta(hours=1)
+RESUME_DIRECTORY = 'resumes'
+
+
+def referenced_resumes():
+    # {name: number of candidates}, one grouped query
+    return dict(Candidate.objects.exclude(resume='').exclude(resume__isnull=True).order_by()
+                .values('resume').annotate(total=Count('id')).values_list('resume', 'total'))
+
+
+def recount_resume_refs():
+    # repairs refs that drifted, e.g. after a queryset update() of Candidate.resume, returns the rows fixed
+    actual = referenced_resumes()
+    fixed = 0
+    for pk, name, refs in StoredResume.objects.values_list('pk', 'name', 'refs').iterator():
+        total = actual.pop(name, 0)
+        if total != refs:
+            fixed += StoredResume.objects.filter(pk=pk).update(refs=total, updated_on=timezone.now())
+    for name, total in actual.items():
+        StoredResume.objects.create(name=name, refs=total)
+        fixed += 1
+    return fixed
+
+
+def _is_recent(name, cutoff):
+    try:
+        return resume_storage.get_modified_time(name) >= cutoff
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(grace=DEFAULT_GRACE):
+    # deletes the files no candidate points at any more, returns the number of files deleted
+    cutoff = timezone.now() - grace
+    deleted = 0
+    for pk, name in StoredResume.objects.filter(refs=0, updated_on__lt=cutoff).values_list('pk', 'name'):
+        # a duplicate upload touches the existing file, it is about to be referenced again
+        if _is_recent(name, cutoff):
+            continue
+        with transaction.atomic():
+            if StoredResume.objects.filter(pk=pk, refs=0).delete()[0]:
+                resume_storage.delete(name)
+                deleted += 1
+    return deleted
+
+
+def collect_untracked(grace=DEFAULT_GRACE):
+    # files on disk with no StoredResume row and no candidate, e.g. resumes uploaded before refcounting
+    cutoff = timezone.now() - grace
+    root = resume_storage.path(RESUME_DIRECTORY)
+    referenced = set(referenced_resumes()) | set(StoredResume.objects.values_list('name', flat=True))
+    deleted = 0
+    for directory, subdirectories, files in os.walk(root):
+        for filename in files:
+            name = os.path.relpath(os.path.join(directory, filename), resume_storage.location).replace('\\', '/')
+            if name not in referenced and not _is_recent(name, cutoff):
+                resume_storage.delete(name)
+                deleted += 1
+    return deleted
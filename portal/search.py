@@ -0,0 +1,185 @@
+import re
+from django.db import connections, router
+from django.db.models import Q
+
+
+# full text index over recruiter.Job, one row per job with rowid = job id
+JOB_INDEX_TABLE = 'portal_job_fts'
+JOB_INDEX_FIELDS = ('headline', 'description', 'requirements', 'company_name')
+# bm25 column weights, in the same order as JOB_INDEX_FIELDS
+JOB_INDEX_WEIGHTS = (10.0, 1.0, 2.0, 5.0)
+
+# full text index over the extracted resume tokens, one row per candidate with rowid = candidate id
+CANDIDATE_RESUME_INDEX_TABLE = 'portal_candidate_resume_fts'
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _job_model():
+    from recruiter.models import Job
+    return Job
+
+
+def _job_connection():
+    return connections[router.db_for_write(_job_model())]
+
+
+def fts_supported(connection):
+    return connection.vendor == 'sqlite'
+
+
+def create_job_index(connection=None):
+    connection = connection or _job_connection()
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5({1}, tokenize='porter unicode61')".format(
+                JOB_INDEX_TABLE, ', '.join(JOB_INDEX_FIELDS)))
+
+
+def rebuild_job_index(connection=None):
+    connection = connection or _job_connection()
+    if not fts_supported(connection):
+        return 0
+    job_table = _job_model()._meta.db_table
+    columns = ', '.join(JOB_INDEX_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS {0}".format(JOB_INDEX_TABLE))
+    create_job_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {0}(rowid, {1}) SELECT id, {1} FROM {2}".format(
+            JOB_INDEX_TABLE, columns, job_table))
+        cursor.execute("INSERT INTO {0}({0}) VALUES ('optimize')".format(JOB_INDEX_TABLE))
+        cursor.execute("SELECT COUNT(*) FROM {0}".format(JOB_INDEX_TABLE))
+        return cursor.fetchone()[0]
+
+
+def index_job(instance, sender, *args, **kwargs):
+    connection = connections[kwargs.get('using') or router.db_for_write(sender)]
+    if not fts_supported(connection):
+        return
+    values = [instance.pk] + [getattr(instance, field) or '' for field in JOB_INDEX_FIELDS]
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0} WHERE rowid = %s".format(JOB_INDEX_TABLE), [instance.pk])
+        cursor.execute("INSERT INTO {0}(rowid, {1}) VALUES ({2})".format(
+            JOB_INDEX_TABLE, ', '.join(JOB_INDEX_FIELDS), ', '.join(['%s'] * len(values))), values)
+
+
+def unindex_job(instance, sender, *args, **kwargs):
+    connection = connections[kwargs.get('using') or router.db_for_write(sender)]
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0} WHERE rowid = %s".format(JOB_INDEX_TABLE), [instance.pk])
+
+
+def create_job_index_after_migrate(sender, using='default', *args, **kwargs):
+    # the signal handlers above expect the table, it is created once per migrate instead of per save
+    if sender.label == 'recruiter':
+        create_job_index(connections[using])
+
+
+def parse_search_terms(text):
+    return TERM_RE.findall((text or '').lower())
+
+
+def build_match_query(text):
+    # every term must match, the last one as a prefix so "pyth" finds python
+    terms = parse_search_terms(text)
+    if not terms:
+        return ''
+    quoted = ['"{}"'.format(term) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+# restricts a Job queryset to jobs matching text, best bm25 match first
+def search_jobs(queryset, text):
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    connection = connections[queryset.db]
+    if not fts_supported(connection):
+        condition = Q()
+        for term in parse_search_terms(text):
+            term_condition = Q()
+            for field in JOB_INDEX_FIELDS:
+                term_condition |= Q(**{field + '__icontains': term})
+            condition &= term_condition
+        return queryset.filter(condition)
+    job_table = queryset.model._meta.db_table
+    rank = 'bm25({0}, {1})'.format(JOB_INDEX_TABLE, ', '.join(str(w) for w in JOB_INDEX_WEIGHTS))
+    return queryset.extra(
+        select={'search_rank': rank},
+        tables=[JOB_INDEX_TABLE],
+        where=['{0}.rowid = {1}.id'.format(JOB_INDEX_TABLE, job_table),
+               '{0} MATCH %s'.format(JOB_INDEX_TABLE)],
+        params=[match],
+    ).order_by('search_rank', '-id')
+
+
+def _candidate_connection():
+    from portal.models import Candidate
+    return connections[router.db_for_write(Candidate)]
+
+
+def create_candidate_resume_index(connection=None):
+    connection = connection or _candidate_connection()
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5(tokens, tokenize='porter unicode61')"
+                       .format(CANDIDATE_RESUME_INDEX_TABLE))
+
+
+def index_candidate_resumes(candidate_ids, connection=None):
+    # (re)indexes the resume tokens of the given candidates, as linked by portal.resume_text
+    from portal.models import Candidate, ResumeText
+    connection = connection or _candidate_connection()
+    if not fts_supported(connection) or not candidate_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(candidate_ids))
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0} WHERE rowid IN ({1})".format(CANDIDATE_RESUME_INDEX_TABLE, placeholders),
+                       list(candidate_ids))
+        cursor.execute(
+            "INSERT INTO {0}(rowid, tokens) SELECT c.id, r.tokens FROM {1} c INNER JOIN {2} r "
+            "ON c.resume_text_id = r.id WHERE c.id IN ({3}) AND r.tokens != ''".format(
+                CANDIDATE_RESUME_INDEX_TABLE, Candidate._meta.db_table, ResumeText._meta.db_table, placeholders),
+            list(candidate_ids))
+
+
+def unindex_candidate_resume(instance, sender, *args, **kwargs):
+    connection = connections[kwargs.get('using') or router.db_for_write(sender)]
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0} WHERE rowid = %s".format(CANDIDATE_RESUME_INDEX_TABLE), [instance.pk])
+
+
+def create_candidate_resume_index_after_migrate(sender, using='default', *args, **kwargs):
+    # like the job index, created once per migrate instead of per indexing call
+    if sender.label == 'portal':
+        create_candidate_resume_index(connections[using])
+
+
+# restricts a Candidate queryset to candidates whose resume matches text, best bm25 match first
+def search_candidate_resumes(queryset, text):
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    connection = connections[queryset.db]
+    if not fts_supported(connection):
+        condition = Q()
+        for term in parse_search_terms(text):
+            condition &= Q(resume_text__tokens__icontains=term)
+        return queryset.filter(condition)
+    candidate_table = queryset.model._meta.db_table
+    return queryset.extra(
+        select={'search_rank': 'bm25({0})'.format(CANDIDATE_RESUME_INDEX_TABLE)},
+        tables=[CANDIDATE_RESUME_INDEX_TABLE],
+        where=['{0}.rowid = {1}.id'.format(CANDIDATE_RESUME_INDEX_TABLE, candidate_table),
+               '{0} MATCH %s'.format(CANDIDATE_RESUME_INDEX_TABLE)],
+        params=[match],
+    ).order_by('search_rank', '-id')
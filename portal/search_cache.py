@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import transaction
+
+
+GENERATION_KEY = 'portal:search_generation:{}'
+SEARCH_CACHE_MAX_ENTRIES = 500
+# result lists longer than this are not worth keeping in memory
+SEARCH_CACHE_MAX_IDS = 20000
+
+
+def generation_cache():
+    # every worker has to see the bumps of the others, GENERATION_CACHE names a cache they share
+    return caches[getattr(settings, 'GENERATION_CACHE', DEFAULT_CACHE_ALIAS)]
+
+
+def new_generation():
+    # a generation lost to eviction restarts from the clock, never from a value it had before
+    return int(time.time() * 1000000)
+
+
+def get_generation(name):
+    return generation_cache().get_or_set(GENERATION_KEY.format(name), new_generation, None)
+
+
+def bump_generation(name):
+    cache = generation_cache()
+    try:
+        cache.incr(GENERATION_KEY.format(name))
+    except ValueError:
+        cache.set(GENERATION_KEY.format(name), new_generation(), None)
+
+
+def bump_generation_on_commit(name):
+    # bumped before the commit, another worker could cache the old rows under the new generation
+    transaction.on_commit(lambda: bump_generation(name))
+
+
+class LocalGenerations(object):
+    # process local LRU of {name: (generation, checked at)}, a generation is read from the shared cache
+    # at most once per check_interval seconds, forget() makes this process read it again at once
+
+    def __init__(self, check_interval, max_entries):
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and now - entry[1] < self.check_interval:
+                self._entries.move_to_end(name)
+                return entry[0]
+        generation = get_generation(name)
+        with self._lock:
+            self._entries[name] = (generation, now)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return generation
+
+    def forget(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def normalize_filter_params(filterset):
+    # only the filters of the filterset, without blanks, in a stable order
+    data = filterset.data
+    params = []
+    for name in sorted(filterset.filters):
+        values = data.getlist(name) if hasattr(data, 'getlist') else [data.get(name)]
+        values = [str(value).strip() for value in values if value is not None and str(value).strip()]
+        if name == 'q':
+            values = [value.lower() for value in values]
+        if values:
+            params.append((name, sorted(values)))
+    return tuple((name, tuple(values)) for name, values in params)
+
+
+class SearchResultCache(object):
+    # process local LRU of {normalized filter params: ordered matching ids}, an entry
+    # is only served while the generation of its model is the one it was stored under
+
+    def __init__(self, name, max_entries=SEARCH_CACHE_MAX_ENTRIES, max_ids=SEARCH_CACHE_MAX_IDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_ids(self, filterset, compute=None):
+        # compute(filterset) may answer from somewhere cheaper than the queryset, or return None
+        key = normalize_filter_params(filterset)
+        generation = get_generation(self.name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        ids = compute(filterset) if compute is not None else None
+        if ids is None:
+            ids = tuple(filterset.qs.values_list('id', flat=True))
+        if len(ids) <= self.max_ids:
+            with self._lock:
+                self._entries[key] = (generation, ids)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'name': self.name, 'entries': len(self._entries), 'max_entries': self.max_entries,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0}
+
+
+job_search_cache = SearchResultCache('job')
+candidate_search_cache = SearchResultCache('candidate')
+
+
+def fetch_in_order(queryset, ids):
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def invalidate_job_search(*args, **kwargs):
+    # m2m_changed fires before and after every change, the post_ one is enough
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_generation_on_commit('job')
+
+
+def invalidate_candidate_search(*args, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_generation_on_commit('candidate')
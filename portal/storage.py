@@ -0,0 +1,81 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.deconstruct import deconstructible
+
+
+HASH_CHUNK_SIZE = 64 * 1024
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    # streams uploads too large for memory to a temp file and hashes them on the way,
+    # so ContentAddressedStorage does not read them a second time
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # files are stored under <upload_to>/<first 2 hex>/<sha256><ext>, identical uploads share one file.
+    # files are never overwritten or deleted here, the gc_resumes command removes the unreferenced ones
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory, original = os.path.split(name)
+        extension = os.path.splitext(original)[1].lower()
+        extension = extension if EXTENSION_RE.match(extension) else ''
+        temporary_path = getattr(content, 'temporary_file_path', None)
+        digest = getattr(content, 'sha256', None)
+        spooled = temporary_path is None or digest is None
+        if spooled:
+            source, digest = self._spool(content)
+        else:
+            source = temporary_path()
+        name = os.path.join(directory, digest[:2], digest + extension).replace('\\', '/')
+        path = self.path(name)
+        try:
+            if os.path.exists(path):
+                # already stored, refreshing the mtime keeps the gc grace period away from it
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # a rename when possible, a concurrent upload of the same content replaces it with the same bytes
+                file_move_safe(source, path, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        finally:
+            if spooled and os.path.exists(source):
+                os.remove(source)
+        return name
+
+    def _spool(self, content):
+        # in-memory uploads and plain files: one pass writing a temp file beside the target and hashing it
+        os.makedirs(self.location, exist_ok=True)
+        sha256 = hashlib.sha256()
+        descriptor, source = tempfile.mkstemp(prefix='.upload-', dir=self.location)
+        with os.fdopen(descriptor, 'wb') as spooled:
+            for chunk in content.chunks(HASH_CHUNK_SIZE):
+                sha256.update(chunk)
+                spooled.write(chunk)
+        return source, sha256.hexdigest()
+
+
+resume_storage = ContentAddressedStorage()
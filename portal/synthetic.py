@@ -0,0 +1,230 @@
+import itertools
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from .models import Role, Skill, Industry, Qualification, City, Candidate, Proposal, Package, Recharge, \
+    EXPERIENCE_CHOICES, experience_range, package_details
+from recruiter.models import Recruiter, Job, CandidateLike, JOB_TYPE_CHOICES, RECRUITER_TYPES
+
+
+# every synthetic user can log in with this password
+SYNTHETIC_PASSWORD = 'synthetic'
+SYNTHETIC_PREFIX = 'synthetic'
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_SIZES = {'candidates': 10000, 'recruiters': 500, 'jobs': 5000, 'proposals': 50000, 'likes': 10000,
+                 'recharges': 12000}
+LOOKUP_SIZES = ((Role, 60), (Skill, 400), (Industry, 30), (Qualification, 25), (City, 200))
+# weight of the n-th most popular skill, city, ... is 1 / n ** ZIPF_EXPONENT, a few are very common
+ZIPF_EXPONENT = 1.1
+EXPERIENCE_WEIGHTS = (5, 20, 25, 25, 12, 6, 4, 3)
+CANDIDATE_SKILLS = (3, 8)
+CANDIDATE_ROLES = (1, 3)
+JOB_SKILLS = (2, 6)
+JOB_QUALIFICATIONS = (0, 2)
+PACKAGE_VALIDITY_DAYS = 30
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class WeightedPicker(object):
+    # random picks from a fixed population, popular items first in it
+
+    def __init__(self, rng, population, weights=None):
+        self.rng = rng
+        self.population = list(population)
+        self.cumulative = list(itertools.accumulate(weights or zipf_weights(len(self.population))))
+
+    def one(self):
+        return self.rng.choices(self.population, cum_weights=self.cumulative)[0]
+
+    def distinct(self, low, high):
+        count = min(self.rng.randint(low, high), len(self.population))
+        picked = set()
+        while len(picked) < count:
+            picked.add(self.one())
+        return picked
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_create(model, objects, chunk_size):
+    # objects may be a generator, at most chunk_size of them are in memory at once.
+    # django splits each chunk further when the backend limits the rows per INSERT, like sqlite
+    created = 0
+    for chunk in chunked(objects, chunk_size):
+        model.objects.bulk_create(chunk)
+        created += len(chunk)
+    return created
+
+
+def ensure_lookup_rows(rng):
+    # fills up Role, Skill, ... to LOOKUP_SIZES, returns {model: [ids]} in a shuffled popularity order
+    lookups = {}
+    for model, size in LOOKUP_SIZES:
+        missing = size - model.objects.count()
+        if missing > 0:
+            start = model.objects.count() + 1
+            model.objects.bulk_create([model(name='{} {}'.format(model._meta.verbose_name.title(), number))
+                                       for number in range(start, start + missing)])
+        ids = list(model.objects.values_list('id', flat=True))
+        rng.shuffle(ids)
+        lookups[model] = ids
+    return lookups
+
+
+def unique_pairs(rng, first, second, count):
+    # up to count distinct (first, second) pairs, fewer when there are not that many
+    pairs = set()
+    attempts = 0
+    while len(pairs) < count and attempts < count * 10:
+        pairs.add((first.one(), second.one()))
+        attempts += 1
+    return sorted(pairs)
+
+
+def create_users(prefix, kind, count, chunk_size):
+    password = make_password(SYNTHETIC_PASSWORD)
+    usernames = ['{}-{}{}'.format(prefix, kind, number) for number in range(count)]
+    bulk_create(User, (User(username=username, email='{}@example.com'.format(username), password=password)
+                            for username in usernames), chunk_size)
+    # bulk_create does not set the ids on every database, read them back in order
+    ids = dict(User.objects.filter(username__startswith='{}-{}'.format(prefix, kind)).values_list('username', 'id'))
+    return [ids[username] for username in usernames]
+
+
+def _experience(rng):
+    return rng.choices([value for value, label in EXPERIENCE_CHOICES], weights=EXPERIENCE_WEIGHTS)[0]
+
+
+def seed(prefix=SYNTHETIC_PREFIX, chunk_size=DEFAULT_CHUNK_SIZE, random_seed=0, **sizes):
+    # bulk creates users, candidates, recruiters, jobs, proposals, likes and recharges without signals,
+    # the caller rebuilds counters and indexes afterwards. returns {model label: rows created}
+    sizes = dict(DEFAULT_SIZES, **sizes)
+    rng = random.Random(random_seed)
+    created = {}
+    with transaction.atomic():
+        lookups = ensure_lookup_rows(rng)
+        pickers = {model: WeightedPicker(rng, ids) for model, ids in lookups.items()}
+        names = {model: dict(model.objects.values_list('id', 'name')) for model in (Role, Skill)}
+
+        candidate_users = create_users(prefix, 'c', sizes['candidates'], chunk_size)
+        recruiter_users = create_users(prefix, 'r', sizes['recruiters'], chunk_size)
+        created['auth.user'] = len(candidate_users) + len(recruiter_users)
+
+        def candidates():
+            for number, user_id in enumerate(candidate_users):
+                experience = _experience(rng)
+                experience_min, experience_max = experience_range(experience)
+                yield Candidate(user_id=user_id, full_name='Synthetic Candidate {}'.format(number),
+                                email='{}-c{}@example.com'.format(prefix, number), phone='9{:09d}'.format(number),
+                                experience=experience, experience_min=experience_min, experience_max=experience_max,
+                                qualification_id=pickers[Qualification].one(), industry_id=pickers[Industry].one(),
+                                city_id=pickers[City].one(), email_confirmed=True)
+
+        created['portal.candidate'] = bulk_create(Candidate, candidates(), chunk_size)
+        candidate_ids = dict(Candidate.objects.filter(user__username__startswith='{}-c'.format(prefix))
+                             .values_list('user_id', 'id'))
+        candidate_ids = [candidate_ids[user_id] for user_id in candidate_users]
+        created['portal.candidate_skills'] = bulk_create(Candidate.skills.through, (
+            Candidate.skills.through(candidate_id=candidate_id, skill_id=skill_id) for candidate_id in candidate_ids
+            for skill_id in pickers[Skill].distinct(*CANDIDATE_SKILLS)), chunk_size)
+        created['portal.candidate_roles'] = bulk_create(Candidate.roles.through, (
+            Candidate.roles.through(candidate_id=candidate_id, role_id=role_id) for candidate_id in candidate_ids
+            for role_id in pickers[Role].distinct(*CANDIDATE_ROLES)), chunk_size)
+
+        created['recruiter.recruiter'] = bulk_create(Recruiter, (
+            Recruiter(user_id=user_id, full_name='Synthetic Recruiter {}'.format(number),
+                      email='{}-r{}@example.com'.format(prefix, number), recruiter_type=rng.choice(RECRUITER_TYPES)[0],
+                      email_confirmed=True)
+            for number, user_id in enumerate(recruiter_users)), chunk_size)
+        recruiter_ids = dict(Recruiter.objects.filter(user__username__startswith='{}-r'.format(prefix))
+                             .values_list('user_id', 'id'))
+        recruiter_ids = [recruiter_ids[user_id] for user_id in recruiter_users]
+        # a few recruiters post most of the jobs and like most of the candidates
+        recruiter_picker = WeightedPicker(rng, recruiter_ids)
+        candidate_picker = WeightedPicker(rng, candidate_ids, zipf_weights(len(candidate_ids), 0.5))
+
+        def jobs():
+            for number in range(sizes['jobs'] if recruiter_ids else 0):
+                role_id = pickers[Role].one()
+                experience = _experience(rng)
+                experience_min, experience_max = experience_range(experience)
+                salary_from = rng.randrange(8000, 80000, 1000)
+                skills = ', '.join(names[Skill][skill_id] for skill_id in pickers[Skill].distinct(*JOB_SKILLS))
+                yield Job(posted_by_id=recruiter_picker.one(), role_id=role_id, industry_id=pickers[Industry].one(),
+                          city_id=pickers[City].one(), experience=experience, experience_min=experience_min,
+                          experience_max=experience_max, job_type=rng.choice(JOB_TYPE_CHOICES)[0],
+                          headline='required {} ({})'.format(names[Role][role_id], number),
+                          company_name='Synthetic Company {}'.format(rng.randrange(sizes['recruiters'] * 2 or 1)),
+                          salary_from=salary_from, salary_upto=salary_from + rng.randrange(0, 40000, 1000),
+                          description='looking for {}'.format(skills), requirements=skills)
+
+        created['recruiter.job'] = bulk_create(Job, jobs(), chunk_size)
+        job_ids = list(Job.objects.filter(posted_by__user__username__startswith='{}-r'.format(prefix))
+                       .order_by('id').values_list('id', flat=True))
+        created['recruiter.job_skills'] = bulk_create(Job.skills.through, (
+            Job.skills.through(job_id=job_id, skill_id=skill_id) for job_id in job_ids
+            for skill_id in pickers[Skill].distinct(*JOB_SKILLS)), chunk_size)
+        created['recruiter.job_qualifications'] = bulk_create(Job.qualifications.through, (
+            Job.qualifications.through(job_id=job_id, qualification_id=qualification_id) for job_id in job_ids
+            for qualification_id in pickers[Qualification].distinct(*JOB_QUALIFICATIONS)), chunk_size)
+
+        if job_ids and candidate_ids:
+            job_picker = WeightedPicker(rng, job_ids, zipf_weights(len(job_ids), 0.7))
+            created['portal.proposal'] = bulk_create(Proposal, (
+                Proposal(job_id=job_id, posted_by_id=candidate_id, message='Synthetic proposal')
+                for job_id, candidate_id in unique_pairs(rng, job_picker, candidate_picker, sizes['proposals'])),
+                chunk_size)
+        if recruiter_ids and candidate_ids:
+            created['recruiter.candidatelike'] = bulk_create(CandidateLike, (
+                CandidateLike(candidate_id=candidate_id, recruiter_id=recruiter_id)
+                for candidate_id, recruiter_id in unique_pairs(rng, candidate_picker, recruiter_picker,
+                                                               sizes['likes'])), chunk_size)
+
+        created['portal.recharge'] = seed_recharges(rng, candidate_users, recruiter_users, sizes['recharges'],
+                                                    chunk_size)
+    return created
+
+
+def seed_recharges(rng, candidate_users, recruiter_users, count, chunk_size):
+    # most users recharge once, some a few times, their validity is extended by every recharge
+    packages = {}
+    for user_type in ('Candidate', 'Recruiter'):
+        packages[user_type], _ = Package.objects.get_or_create(
+            name='Synthetic {}'.format(user_type), user_type=user_type, available=False,
+            defaults={'price': 0, 'validity_days': PACKAGE_VALIDITY_DAYS, 'description': 'seed_synthetic'})
+    users = [(user_id, 'Candidate') for user_id in candidate_users] + \
+            [(user_id, 'Recruiter') for user_id in recruiter_users]
+    if not users:
+        return 0
+    rng.shuffle(users)
+    recharges = {}
+    for number in range(count):
+        # the first pass covers distinct users, the rest recharges again
+        user = users[number] if number < len(users) else rng.choice(users)
+        recharges[user] = recharges.get(user, 0) + 1
+    created = bulk_create(Recharge, (
+        Recharge(user_id=user_id, package=packages[user_type], package_details=package_details(packages[user_type]))
+        for (user_id, user_type), times in sorted(recharges.items()) for i in range(times)), chunk_size)
+    now = timezone.now()
+    by_times = {}
+    for (user_id, user_type), times in recharges.items():
+        by_times.setdefault((user_type, times), []).append(user_id)
+    models = {'Candidate': Candidate, 'Recruiter': Recruiter}
+    for (user_type, times), user_ids in by_times.items():
+        validity = now + timezone.timedelta(days=packages[user_type].validity_days * times)
+        # sqlite allows 999 parameters per statement
+        for chunk in chunked(user_ids, 500):
+            models[user_type].objects.filter(user_id__in=chunk).update(last_recharge=now, recharge_validity=validity)
+    return created
@@ -0,0 +1,166 @@
+from contextlib import ExitStack
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import views as portal_views
+from .benchmark import benchmark_client, benchmark_urls, benchmark_users
+from .backend import user_cache
+from .bitmap_index import candidate_bitmap_index
+from .middleware import profile_generations
+from .models import Candidate, Proposal
+from .reference_data import reference_data
+from .search_cache import bump_generation
+from .synthetic import seed
+from .tests import TemporaryMediaTestMixin
+from recruiter import views as recruiter_views
+from recruiter.models import Job
+
+
+PAGE_SIZES = (1, 10, 50)
+PREFIX = 'budget'
+
+# the most queries a GET of every named url may run, at any page size and after one warm up request.
+# a new url fails test_every_url_has_a_budget until it gets one, None marks urls that do not render
+QUERY_BUDGETS = {
+    'portal:home': 1,
+    'portal:login': 1,
+    'portal:register': 1,
+    'portal:profile': 7,
+    'portal:dashboard': 3,
+    'portal:update_profile': 7,
+    'portal:resume_download': 2,
+    'portal:account_activation_sent': 1,
+    'portal:job_details': 5,
+    'portal:job_search': 4,
+    'portal:search_cache_stats': 1,
+    'portal:query_profile_stats': 1,
+    'portal:metrics': 1,
+    'portal:proposal_add': 3,
+    'portal:proposal_update': 3,
+    'portal:proposal_details': 4,
+    'portal:proposal_delete': 4,
+    'portal:proposal_list': 3,
+    'portal:account': 3,
+    'portal:password_change': 1,
+    'portal:password_reset': 1,
+    'portal:password_reset_done': 1,
+    'portal:password_reset_complete': 1,
+    'recruiter:home': 1,
+    # renders recruiter/dashboard.html, which does not exist
+    'recruiter:dashboard': None,
+    'recruiter:login': 1,
+    'recruiter:register': 1,
+    'recruiter:profile': 2,
+    'recruiter:update_profile': 2,
+    'recruiter:account_activation_sent': 1,
+    'recruiter:job_post': 1,
+    'recruiter:job_list': 3,
+    'recruiter:job_details': 9,
+    'recruiter:job_update': 8,
+    'recruiter:job_delete': 3,
+    'recruiter:proposal_list': 3,
+    'recruiter:proposal_details': 3,
+    'recruiter:candidate_search': 4,
+    'recruiter:candidate_search_export': 3,
+    'recruiter:candidate_details': 5,
+    'recruiter:candidate_like_list': 4,
+    'recruiter:account': 3,
+    'recruiter:password_change': 1,
+}
+
+# requested as a staff user instead of the candidate or recruiter of benchmark_users
+STAFF_URLS = ('portal:search_cache_stats', 'portal:query_profile_stats')
+
+
+def page_size(size):
+    # every paginated view of both apps shows size rows per page
+    stack = ExitStack()
+    for module in (portal_views, recruiter_views):
+        stack.enter_context(mock.patch.object(module, 'SEARCH_PAGINATE_BY', size))
+    for view in (portal_views.ProposalListView, recruiter_views.JobListView, recruiter_views.ProposalListView,
+                 recruiter_views.CandidateLikeListView):
+        stack.enter_context(mock.patch.object(view, 'paginate_by', size))
+    return stack
+
+
+@override_settings(METRICS_TOKEN='budget')
+class QueryBudgetTests(TemporaryMediaTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        reference_data.clear()
+        seed(prefix=PREFIX, candidates=120, recruiters=2, jobs=150, proposals=300, likes=120, recharges=130)
+        call_command('reconcile_counters', stdout=StringIO())
+        # more proposals than the biggest page for the candidate the urls are requested as
+        candidate = benchmark_users(PREFIX)['portal'][1]['candidate']
+        proposed = set(candidate.proposal_set.values_list('job_id', flat=True))
+        Proposal.objects.bulk_create([Proposal(job_id=job_id, posted_by=candidate)
+                                      for job_id in Job.objects.values_list('id', flat=True)
+                                      if job_id not in proposed][:max(PAGE_SIZES)])
+        call_command('reconcile_counters', stdout=StringIO())
+        candidate_bitmap_index.rebuild()
+        bump_generation('job')
+        bump_generation('candidate')
+        cls.staff = User.objects.create(username='{}-staff'.format(PREFIX), is_staff=True)
+
+    def setUp(self):
+        self.urls = [(name, path, self.staff if name in STAFF_URLS else user)
+                     for name, path, user in benchmark_urls(benchmark_users(PREFIX))]
+        self.clients = {}
+        # the synthetic candidates have no resume, the one the urls point at gets a file to download
+        self.use_temporary_media_root()
+        candidate = benchmark_users(PREFIX)['portal'][1]['candidate']
+        name = Candidate.resume.field.storage.save('resumes/{}.txt'.format(candidate.pk), ContentFile(b'resume'))
+        Candidate.objects.filter(pk=candidate.pk).update(resume=name)
+        # reference tables, profiles and cached users compare their generation every few seconds, not per request
+        for local_generations in (reference_data, profile_generations, user_cache.generations):
+            patcher = mock.patch.object(local_generations, 'check_interval', 3600)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, path, user):
+        if user.pk not in self.clients:
+            self.clients[user.pk] = benchmark_client(user)
+        response = self.clients[user.pk].get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def assertWithinBudget(self, name, budget, queries):
+        if len(queries) > budget:
+            self.fail('{} ran {} queries, its budget is {}:\n{}'.format(name, len(queries), budget, '\n'.join(
+                '{}. {}'.format(number, query['sql']) for number, query in enumerate(queries, start=1))))
+
+    def test_every_url_has_a_budget(self):
+        self.assertEqual(sorted(name for name, path, user in self.urls), sorted(QUERY_BUDGETS))
+
+    def test_queries_stay_within_budget_at_every_page_size(self):
+        counts = {}
+        for size in PAGE_SIZES:
+            with page_size(size):
+                for name, path, user in self.urls:
+                    budget = QUERY_BUDGETS.get(name)
+                    if budget is None:
+                        continue
+                    with self.subTest(url=name, page_size=size):
+                        # fills the per process caches, user, profile, reference data and search results
+                        self.get(path, user)
+                        with CaptureQueriesContext(connection) as queries:
+                            response = self.get(path, user)
+                        self.assertEqual(response.status_code, 200)
+                        self.assertWithinBudget(name, budget, queries)
+                        counts.setdefault(name, {})[size] = len(queries)
+                        page_obj = response.context.get('page_obj') if response.context else None
+                        if page_obj is not None:
+                            # the dataset fills every page, a budget is only meaningful for full pages
+                            self.assertEqual(len(page_obj.object_list), size)
+        for name, by_size in counts.items():
+            with self.subTest(url=name):
+                self.assertEqual(len(set(by_size.values())), 1,
+                                 '{} runs more queries for bigger pages: {}'.format(name, by_size))
@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# settings naming directories the code writes to, the test run gets temporary ones
+TEMPORARY_DIRECTORY_SETTINGS = ('BITMAP_INDEX_DIR', 'METRICS_DIR')
+# a TestCase never commits, other threads would not see its rows
+TEST_SETTINGS = {'MATCHING_REBUILD_IN_BACKGROUND': False}
+
+
+class PortalTestRunner(DiscoverRunner):
+    # files written for the test databases, like the bitmap index or the metrics snapshots, never land
+    # in the directories of the development server
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temporary_directory = tempfile.mkdtemp(prefix='smp-tests-')
+        overrides = dict(TEST_SETTINGS)
+        overrides.update((name, os.path.join(self.temporary_directory, name.lower()))
+                         for name in TEMPORARY_DIRECTORY_SETTINGS)
+        self.settings_override = override_settings(**overrides)
+        self.settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.settings_override.disable()
+        shutil.rmtree(self.temporary_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
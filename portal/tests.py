@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import zipfile
+import zlib
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.files.base import ContentFile
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.db import connection, transaction
+from django.http import HttpResponse, QueryDict
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from .alerts import match_new_jobs, matching_candidates, queue_digests
+from .backend import EmailAuthenticate, user_cache, user_generation_name
+from .bitmap_index import ALL, BitmapIndex, candidate_bitmap_index
+from .benchmark import run_benchmark
+from .filters import JobFilter
+from .search import JOB_INDEX_TABLE, build_match_query, search_jobs
+from .search_cache import GENERATION_KEY, SearchResultCache, bump_generation, generation_cache, get_generation
+from .forms import UpdateProfileForm
+from .matching import MATCH_WEIGHTS, CandidateSnapshot, best_matches, forget_candidate_snapshot, \
+    get_candidate_snapshot
+from .mail import CLAIM_TIMEOUT_SECONDS, claim_batch, queue_mail, send_queued
+from .metrics import RETIRED_NAME, ProcessMetrics, collect, email_queue_depth, render_metrics
+from .middleware import ProfileMiddleware, QueryProfileMiddleware, invalidate_profile, profile_generation_name, \
+    profile_generations
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .models import Role, Skill, Industry, Qualification, City, Candidate, Proposal, Package, Recharge, \
+    OutgoingEmail, JobAlert, StoredResume, ResumeText, JobRecommendation, EXPERIENCE_OPEN_MAX
+from .recommendations import PENDING_CHUNKS_PER_PROCESS, compute_recommendations, load_candidate_chunk, score_chunk
+from .query_profiler import normalize_sql, query_profiles
+from .recharge import make_recharge
+from .reference_data import reference_data, reference_generation_name, attach_reference_data
+from .resume_text import extract_pending, reset_resume_texts
+from .resumes import collect_garbage, recount_resume_refs
+from .storage import resume_storage
+from .synthetic import seed
+from recruiter.filters import CandidateFilter
+from recruiter.models import Recruiter, Job, CandidateLike
+
+
+def explain_query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def create_lookup_rows():
+    for model in (Role, Skill, Industry, Qualification, City):
+        model.objects.create(id=1, name='{} 1'.format(model.__name__))
+
+
+class QueryPlanTestMixin(object):
+
+    def assertNoTableScan(self, queryset, table):
+        plan = explain_query_plan(queryset)
+        # "SCAN TABLE x" on older sqlite, "SCAN x" on newer ones, without "USING ... INDEX" both read every row
+        scans = [step for step in plan
+                 if step.startswith(('SCAN TABLE {}'.format(table), 'SCAN {}'.format(table))) and 'INDEX' not in step]
+        self.assertFalse(scans, 'full scan of {} in plan: {}'.format(table, plan))
+
+
+class CommitHooksTestMixin(object):
+
+    def run_commit_hooks(self):
+        # TestCase never commits, runs the transaction.on_commit() callbacks queued so far
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for savepoint_ids, callback in callbacks:
+            callback()
+
+
+class CursorPagesTestMixin(object):
+
+    def walk_cursor_pages(self, url, params, object_name, queries_per_page):
+        # ids of every page, following the next cursors, each page within queries_per_page
+        pages, params = [], dict(params)
+        # a generation check falling due in the middle of the walk would add queries to one page
+        for local_generations in (reference_data, profile_generations, user_cache.generations):
+            patcher = mock.patch.object(local_generations, 'check_interval', 3600)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the first request puts the user into the process local cache of portal.backend
+        self.client.get(url, params)
+        while True:
+            with self.assertNumQueries(queries_per_page):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([obj.id for obj in response.context[object_name]])
+            page_obj = response.context['page_obj']
+            if not page_obj.has_next():
+                return pages
+            params['cursor'] = page_obj.next_cursor
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is sqlite specific')
+class JobFilterQueryPlanTests(QueryPlanTestMixin, TestCase):
+
+    common_filters = [
+        {'role': '1'},
+        {'city': '1'},
+        {'industry': '1'},
+        {'city': '1', 'role': '1'},
+        {'city': '1', 'role': '1', 'salary_from': '10000'},
+        {'city': '1', 'role': '1', 'salary_from': '10000', 'salary_upto': '50000'},
+        {'role': '1', 'salary_from': '10000'},
+        {'industry': '1', 'experience': '2-4'},
+        {'experience': '2-4'},
+        {'experience': '2-4', 'salary_from': '10000'},
+        {'salary_from': '10000'},
+        {'salary_from': '10000', 'salary_upto': '50000'},
+        {'experience_years': '3'},
+        {'city': '1', 'experience_years': '3'},
+        {'q': 'teacher', 'city': '1'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        # model choice filters only validate against existing rows
+        create_lookup_rows()
+
+    def test_common_filters_use_an_index(self):
+        for data in self.common_filters:
+            with self.subTest(filters=data):
+                job_filter = JobFilter(data, queryset=Job.objects.all())
+                self.assertNoTableScan(job_filter.qs, Job._meta.db_table)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 is sqlite specific')
+class JobSearchTests(TestCase):
+
+    def setUp(self):
+        self.recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+
+    def create_job(self, **fields):
+        return Job.objects.create(posted_by=self.recruiter, **fields)
+
+    def search(self, text):
+        return list(search_jobs(Job.objects.all(), text).values_list('id', flat=True))
+
+    def test_index_table_is_created_by_migrate(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = %s", [JOB_INDEX_TABLE])
+            self.assertEqual(cursor.fetchall(), [(JOB_INDEX_TABLE,)])
+
+    def test_every_term_must_match_the_last_as_a_prefix(self):
+        self.assertEqual(build_match_query('Python, Django dev'), '"python" "django" "dev"*')
+        self.assertEqual(build_match_query(' !? '), '')
+        python = self.create_job(headline='python developer', description='django and postgres')
+        self.create_job(headline='java developer', description='spring')
+        self.assertEqual(self.search('pyth'), [python.id])
+        self.assertEqual(self.search('developer django'), [python.id])
+        self.assertEqual(self.search('developer ruby'), [])
+
+    def test_blank_text_leaves_the_queryset_alone(self):
+        self.create_job(headline='python developer')
+        self.assertEqual(search_jobs(Job.objects.all(), '  ').count(), 1)
+
+    def test_headline_matches_rank_first(self):
+        in_description = self.create_job(headline='developer', description='knows python')
+        in_headline = self.create_job(headline='python developer', description='knows java')
+        self.assertEqual(self.search('python'), [in_headline.id, in_description.id])
+
+    def test_saves_updates_and_deletes_reach_the_index(self):
+        job = self.create_job(headline='python developer')
+        job.headline = 'golang developer'
+        job.save()
+        self.assertEqual(self.search('python'), [])
+        self.assertEqual(self.search('golang'), [job.id])
+        job.delete()
+        self.assertEqual(self.search('golang'), [])
+
+    def test_other_databases_fall_back_to_icontains(self):
+        python = self.create_job(headline='Python developer', company_name='Acme')
+        self.create_job(headline='Java developer', company_name='Acme')
+        with mock.patch('portal.search.fts_supported', return_value=False):
+            jobs = search_jobs(Job.objects.all(), 'acme PYTHON')
+            self.assertNotIn(JOB_INDEX_TABLE, str(jobs.query))
+            self.assertEqual(list(jobs), [python])
+
+
+class JobFacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reference_data.clear()
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        self.pune, self.delhi = City.objects.create(name='Pune'), City.objects.create(name='Delhi')
+        self.teacher, self.driver = Role.objects.create(name='Teacher'), Role.objects.create(name='Driver')
+        for city, role, experience, job_type in ((self.pune, self.teacher, '2-4', 'Full Time'),
+                                                 (self.pune, self.driver, '2-4', 'Part Time'),
+                                                 (self.delhi, self.teacher, '0-1', 'Full Time')):
+            Job.objects.create(posted_by=recruiter, city=city, role=role, experience=experience, job_type=job_type,
+                               headline='job')
+
+    def test_counts_follow_the_other_filters(self):
+        facets = JobFilter({'city': str(self.pune.pk)}, queryset=Job.objects.all()).facets
+        self.assertEqual(facets['role'], {self.teacher.pk: 1, self.driver.pk: 1})
+        self.assertEqual(facets['city'], {self.pune.pk: 2})
+        self.assertEqual(facets['experience'], {'2-4': 2})
+        self.assertEqual(facets['job_type'], {'Full Time': 1, 'Part Time': 1})
+
+    def test_options_are_labelled_with_their_counts(self):
+        job_filter = JobFilter({}, queryset=Job.objects.all())
+        job_filter.add_facet_counts()
+        cities = dict(job_filter.form.fields['city'].choices)
+        self.assertEqual((cities[self.pune.pk], cities[self.delhi.pk]), ('Pune (2)', 'Delhi (1)'))
+        self.assertEqual(dict(job_filter.form.fields['role'].choices)[self.driver.pk], 'Driver (1)')
+        experience = dict(job_filter.form.fields['experience'].choices)
+        self.assertEqual((experience['2-4'], experience['10+']), ('2-4 years (2)', '10+ years (0)'))
+        self.assertEqual(job_filter.job_type_facets, [('Full Time', 2), ('Part Time', 1)])
+
+    def test_counts_are_cached_until_the_job_generation_moves(self):
+        self.assertEqual(JobFilter({}, queryset=Job.objects.all()).facets['city'], {self.pune.pk: 2, self.delhi.pk: 1})
+        Job.objects.filter(city=self.delhi).update(city=self.pune)
+        self.assertEqual(JobFilter({}, queryset=Job.objects.all()).facets['city'], {self.pune.pk: 2, self.delhi.pk: 1})
+        bump_generation('job')
+        self.assertEqual(JobFilter({}, queryset=Job.objects.all()).facets['city'], {self.pune.pk: 3})
+
+
+class SearchResultCacheTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        self.recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        self.job = Job.objects.create(posted_by=self.recruiter, headline='python developer')
+        self.run_commit_hooks()
+        self.cache = SearchResultCache('job')
+
+    def get_ids(self):
+        return self.cache.get_ids(JobFilter({}, queryset=Job.objects.order_by('id')))
+
+    def test_bumps_of_other_workers_are_seen(self):
+        self.assertEqual(self.get_ids(), (self.job.id,))
+        other = Job.objects.create(posted_by=self.recruiter, headline='java developer')
+        self.assertEqual(self.get_ids(), (self.job.id,))
+        # what bump_generation does in the worker that saved the job
+        generation_cache().incr(GENERATION_KEY.format('job'))
+        self.assertEqual(self.get_ids(), (self.job.id, other.id))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_saves_bump_the_generation_once_committed(self):
+        generation = get_generation('job')
+        self.job.headline = 'golang developer'
+        self.job.save()
+        self.assertEqual(get_generation('job'), generation)
+        self.run_commit_hooks()
+        self.assertNotEqual(get_generation('job'), generation)
+
+    def test_an_evicted_generation_does_not_come_back(self):
+        generation = get_generation('job')
+        generation_cache().delete(GENERATION_KEY.format('job'))
+        self.assertGreater(get_generation('job'), generation)
+
+
+class BackfillExperienceTests(TestCase):
+
+    def setUp(self):
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        for number, experience in enumerate(('2-4', '10+', '')):
+            Candidate.objects.create(user=User.objects.create(username='candidate{}'.format(number)),
+                                     full_name='Candidate', experience=experience)
+            Job.objects.create(posted_by=recruiter, headline='job', experience=experience)
+        # rows written before the range columns existed
+        Candidate.objects.update(experience_min=None, experience_max=None)
+        Job.objects.update(experience_min=None, experience_max=None)
+
+    def backfill(self):
+        output = io.StringIO()
+        call_command('backfill_experience', stdout=output)
+        return output.getvalue()
+
+    def test_existing_rows_get_their_range(self):
+        output = self.backfill()
+        self.assertIn('Updated 2 candidates', output)
+        self.assertIn('Updated 2 jobs', output)
+        for model in (Candidate, Job):
+            self.assertEqual(sorted(model.objects.values_list('experience', 'experience_min', 'experience_max')),
+                             [('', None, None), ('10+', 10, EXPERIENCE_OPEN_MAX), ('2-4', 2, 4)])
+
+    def test_a_second_run_changes_nothing(self):
+        self.backfill()
+        output = self.backfill()
+        self.assertIn('Updated 0 candidates', output)
+        self.assertIn('Updated 0 jobs', output)
+        self.assertEqual(Candidate.objects.filter(experience='2-4', experience_min=2, experience_max=4).count(), 1)
+
+
+class ProposalListQueryTests(CursorPagesTestMixin, TestCase):
+    # session, candidate, page, the user itself comes from the cache of portal.backend
+    queries_per_page = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='candidate')
+        candidate = Candidate.objects.create(user=cls.user, full_name='Candidate')
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        for i in range(12):
+            job = Job.objects.create(headline='job {}'.format(i), posted_by=recruiter)
+            Proposal.objects.create(job=job, posted_by=candidate)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_page_queries_do_not_grow_with_proposals(self):
+        pages = self.walk_cursor_pages(reverse('portal:proposal_list'), {}, 'proposals', self.queries_per_page)
+        self.assertEqual([len(page) for page in pages], [10, 2])
+        self.assertEqual(sum(pages, []), list(Proposal.objects.order_by('-on', '-id').values_list('id', flat=True)))
+
+    def test_previous_cursor_returns_the_page_before(self):
+        first = self.client.get(reverse('portal:proposal_list')).context['page_obj']
+        second = self.client.get(reverse('portal:proposal_list'), {'cursor': first.next_cursor}).context['page_obj']
+        back = self.client.get(reverse('portal:proposal_list'), {'cursor': second.previous_cursor}).context['page_obj']
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertFalse(back.has_previous())
+
+    def test_tampered_cursor_serves_the_first_page(self):
+        response = self.client.get(reverse('portal:proposal_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+class CandidateBitmapIndexTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(BITMAP_INDEX_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reference_data.clear()
+        self.python, self.django, self.java = [Skill.objects.create(name=name) for name in ('python', 'django', 'java')]
+        self.developer, self.tester = Role.objects.create(name='Developer'), Role.objects.create(name='Tester')
+        self.pune, self.delhi = City.objects.create(name='Pune'), City.objects.create(name='Delhi')
+        self.both = self.create_candidate('both', self.pune, [self.python, self.django], [self.developer])
+        self.python_only = self.create_candidate('python', self.delhi, [self.python], [self.tester])
+        self.java_django = self.create_candidate('java', self.pune, [self.django, self.java], [])
+        self.run_commit_hooks()
+        candidate_bitmap_index.rebuild()
+
+    def create_candidate(self, name, city, skills, roles):
+        candidate = Candidate.objects.create(user=User.objects.create(username=name), full_name=name, city=city)
+        candidate.skills.set(skills)
+        candidate.roles.set(roles)
+        return candidate
+
+    def match(self, data):
+        data = {name: [str(obj.pk) for obj in value] if isinstance(value, list) else str(value.pk)
+                for name, value in data.items()}
+        return candidate_bitmap_index.match_filterset(CandidateFilter(data, queryset=Candidate.objects.all()))
+
+    def test_skills_are_anded_roles_ored_and_exclusions_negated(self):
+        self.assertEqual(self.match({'skills': [self.python, self.django]}), (self.both.pk,))
+        self.assertEqual(self.match({'roles': [self.developer, self.tester]}), (self.both.pk, self.python_only.pk))
+        self.assertEqual(self.match({'skills': [self.django], 'without_skills': [self.java]}), (self.both.pk,))
+        self.assertEqual(self.match({'city': self.pune, 'skills': [self.django]}),
+                         (self.both.pk, self.java_django.pk))
+        self.assertEqual(self.match({}), (self.both.pk, self.python_only.pk, self.java_django.pk))
+
+    def test_unindexed_filters_fall_back_to_the_queryset(self):
+        self.assertIsNone(self.match({'industry': Industry.objects.create(name='IT')}))
+
+    def test_files_grow_for_new_ids_and_values(self):
+        index = BitmapIndex('test', ('tag',))
+        index.build(ALL, [(0, 1)])
+        index.build('tag', [(1, 1), (2, 3)])
+        size = os.path.getsize(index.path('tag'))
+        index.set('tag', 40, [5000])
+        self.assertGreater(os.path.getsize(index.path('tag')), size)
+        self.assertEqual((index.row('tag', 1), index.row('tag', 2)), (1 << 1, 1 << 3))
+        self.assertEqual(index.row('tag', 40), 1 << 5000)
+        self.assertEqual(index.any_of('tag', [1, 40]), 1 << 1 | 1 << 5000)
+        self.assertEqual(index.row('tag', 41), 0)
+        index.set('tag', 1, [1], on=False)
+        self.assertEqual(index.row('tag', 1), 0)
+
+    def test_signals_update_the_index_once_committed(self):
+        candidate = self.create_candidate('new', self.delhi, [self.java], [self.developer])
+        self.assertEqual(self.match({'skills': [self.java]}), (self.java_django.pk,))
+        self.run_commit_hooks()
+        self.assertEqual(self.match({'skills': [self.java]}), (self.java_django.pk, candidate.pk))
+        self.assertEqual(self.match({'city': self.delhi, 'roles': [self.developer]}), (candidate.pk,))
+        candidate.city = self.pune
+        candidate.save()
+        candidate.skills.remove(self.java)
+        self.python.candidate_set.add(candidate)
+        self.run_commit_hooks()
+        self.assertEqual(self.match({'city': self.delhi}), (self.python_only.pk,))
+        self.assertEqual(self.match({'skills': [self.java]}), (self.java_django.pk,))
+        self.assertEqual(self.match({'skills': [self.python]}), (self.both.pk, self.python_only.pk, candidate.pk))
+        candidate.delete()
+        self.run_commit_hooks()
+        self.assertEqual(self.match({'skills': [self.python]}), (self.both.pk, self.python_only.pk))
+
+    def test_index_is_written_before_the_search_generation_moves_on(self):
+        matched_at_bump = []
+
+        def bump_generation(name):
+            if name == 'candidate':
+                matched_at_bump.append(self.match({'city': self.delhi, 'skills': [self.java]}))
+        self.python_only.skills.add(self.java)
+        with mock.patch('portal.search_cache.bump_generation', side_effect=bump_generation):
+            self.run_commit_hooks()
+        self.java_django.city = self.delhi
+        self.java_django.save()
+        with mock.patch('portal.search_cache.bump_generation', side_effect=bump_generation):
+            self.run_commit_hooks()
+        self.assertEqual(matched_at_bump, [(self.python_only.pk,), (self.python_only.pk, self.java_django.pk)])
+
+    def test_rolled_back_saves_leave_no_bits(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.create_candidate('rolled back', self.delhi, [self.java], [])
+                raise ValueError
+        self.run_commit_hooks()
+        self.assertEqual(self.match({'skills': [self.java]}), (self.java_django.pk,))
+
+
+class CandidateMatchingTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        forget_candidate_snapshot()
+        self.addCleanup(forget_candidate_snapshot)
+        self.python, self.django = Skill.objects.create(name='python'), Skill.objects.create(name='django')
+        self.developer = Role.objects.create(name='Developer')
+        self.pune, self.delhi = City.objects.create(name='Pune'), City.objects.create(name='Delhi')
+        self.graduate = Qualification.objects.create(name='Graduate')
+        self.it = Industry.objects.create(name='IT')
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        self.job = Job.objects.create(posted_by=recruiter, headline='developer', role=self.developer,
+                                      city=self.pune, industry=self.it, experience='2-4')
+        self.job.skills.set([self.python, self.django])
+        self.job.qualifications.set([self.graduate])
+        self.perfect = self.create_candidate('perfect', skills=[self.python, self.django], roles=[self.developer],
+                                             city=self.pune, qualification=self.graduate, industry=self.it,
+                                             experience='2-4')
+        self.half_skills = self.create_candidate('half', skills=[self.python], city=self.delhi)
+        self.too_senior = self.create_candidate('senior', experience='6-8')
+        self.unrelated = self.create_candidate('unrelated', city=self.delhi, experience='10+')
+
+    def create_candidate(self, name, skills=(), roles=(), **fields):
+        candidate = Candidate.objects.create(user=User.objects.create(username=name), full_name=name, **fields)
+        candidate.skills.set(skills)
+        candidate.roles.set(roles)
+        return candidate
+
+    def test_scores_add_up_the_weighted_criteria(self):
+        self.assertEqual(CandidateSnapshot().top(self.job), [
+            (self.perfect.pk, 1.0), (self.half_skills.pk, round(MATCH_WEIGHTS['skills'] / 2, 4)),
+            # two years above the range
+            (self.too_senior.pk, round(MATCH_WEIGHTS['experience'] * 0.5, 4))])
+
+    def test_top_k_breaks_ties_by_id(self):
+        twin = self.create_candidate('twin', skills=[self.python], city=self.delhi)
+        self.assertEqual(CandidateSnapshot().top(self.job, k=3),
+                         [(self.perfect.pk, 1.0), (self.half_skills.pk, 0.175), (twin.pk, 0.175)])
+
+    def test_best_matches_loads_the_candidates(self):
+        matches = best_matches(self.job, k=2)
+        self.assertEqual([(candidate, score) for candidate, score in matches],
+                         [(self.perfect, 1.0), (self.half_skills, 0.175)])
+        self.half_skills.delete()
+        # the snapshot still has the deleted candidate until the commit moves the generation
+        self.assertEqual([candidate for candidate, score in best_matches(self.job, k=2)], [self.perfect])
+
+    def test_changes_are_picked_up_by_the_next_snapshot(self):
+        snapshot = get_candidate_snapshot()
+        self.assertIs(get_candidate_snapshot(), snapshot)
+        self.unrelated.city = self.pune
+        self.unrelated.save()
+        self.run_commit_hooks()
+        self.assertIn((self.unrelated.pk, MATCH_WEIGHTS['city']), get_candidate_snapshot().top(self.job))
+
+    @override_settings(MATCHING_REBUILD_IN_BACKGROUND=True)
+    def test_stale_snapshot_answers_while_a_thread_rebuilds(self):
+        snapshot = get_candidate_snapshot()
+        self.unrelated.save()
+        self.run_commit_hooks()
+        with mock.patch('portal.matching.threading.Thread') as thread, \
+                mock.patch('portal.matching._rebuilding', False):
+            self.assertIs(get_candidate_snapshot(), snapshot)
+            self.assertIs(get_candidate_snapshot(), snapshot)
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once_with()
+
+
+class FakePool(object):
+    # runs the chunks on this thread when their result is asked for, logging loads and results
+
+    def __init__(self, log, processes, initializer, initargs):
+        self.log = log
+        initializer(*initargs)
+
+    def apply_async(self, func, args):
+        result = mock.Mock()
+        result.get.side_effect = lambda: self.log.append('result') or func(*args)
+        return result
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class JobRecommendationTests(TestCase):
+
+    def setUp(self):
+        self.python, self.django, self.java = [Skill.objects.create(name=name) for name in ('python', 'django', 'java')]
+        self.pune, self.delhi = City.objects.create(name='Pune'), City.objects.create(name='Delhi')
+        self.graduate = Qualification.objects.create(name='Graduate')
+        self.recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        self.python_job = self.create_job('python', [self.python, self.django])
+        self.java_job = self.create_job('java', [self.java])
+        self.alice = self.create_candidate('alice', [self.python, self.django], city=self.pune,
+                                           qualification=self.graduate)
+        self.bob = self.create_candidate('bob', [self.java], city=self.delhi)
+
+    def create_job(self, headline, skills, **fields):
+        job = Job.objects.create(posted_by=self.recruiter, headline=headline, city=self.pune, **fields)
+        job.skills.set(skills)
+        return job
+
+    def create_candidate(self, name, skills, **fields):
+        candidate = Candidate.objects.create(user=User.objects.create(username=name), full_name=name, **fields)
+        candidate.skills.set(skills)
+        return candidate
+
+    def recommendations(self):
+        return {candidate: [(job, score) for job, score in JobRecommendation.objects.filter(candidate=candidate)
+                            .order_by('rank').values_list('job', 'score')]
+                for candidate in (self.alice.pk, self.bob.pk)}
+
+    def test_full_run_keeps_the_best_jobs_of_every_candidate(self):
+        run = compute_recommendations(top=2, chunk_size=1)
+        self.assertEqual(run.candidates, 2)
+        self.assertEqual(self.recommendations(), {self.alice.pk: [(self.python_job.pk, 0.5), (self.java_job.pk, 0.15)],
+                                                  self.bob.pk: [(self.java_job.pk, 0.35)]})
+        compute_recommendations(top=1)
+        self.assertEqual(self.recommendations(), {self.alice.pk: [(self.python_job.pk, 0.5)],
+                                                  self.bob.pk: [(self.java_job.pk, 0.35)]})
+
+    def test_incremental_run_merges_new_jobs_into_the_kept_ones(self):
+        compute_recommendations(top=2)
+        new_job = self.create_job('new', [self.python, self.django])
+        new_job.qualifications.set([self.graduate])
+        self.bob.city = self.pune
+        self.bob.save()
+        run = compute_recommendations(top=2, incremental=True)
+        self.assertTrue(run.incremental)
+        self.assertEqual(self.recommendations(), {
+            # unchanged, the new job is merged into the previous list
+            self.alice.pk: [(new_job.pk, 0.65), (self.python_job.pk, 0.5)],
+            # changed, recomputed against every job, ties go to the older job
+            self.bob.pk: [(self.java_job.pk, 0.5), (self.python_job.pk, 0.15)]})
+
+    def test_worker_processes_give_the_same_results(self):
+        compute_recommendations(top=2, chunk_size=1)
+        expected = self.recommendations()
+        JobRecommendation.objects.all().delete()
+        compute_recommendations(top=2, chunk_size=1, processes=2)
+        self.assertEqual(self.recommendations(), expected)
+
+    def test_pool_gets_a_bounded_number_of_chunks_ahead(self):
+        for number in range(10):
+            self.create_candidate('candidate{}'.format(number), [self.python])
+        log = []
+        processes = 2
+
+        def load(*args, **kwargs):
+            log.append('load')
+            return load_candidate_chunk(*args, **kwargs)
+
+        with mock.patch('portal.recommendations.multiprocessing.Pool',
+                        lambda *args, **kwargs: FakePool(log, *args, **kwargs)), \
+                mock.patch('portal.recommendations.load_candidate_chunk', load):
+            self.assertEqual(compute_recommendations(top=2, chunk_size=1, processes=processes).candidates, 12)
+        ahead = [log[:position].count('load') - log[:position].count('result') for position in range(len(log) + 1)]
+        self.assertEqual(max(ahead), processes * PENDING_CHUNKS_PER_PROCESS + 1)
+        self.assertEqual(log.count('result'), 12)
+
+    def test_job_blocks_cap_the_score_matrix(self):
+        self.create_job('django', [self.django])
+        self.create_job('python', [self.python])
+        self.create_job('java django', [self.java, self.django])
+        compute_recommendations(top=2, chunk_size=2)
+        expected = self.recommendations()
+        JobRecommendation.objects.all().delete()
+        shapes = []
+
+        def score(chunk, jobs):
+            matrix = score_chunk(chunk, jobs)
+            shapes.extend([matrix.shape, jobs.skills.shape, jobs.qualifications.shape])
+            return matrix
+        with mock.patch('portal.recommendations.JOB_BLOCK_SIZE', 2), \
+                mock.patch('portal.recommendations.score_chunk', score):
+            compute_recommendations(top=2, chunk_size=2)
+        self.assertEqual(self.recommendations(), expected)
+        self.assertEqual(max(rows for rows, columns in shapes[1::3]), 2)
+        self.assertLessEqual(max(rows * columns for rows, columns in shapes[::3]), 2 * 2)
+
+
+class ProfileMiddlewareTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='candidate')
+        self.candidate = Candidate.objects.create(user=self.user, full_name='Candidate')
+        self.session = SessionStore()
+        profile_generations.clear()
+
+    def get_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.session
+        request.user = EmailAuthenticate().get_user(self.user.pk)
+        ProfileMiddleware(lambda request: None)(request)
+        return request
+
+    def test_second_request_reads_the_session_copy(self):
+        self.assertEqual(self.get_request().profile.role, 'candidate')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_request().profile.role, 'candidate')
+
+    def test_cached_gate_reads_the_session_copy(self):
+        self.assertFalse(self.get_request().profile.has_subscription('candidate'))
+        request = self.get_request()
+        with self.assertNumQueries(0):
+            self.assertFalse(request.profile.has_subscription('candidate'))
+
+    def test_missing_session_copy_is_one_query(self):
+        self.assertEqual(self.get_request().profile.role, 'candidate')
+        self.session = SessionStore()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_request().profile.role, 'candidate')
+
+    def test_recharge_invalidates_the_session_copy(self):
+        self.assertFalse(self.get_request().profile.has_subscription('candidate'))
+        self.candidate.add_recharge(package_validity_days=30)
+        self.run_commit_hooks()
+        profile = self.get_request().profile
+        self.assertTrue(profile.has_subscription('candidate'))
+        self.assertFalse(profile.has_subscription('recruiter'))
+
+    def test_invalidation_by_another_worker_is_seen(self):
+        self.assertEqual(self.get_request().profile.role, 'candidate')
+        # another worker swaps the profile and bumps the generation in the shared cache,
+        # nothing of it reaches this process's local cache
+        Candidate.objects.filter(id=self.candidate.id).delete()
+        Recruiter.objects.create(user=self.user, full_name='Recruiter')
+        connection.run_on_commit = []
+        generation_cache().incr(GENERATION_KEY.format('profile:{}'.format(self.user.pk)))
+        cache.clear()
+        # this process only looks at the shared generation every PROFILE_CHECK_INTERVAL seconds
+        self.assertEqual(self.get_request().profile.role, 'candidate')
+        with mock.patch.object(profile_generations, 'check_interval', 0):
+            self.assertEqual(self.get_request().profile.role, 'recruiter')
+
+    def test_new_profile_is_seen_after_commit(self):
+        self.candidate.delete()
+        self.run_commit_hooks()
+        self.assertIsNone(self.get_request().profile.role)
+        with transaction.atomic():
+            Recruiter.objects.create(user=self.user, full_name='Recruiter')
+        self.assertIsNone(self.get_request().profile.role)
+        self.run_commit_hooks()
+        self.assertEqual(self.get_request().profile.role, 'recruiter')
+
+
+class RechargeTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='candidate')
+        self.candidate = Candidate.objects.create(user=self.user, full_name='Candidate')
+        self.package = Package.objects.create(name='Month', user_type='Candidate', price=100, validity_days=30,
+                                              description='one month')
+
+    def test_running_validity_is_extended_from_its_end(self):
+        end = timezone.now() + timezone.timedelta(days=5)
+        Candidate.objects.filter(id=self.candidate.id).update(recharge_validity=end)
+        make_recharge(self.user, self.package)
+        self.candidate.refresh_from_db()
+        self.assertEqual(self.candidate.recharge_validity, end + timezone.timedelta(days=30))
+
+    def test_expired_validity_starts_from_now(self):
+        Candidate.objects.filter(id=self.candidate.id).update(
+            recharge_validity=timezone.now() - timezone.timedelta(days=5))
+        before = timezone.now()
+        make_recharge(self.user, self.package)
+        self.candidate.refresh_from_db()
+        self.assertGreaterEqual(self.candidate.recharge_validity, before + timezone.timedelta(days=30))
+        self.assertLess(self.candidate.recharge_validity, timezone.now() + timezone.timedelta(days=30))
+
+    def test_recharge_is_stored_once_with_its_package_snapshot(self):
+        recharge = make_recharge(self.user, self.package)
+        self.assertEqual(Recharge.objects.filter(user=self.user).count(), 1)
+        self.assertIn('Validity Days : 30', Recharge.objects.get(id=recharge.id).package_details)
+        self.assertIsNotNone(self.user.candidate.recharge_validity)
+
+    def test_stale_profile_save_keeps_the_recharge(self):
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        for profile in (self.candidate, recruiter):
+            stale = type(profile).objects.get(pk=profile.pk)
+            profile.add_recharge(package_validity_days=30)
+            stale.full_name = 'Renamed'
+            stale.save()
+            stored = type(profile).objects.get(pk=profile.pk)
+            self.assertEqual((stored.full_name, stored.last_recharge, stored.recharge_validity),
+                             ('Renamed', profile.last_recharge, profile.recharge_validity))
+            self.assertIsNotNone(stored.recharge_validity)
+
+    def test_profile_is_invalidated_after_the_recharge_commits(self):
+        name = profile_generation_name(self.user.pk)
+        generation = get_generation(name)
+        with transaction.atomic():
+            make_recharge(self.user, self.package)
+            self.assertEqual(get_generation(name), generation)
+        self.assertEqual(get_generation(name), generation)
+        self.run_commit_hooks()
+        self.assertGreater(get_generation(name), generation)
+
+
+class EmailAuthenticateTests(CommitHooksTestMixin, QueryPlanTestMixin, TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(username='Asha', email='Asha@Example.com')
+        self.user.set_password('secret')
+        self.user.save()
+        self.backend = EmailAuthenticate()
+
+    def test_login_ignores_case(self):
+        for username in ('asha@example.com', 'ASHA@EXAMPLE.COM', 'asha', ' Asha '):
+            with self.subTest(username=username):
+                self.assertEqual(self.backend.authenticate(username=username, password='secret'), self.user)
+        self.assertIsNone(self.backend.authenticate(username='asha', password='wrong'))
+        self.assertIsNone(self.backend.authenticate(username='nobody@example.com', password='secret'))
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is sqlite specific')
+    def test_lookups_use_the_lower_indexes(self):
+        for field in ('email', 'username'):
+            with self.subTest(field=field):
+                users = User.objects.annotate(login_key=Lower(field)).filter(login_key='asha')
+                self.assertNoTableScan(users, User._meta.db_table)
+
+    def test_get_user_is_cached_until_the_user_changes(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            cached = self.backend.get_user(self.user.pk)
+        self.assertEqual(cached.password, self.user.password)
+        self.assertIsNot(cached, self.backend.get_user(self.user.pk))
+        self.user.set_password('changed')
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.backend.get_user(self.user.pk).check_password('changed'))
+
+    def test_commit_moves_the_shared_user_generation_on(self):
+        name = user_generation_name(self.user.pk)
+        generation = get_generation(name)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(get_generation(name), generation)
+        self.run_commit_hooks()
+        self.assertNotEqual(get_generation(name), generation)
+        self.assertFalse(self.backend.get_user(self.user.pk).is_active)
+
+    def test_deactivation_by_another_worker_is_seen(self):
+        self.assertTrue(self.backend.get_user(self.user.pk).is_active)
+        # another worker deactivates the user, only the shared generation tells this process about it
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        bump_generation(user_generation_name(self.user.pk))
+        # this process only looks at the shared generation every USER_CHECK_INTERVAL seconds
+        self.assertTrue(self.backend.get_user(self.user.pk).is_active)
+        with mock.patch.object(user_cache.generations, 'check_interval', 0):
+            self.assertFalse(self.backend.get_user(self.user.pk).is_active)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected('connection lost')
+
+
+class OutgoingEmailTests(TestCase):
+
+    def test_registration_queues_the_activation_email(self):
+        response = self.client.post(reverse('portal:register'), {
+            'username': 'asha', 'email': 'asha@example.com', 'password1': 'Secret-pass-1',
+            'password2': 'Secret-pass-1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutgoingEmail.objects.get()
+        self.assertEqual(queued.recipients, ['asha@example.com'])
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['asha@example.com'])
+        self.assertIn('/activate/', mail.outbox[0].body)
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.SENT)
+
+    def test_password_reset_email_is_queued(self):
+        User.objects.create_user(username='asha', email='asha@example.com', password='secret')
+        self.client.post(reverse('portal:password_reset'), {'email': 'asha@example.com'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.get().recipients, ['asha@example.com'])
+
+    def test_batch_shares_one_connection(self):
+        for number in range(3):
+            queue_mail('Subject', 'Body', ['user{}@example.com'.format(number)])
+        connection = get_connection()
+        with mock.patch.object(connection, 'open', wraps=connection.open) as opened:
+            self.assertEqual(send_queued(batch_size=2, connection=connection), (2, 0))
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED).count(), 1)
+
+    def test_failures_back_off_then_go_dead(self):
+        email = queue_mail('Subject', 'Body', ['asha@example.com'])
+        self.assertEqual(send_queued(max_attempts=2, connection=FailingEmailBackend()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.QUEUED, 1))
+        self.assertIn('connection lost', email.last_error)
+        self.assertGreater(email.next_attempt_on, timezone.now())
+        # not due yet
+        self.assertEqual(send_queued(max_attempts=2, connection=FailingEmailBackend()), (0, 0))
+        OutgoingEmail.objects.filter(id=email.id).update(next_attempt_on=timezone.now())
+        send_queued(max_attempts=2, connection=FailingEmailBackend())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.DEAD, 2))
+        self.assertEqual(send_queued(max_attempts=2), (0, 0))
+
+    def test_workers_only_send_the_rows_they_claimed(self):
+        for number in range(3):
+            queue_mail('Subject', 'Body', ['user{}@example.com'.format(number)])
+        # another worker is still sending the first two
+        claimed = claim_batch(2, timezone.now())
+        self.assertEqual([email.recipients for email in claimed], [['user0@example.com'], ['user1@example.com']])
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['user2@example.com']])
+        self.assertEqual(send_queued(), (0, 0))
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING).count(), 2)
+
+    def test_claims_of_a_dead_worker_expire(self):
+        queue_mail('Subject', 'Body', ['asha@example.com'])
+        claim_batch(1, timezone.now() - timezone.timedelta(seconds=CLAIM_TIMEOUT_SECONDS + 1))
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.SENT)
+
+
+class JobAlertTests(TestCase):
+
+    def setUp(self):
+        self.city = City.objects.create(name='Pune')
+        self.role = Role.objects.create(name='Teacher')
+        self.skill = Skill.objects.create(name='Maths')
+        self.recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='R')
+        self.candidate = self.make_candidate('match', self.city, [self.role], [self.skill])
+        self.make_candidate('other-city', City.objects.create(name='Delhi'), [self.role], [self.skill])
+        self.make_candidate('no-skill', self.city, [self.role], [])
+        self.make_candidate('no-email', self.city, [self.role], [self.skill], email='')
+
+    def make_candidate(self, name, city, roles, skills, email=None):
+        candidate = Candidate.objects.create(user=User.objects.create(username=name), full_name=name, city=city,
+                                             email='{}@example.com'.format(name) if email is None else email)
+        candidate.roles.set(roles)
+        candidate.skills.set(skills)
+        return candidate
+
+    def post_job(self, headline):
+        job = Job.objects.create(headline=headline, posted_by=self.recruiter, role=self.role, city=self.city)
+        job.skills.set([self.skill])
+        return job
+
+    def test_matching_is_one_candidate_query(self):
+        job = self.post_job('maths teacher')
+        # the skill ids of the job, then the candidates, whatever the number of candidates
+        with self.assertNumQueries(2):
+            self.assertEqual(list(matching_candidates(job)), [self.candidate])
+
+    def test_alerts_are_coalesced_into_one_digest_per_candidate(self):
+        self.post_job('maths teacher')
+        self.post_job('maths tutor')
+        self.assertEqual(match_new_jobs(), 2)
+        self.assertEqual(match_new_jobs(), 0)
+        self.assertEqual(queue_digests(), 1)
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['match@example.com'])
+        self.assertIn('maths tutor', mail.outbox[0].body)
+        self.assertIn('maths teacher', mail.outbox[0].body)
+
+    def test_digests_are_rate_limited_per_candidate(self):
+        self.post_job('maths teacher')
+        match_new_jobs()
+        queue_digests()
+        self.post_job('maths tutor')
+        match_new_jobs()
+        self.assertEqual(queue_digests(), 0)
+        JobAlert.objects.exclude(sent_on=None).update(sent_on=timezone.now() - timezone.timedelta(days=2))
+        self.assertEqual(queue_digests(), 1)
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+    def test_digests_are_queued_in_batches(self):
+        self.post_job('maths teacher')
+        for number in range(4):
+            self.make_candidate('more{}'.format(number), self.city, [self.role], [self.skill])
+        match_new_jobs()
+        self.assertEqual(queue_digests(batch_size=2), 5)
+        self.assertFalse(JobAlert.objects.filter(sent_on=None).exists())
+        self.assertEqual(queue_digests(batch_size=2), 0)
+        # the outbox worker delivers them over one connection
+        self.assertEqual(send_queued(), (5, 0))
+        self.assertEqual(len({tuple(message.to) for message in mail.outbox}), 5)
+
+    def test_a_bad_address_does_not_hold_back_the_other_digests(self):
+        self.post_job('maths teacher')
+        for number in range(4):
+            self.make_candidate('more{}'.format(number), self.city, [self.role], [self.skill])
+        match_new_jobs()
+        self.assertEqual(queue_digests(batch_size=2), 5)
+        connection = get_connection()
+        send_messages = connection.send_messages
+
+        def deliver(messages):
+            if messages[0].to == ['match@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'match@example.com': (550, b'no such user')})
+            return send_messages(messages)
+        with mock.patch.object(connection, 'send_messages', side_effect=deliver):
+            self.assertEqual(send_queued(connection=connection), (4, 1))
+        # the bad address backs off in the outbox, its alerts are not queued again
+        failed = OutgoingEmail.objects.get(to='match@example.com')
+        self.assertEqual((failed.status, failed.attempts), (OutgoingEmail.QUEUED, 1))
+        self.assertGreater(failed.next_attempt_on, timezone.now())
+        self.assertEqual(queue_digests(), 0)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_saving_a_stale_job_keeps_its_alert_mark(self):
+        job = self.post_job('maths teacher')
+        match_new_jobs()
+        job.headline = 'maths tutor'
+        job.save()
+        self.assertIsNotNone(Job.objects.get(pk=job.pk).alerts_matched_on)
+        self.assertEqual(match_new_jobs(), 0)
+
+
+class TemporaryMediaTestMixin(object):
+
+    def use_temporary_media_root(self, **settings):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, **settings)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ResumeStorageTests(TemporaryMediaTestMixin, TestCase):
+
+    def setUp(self):
+        self.use_temporary_media_root(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+        self.user = User.objects.create(username='asha')
+        self.candidate = Candidate.objects.create(user=self.user, full_name='Asha')
+        self.other = Candidate.objects.create(user=User.objects.create(username='ravi'), full_name='Ravi')
+
+    def upload(self, candidate, content, filename='resume.pdf'):
+        candidate.resume.save(filename, ContentFile(content))
+        return candidate.resume.name
+
+    def test_identical_uploads_share_one_file(self):
+        name = self.upload(self.candidate, b'same resume')
+        self.assertEqual(self.upload(self.other, b'same resume', 'other.PDF'), name)
+        self.assertEqual(name, 'resumes/{0}/{1}.pdf'.format(hashlib.sha256(b'same resume').hexdigest()[:2],
+                                                           hashlib.sha256(b'same resume').hexdigest()))
+        self.assertEqual(StoredResume.objects.get(name=name).refs, 2)
+
+    def test_streamed_upload_is_hashed_once_and_stored(self):
+        self.client.force_login(self.user)
+        content = b'x' * 10000
+        with mock.patch.object(hashlib, 'sha256', wraps=hashlib.sha256) as sha256:
+            response = self.client.post(reverse('portal:update_profile'), {
+                'full_name': 'Asha', 'resume': SimpleUploadedFile('resume.pdf', content)})
+        self.assertEqual(response.status_code, 302)
+        self.candidate.refresh_from_db()
+        self.assertEqual(self.candidate.resume.name.rsplit('/', 1)[1], hashlib.sha256(content).hexdigest() + '.pdf')
+        self.assertEqual(sha256.call_count, 1)
+        self.assertEqual(self.candidate.resume.read(), content)
+
+    def test_replaced_resume_is_collected_after_the_grace_period(self):
+        old = self.upload(self.candidate, b'first version')
+        new = self.upload(self.candidate, b'second version')
+        self.assertEqual(StoredResume.objects.get(name=old).refs, 0)
+        self.assertEqual(collect_garbage(), 0)
+        StoredResume.objects.filter(name=old).update(updated_on=timezone.now() - timezone.timedelta(hours=2))
+        os.utime(resume_storage.path(old), (0, 0))
+        self.assertEqual(collect_garbage(), 1)
+        self.assertFalse(resume_storage.exists(old))
+        self.assertTrue(resume_storage.exists(new))
+
+    def test_deleted_candidate_releases_its_resume(self):
+        name = self.upload(self.candidate, b'resume')
+        self.upload(self.other, b'resume')
+        self.other.delete()
+        self.assertEqual(StoredResume.objects.get(name=name).refs, 1)
+        Candidate.objects.filter(id=self.candidate.id).update(resume='')
+        self.assertEqual(recount_resume_refs(), 1)
+        self.assertEqual(StoredResume.objects.get(name=name).refs, 0)
+
+
+class ResumeDownloadTests(CommitHooksTestMixin, TemporaryMediaTestMixin, TestCase):
+
+    def setUp(self):
+        self.use_temporary_media_root()
+        self.user = User.objects.create(username='asha')
+        self.candidate = Candidate.objects.create(user=self.user, full_name='Asha Rao')
+        self.candidate.resume.save('cv.pdf', ContentFile(b'0123456789'))
+        self.url = reverse('portal:resume_download', args=[self.candidate.id])
+        self.client.force_login(self.user)
+
+    def test_owner_downloads_the_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertIn('filename="asha-rao-resume.pdf"', response['Content-Disposition'])
+
+    def test_range_request_gets_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'789')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=20-').status_code, 416)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_other_candidates_and_anonymous_users_are_refused(self):
+        self.client.force_login(Candidate.objects.create(user=User.objects.create(username='ravi')).user)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_only_subscribed_recruiters_download(self):
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='R')
+        self.client.force_login(recruiter.user)
+        self.assertRedirects(self.client.get(self.url), reverse('recruiter:account'), fetch_redirect_response=False)
+        Recruiter.objects.filter(id=recruiter.id).update(recharge_validity=timezone.now() + timezone.timedelta(days=1))
+        invalidate_profile(recruiter.user_id)
+        self.run_commit_hooks()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_front_end_server_sends_the_file(self):
+        with self.settings(SENDFILE_BACKEND='x-accel-redirect', SENDFILE_URL='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.candidate.resume.name)
+        self.assertEqual(response.content, b'')
+        with self.settings(SENDFILE_BACKEND='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], resume_storage.path(self.candidate.resume.name))
+
+
+def make_docx(*paragraphs):
+    body = ''.join('<w:p><w:r><w:t>{}</w:t></w:r></w:p>'.format(text) for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as docx:
+        docx.writestr('word/document.xml', '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                                           'wordprocessingml/2006/main"><w:body>{}</w:body></w:document>'.format(body))
+    return buffer.getvalue()
+
+
+def make_pdf(text):
+    stream = zlib.compress('BT /F1 12 Tf 72 712 Td ({}) Tj ET'.format(text).encode('latin-1'))
+    return b'%PDF-1.4\n1 0 obj\n<< /Length ' + str(len(stream)).encode() + b' /Filter /FlateDecode >>\nstream\n' + \
+        stream + b'\nendstream\nendobj\n%%EOF\n'
+
+
+class ResumeTextTests(TemporaryMediaTestMixin, TestCase):
+
+    def setUp(self):
+        self.use_temporary_media_root()
+
+    def make_candidate(self, name, filename, content):
+        candidate = Candidate.objects.create(user=User.objects.create(username=name), full_name=name)
+        candidate.resume.save(filename, ContentFile(content))
+        return candidate
+
+    def test_text_docx_and_pdf_resumes_are_extracted(self):
+        text = self.make_candidate('text', 'cv.txt', 'Cooking and Baking'.encode())
+        docx = self.make_candidate('docx', 'cv.docx', make_docx('Senior Teacher', 'Maths (10 years)'))
+        pdf = self.make_candidate('pdf', 'cv.pdf', make_pdf('Python \\(Django\\) developer'))
+        self.assertEqual(extract_pending(), (3, 3))
+        for candidate, expected in ((text, 'cooking and baking'), (docx, 'senior teacher maths (10 years)'),
+                                    (pdf, 'python (django) developer')):
+            candidate.refresh_from_db()
+            self.assertEqual(candidate.resume_text.text, expected)
+            self.assertEqual(candidate.resume_text_source, candidate.resume.name)
+
+    def test_extraction_is_idempotent_per_content_hash(self):
+        first = self.make_candidate('first', 'cv.txt', b'same words')
+        self.make_candidate('second', 'other.txt', b'same words')
+        self.assertEqual(extract_pending(), (2, 1))
+        self.assertEqual(extract_pending(), (0, 0))
+        reset_resume_texts()
+        self.assertEqual(extract_pending(), (2, 0))
+        self.assertEqual(ResumeText.objects.count(), 1)
+        first.resume.save('cv.txt', ContentFile(b'new words'))
+        self.assertEqual(extract_pending(), (1, 1))
+
+    def test_candidate_search_finds_resume_keywords(self):
+        teacher = self.make_candidate('teacher', 'cv.docx', make_docx('Physics teacher'))
+        self.make_candidate('cook', 'cv.txt', b'Chef')
+        extract_pending()
+        found = CandidateFilter(QueryDict('q=PHYSICS'), queryset=Candidate.objects.all()).qs
+        self.assertEqual(list(found), [teacher])
+        self.assertEqual(list(CandidateFilter(QueryDict('q=teach'), queryset=Candidate.objects.all()).qs), [teacher])
+        teacher.delete()
+        self.assertEqual(list(CandidateFilter(QueryDict('q=physics'), queryset=Candidate.objects.all()).qs), [])
+
+    def test_saving_a_stale_candidate_keeps_the_extracted_text(self):
+        candidate = self.make_candidate('teacher', 'cv.txt', b'Physics teacher')
+        stale = Candidate.objects.get(pk=candidate.pk)
+        extract_pending()
+        stale.full_name = 'Physics Teacher'
+        stale.save()
+        candidate.refresh_from_db()
+        self.assertEqual((candidate.full_name, candidate.resume_text.text), ('Physics Teacher', 'physics teacher'))
+        self.assertEqual(candidate.resume_text_source, candidate.resume.name)
+        self.assertEqual(extract_pending(), (0, 0))
+
+
+class ReferenceDataTests(CommitHooksTestMixin, TestCase):
+
+    def setUp(self):
+        # the process local copy outlives the rolled back rows of earlier tests
+        reference_data.clear()
+        create_lookup_rows()
+
+    def test_forms_and_filters_render_without_queries(self):
+        str(UpdateProfileForm())
+        with self.assertNumQueries(0):
+            str(UpdateProfileForm())
+            str(JobFilter(QueryDict(), queryset=Job.objects.all()).form)
+            str(CandidateFilter(QueryDict(), queryset=Candidate.objects.all()).form)
+
+    def test_choices_validate_without_queries(self):
+        for model in (Skill, City):
+            reference_data.all(model)
+        with self.assertNumQueries(0):
+            candidate_filter = CandidateFilter(QueryDict('skills=1&city=1'), queryset=Candidate.objects.all())
+            self.assertTrue(candidate_filter.is_valid())
+            self.assertEqual([skill.id for skill in candidate_filter.form.cleaned_data['skills']], [1])
+            self.assertEqual(candidate_filter.form.cleaned_data['city'].name, 'City 1')
+            candidate_filter = CandidateFilter(QueryDict('skills=1&skills=99'), queryset=Candidate.objects.all())
+            self.assertFalse(candidate_filter.is_valid())
+
+    def test_changes_invalidate_the_cache(self):
+        self.assertEqual([city.name for city in reference_data.all(City)], ['City 1'])
+        City.objects.create(id=2, name='City 2')
+        City.objects.filter(id=1).get().delete()
+        self.assertEqual([city.name for city in reference_data.all(City)], ['City 2'])
+        loads = reference_data.loads
+        reference_data.all(City)
+        self.assertEqual(reference_data.loads, loads)
+
+    def test_other_workers_are_invalidated_after_commit(self):
+        name = reference_generation_name(City)
+        generation = get_generation(name)
+        reference_data.all(City)
+        with transaction.atomic():
+            City.objects.create(id=2, name='City 2')
+            self.assertEqual(len(reference_data.all(City)), 2)
+        self.assertEqual(get_generation(name), generation)
+        self.run_commit_hooks()
+        self.assertGreater(get_generation(name), generation)
+        self.assertEqual(len(reference_data.all(City)), 2)
+
+    def test_attached_foreign_keys_cost_no_query(self):
+        recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        Job.objects.create(posted_by=recruiter, headline='Cook', city_id=1, role_id=1)
+        job = attach_reference_data([Job.objects.get()], 'city', 'role', 'industry')[0]
+        with self.assertNumQueries(0):
+            self.assertEqual((job.city.name, job.role.name, job.industry), ('City 1', 'Role 1', None))
+
+
+class QueryProfilerTests(TestCase):
+
+    def setUp(self):
+        query_profiles.clear()
+        create_lookup_rows()
+
+    def test_normalized_statements_ignore_values(self):
+        self.assertEqual(normalize_sql("SELECT * FROM t WHERE id IN (%s, %s,%s) AND name = 'x' LIMIT 21"),
+                         'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(normalize_sql('SELECT "t1"."id" FROM "t1" WHERE "t1"."id" = %s'),
+                         normalize_sql('SELECT  "t1"."id" FROM "t1"\nWHERE "t1"."id" = %s'))
+
+    def test_disabled_middleware_drops_out(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryProfileMiddleware(lambda request: None)
+
+    @override_settings(QUERY_PROFILER_ENABLED=True, QUERY_PROFILER_N_PLUS_ONE_THRESHOLD=3)
+    def test_repeated_statements_are_flagged(self):
+        def view(request):
+            for pk in (1, 1, 1, 1):
+                City.objects.get(pk=pk)
+            Skill.objects.count()
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = resolve(reverse('portal:job_search'))
+        with self.assertLogs('portal.query_profiler', 'WARNING'):
+            QueryProfileMiddleware(view)(request)
+        record, = query_profiles.records()
+        self.assertEqual((record['view'], record['queries'], record['status']), ('portal:job_search', 5, 200))
+        self.assertEqual(record['top'][0]['count'], 4)
+        self.assertEqual(len(record['n_plus_one']), 1)
+        self.assertIn('portal_city', record['n_plus_one'][0])
+        summary = query_profiles.summary()['portal:job_search']
+        self.assertEqual((summary['requests'], summary['n_plus_one_requests']), (1, 1))
+
+    @override_settings(QUERY_PROFILER_ENABLED=True)
+    def test_requests_are_keyed_by_url_name(self):
+        with self.assertLogs('portal.query_profiler', 'INFO'):
+            self.client.get(reverse('portal:home'))
+        self.assertEqual([record['view'] for record in query_profiles.records()], ['portal:home'])
+
+
+class SyntheticDataTests(TestCase):
+
+    sizes = {'candidates': 30, 'recruiters': 4, 'jobs': 12, 'proposals': 40, 'likes': 15, 'recharges': 40}
+
+    def setUp(self):
+        reference_data.clear()
+        self.created = seed(prefix='load', chunk_size=7, **self.sizes)
+
+    def test_seed_creates_the_requested_rows(self):
+        self.assertEqual(Candidate.objects.filter(user__username__startswith='load-c').count(), 30)
+        self.assertEqual(Job.objects.count(), 12)
+        self.assertEqual(Proposal.objects.count(), self.created['portal.proposal'])
+        self.assertEqual(CandidateLike.objects.count(), 15)
+        self.assertEqual(Recharge.objects.count(), 40)
+        # every user recharged at least once
+        self.assertFalse(Candidate.objects.filter(recharge_validity__isnull=True).exists())
+        self.assertFalse(Candidate.objects.filter(skills=None).exists())
+        self.assertFalse(Job.objects.exclude(experience='').filter(experience_min=None).exists())
+
+    def test_benchmark_requests_every_url(self):
+        views = run_benchmark(requests=2, prefix='load')
+        for name in ('portal:job_search', 'portal:job_details', 'portal:proposal_list', 'recruiter:candidate_search',
+                     'recruiter:job_details', 'recruiter:proposal_list', 'recruiter:candidate_search_export'):
+            self.assertEqual(views[name]['status'], 200, name)
+            self.assertEqual(views[name]['requests'], 2)
+            self.assertLessEqual(views[name]['p50_ms'], views[name]['p95_ms'])
+        self.assertNotIn('recruiter:candidate_like', views)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_workers_are_summed(self):
+        first, second = ProcessMetrics(), ProcessMetrics()
+        first.observe_request('portal:home', 'GET', 200, 0.003, 1)
+        first.observe_request('portal:home', 'GET', 200, 0.2, 1)
+        second.observe_request('portal:home', 'GET', 200, 20, 3)
+        second.observe_request('portal:job_search', 'GET', 302, 0.02, 0)
+        first.flush(self.directory)
+        # another live process stands in for the second worker
+        self.flush_as(second, os.getppid(), second.started)
+        collected = collect(self.directory)
+        self.assertEqual(collected['processes'], 2)
+        self.assertEqual(collected['requests'][('portal:home', 'GET', '200')], 3)
+        self.assertEqual(collected['latency']['portal:home'].counts, [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1])
+        text = render_metrics(collected, {'queued': 2})
+        self.assertIn('smp_http_requests_total{view="portal:job_search",method="GET",status="302"} 1\n', text)
+        self.assertIn('smp_http_request_duration_seconds_bucket{view="portal:home",le="0.25"} 2\n', text)
+        self.assertIn('smp_http_request_duration_seconds_bucket{view="portal:home",le="+Inf"} 3\n', text)
+        self.assertIn('smp_db_queries_per_request_sum{view="portal:home"} 5.0\n', text)
+        self.assertIn('smp_email_queue_depth{status="queued"} 2\n', text)
+
+    def test_unflushed_snapshot_waits_for_the_interval(self):
+        metrics = ProcessMetrics()
+        metrics.flush(self.directory, force=False)
+        metrics.observe_request('portal:home', 'GET', 200, 0.01, 1)
+        metrics.flush(self.directory, force=False)
+        self.assertEqual(collect(self.directory)['requests'], {})
+        metrics.flush(self.directory)
+        self.assertEqual(sum(collect(self.directory)['requests'].values()), 1)
+
+    def flush_as(self, metrics, pid, started):
+        # the snapshot of metrics, as written by the worker pid started at started
+        with open(os.path.join(self.directory, '{}-{}.json'.format(pid, started)), 'w') as snapshot_file:
+            json.dump(metrics.snapshot(), snapshot_file)
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def test_requests_are_counted_by_url_name(self):
+        self.client.get(reverse('portal:home'))
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('portal:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('smp_http_requests_total{view="portal:home",method="GET",status="200"}', text)
+        self.assertIn('smp_cache_hits_total{cache="job_search"}', text)
+
+    def test_only_internal_or_token_scrapes_are_served(self):
+        url = reverse('portal:metrics')
+        # a local scraper needs no token, a request forwarded by the reverse proxy does
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 200)
+        with self.settings(INTERNAL_IPS=['10.0.0.0/8']):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+        for header in ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP', 'HTTP_FORWARDED'):
+            with self.subTest(header=header):
+                self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1', **{header: '203.0.113.9'})
+                                 .status_code, 404)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 404)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9', HTTP_AUTHORIZATION='Bearer wrong')
+                             .status_code, 404)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.9',
+                                             HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9', HTTP_AUTHORIZATION='Bearer ')
+                         .status_code, 404)
+
+    def test_dead_workers_are_merged_into_the_retired_counters(self):
+        live, dead, replaced = ProcessMetrics(), ProcessMetrics(), ProcessMetrics()
+        for metrics, view in ((live, 'portal:home'), (dead, 'portal:home'), (replaced, 'portal:job_search')):
+            metrics.observe_request(view, 'GET', 200, 0.01, 2)
+        live.flush(self.directory)
+        self.flush_as(dead, self.dead_pid(), dead.started)
+        # an earlier worker with the pid of this process
+        self.flush_as(replaced, live.pid, live.started - 1)
+        collected = collect(self.directory)
+        self.assertEqual(collected['processes'], 1)
+        self.assertEqual(collected['requests'], {('portal:home', 'GET', '200'): 2,
+                                                 ('portal:job_search', 'GET', '200'): 1})
+        self.assertEqual(collected['queries']['portal:home'].sum, 4.0)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['.retire.lock', RETIRED_NAME, os.path.basename(live.path(self.directory))]))
+        # the totals stay the same, the retired snapshots are not merged twice
+        self.assertEqual(collect(self.directory)['requests'], collected['requests'])
+        live.observe_request('portal:home', 'GET', 200, 0.01, 2)
+        live.flush(self.directory)
+        self.assertEqual(collect(self.directory)['requests'][('portal:home', 'GET', '200')], 3)
+
+    def test_email_queue_depth_by_status(self):
+        for number in range(3):
+            queue_mail('Subject', 'Body', ['user{}@example.com'.format(number)])
+        OutgoingEmail.objects.filter(pk=OutgoingEmail.objects.first().pk).update(status=OutgoingEmail.DEAD)
+        self.assertEqual(email_queue_depth(), {
+            OutgoingEmail.QUEUED: 2, OutgoingEmail.SENDING: 0, OutgoingEmail.SENT: 0, OutgoingEmail.DEAD: 1})
@@ -2,6 +2,7 @@ from django.conf.urls import url
 from django.shortcuts import resolve_url, reverse
 from django.urls import path
 from . import views
+from .mail import QueuedPasswordResetForm
 from django.contrib.auth.views import login, logout_then_login, LoginView, password_reset_done, LogoutView
 from django.contrib.auth import views as auth_views
 
@@ -15,7 +16,9 @@ urlpatterns = [
     url(r'^login/$', login, {'template_name': 'portal/login.html'},  name='login'),
     url(r'^register/$', views.register, name='register'),
     url(r'^profile/$', views.profile, name='profile'),
+    url(r'^dashboard/$', views.dashboard, name='dashboard'),
     url(r'^update_profile/$', views.update_profile, name='update_profile'),
+    url(r'^resume/(?P<candidate_id>[0-9]+)/$', views.resume_download, name='resume_download'),
     # url(r'^logout/$', logout_then_login, name='logout'),
     url(r'^logout/$', LogoutView.as_view(template_name='portal/home.html'), name='logout'),
     url(r'^account_activation_sent/$', views.account_activation_sent, name='account_activation_sent'),
@@ -24,6 +27,9 @@ urlpatterns = [
 
     url(r'^job/details/(?P<pk>[0-9]+)/$', views.JobDetailView.as_view(), name='job_details'),
     url(r'^job/search/$', views.job_search, name='job_search'),
+    url(r'^search/cache/stats/$', views.search_cache_stats, name='search_cache_stats'),
+    url(r'^query/profile/$', views.query_profile_stats, name='query_profile_stats'),
+    url(r'^metrics$', views.metrics, name='metrics'),
     # url(r'^job/search/$', FilterView.as_view(filterset_class=JobFilter, template_name='portal/job_search.html'), name='job_search'),
 
     url(r'^job/proposal/add/(?P<job_id>[0-9]+)/$', views.proposal_add, name='proposal_add'),
@@ -37,7 +43,8 @@ urlpatterns = [
 
     url(r'^password/change/$', views.change_password, name='password_change'),
 
-    url(r'^password/reset/$', auth_views.password_reset, {'post_reset_redirect': '/password/reset/done/'}, name='password_reset'),
+    url(r'^password/reset/$', auth_views.password_reset, {'post_reset_redirect': '/password/reset/done/',
+                                                         'password_reset_form': QueuedPasswordResetForm}, name='password_reset'),
 
     url(r'^password/reset/done/$', auth_views.password_reset_done, name='password_reset_done'),
 
@@ -1,3 +1,4 @@
+import os
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
@@ -6,18 +7,30 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django.core.mail import send_mail
+from django.utils.text import slugify
 from functools import wraps
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 
 from .tokens import account_activation_token
 from .forms import SignUpForm, UpdateProfileForm, ProposalForm, ProposalUpdateForm
 from django.conf import settings
-from .models import Candidate, City, Industry, Role, Qualification, Proposal, Package, Recharge
+from .models import Candidate, City, Industry, Role, Qualification, Proposal, Package
 from recruiter.models import Job
 from .filters import JobFilter
 from .my_messages import no_subscription_message
+from .search_cache import job_search_cache, candidate_search_cache, fetch_in_order
+from .recharge import make_recharge
+from .mail import queue_mail
+from .downloads import protected_file_response
+from .query_profiler import query_profiles
+from .metrics import PROMETHEUS_CONTENT_TYPE, collect, email_queue_depth, process_metrics, render_metrics, \
+    scrape_allowed
+from .reference_data import attach_reference_data
+from .pagination import CURSOR_PARAM, CursorPaginationMixin, paginate_sequence, querystring_without_cursor
+
+SEARCH_PAGINATE_BY = 10
 
 
 def first_page(request):
@@ -27,8 +40,7 @@ def first_page(request):
 def subscription_required(function):
     @wraps(function)
     def wrap(request, *args, **kwargs):
-        candidate = request.user.candidate
-        if candidate.has_subscription():
+        if request.profile.has_subscription('candidate'):
             return function(request, *args, **kwargs)
         else:
             messages.error(request, no_subscription_message)
@@ -39,13 +51,36 @@ def subscription_required(function):
 class SubscriptionRequiredMixin(object):
 
     def dispatch(self, request, *args, **kwargs):
-        if request.user.candidate.has_subscription():
+        if request.profile.has_subscription('candidate'):
             return super().dispatch(request, *args, **kwargs)
         else:
             messages.warning(request, no_subscription_message)
             return redirect('portal:account')
 
 
+@staff_member_required
+def search_cache_stats(request):
+    return JsonResponse({'job': job_search_cache.stats(), 'candidate': candidate_search_cache.stats()})
+
+
+@staff_member_required
+def query_profile_stats(request):
+    # profiles of this worker process only, ?records=1 adds the raw ones
+    data = {'views': query_profiles.summary()}
+    if request.GET.get('records'):
+        data['records'] = query_profiles.records()
+    return JsonResponse(data)
+
+
+def metrics(request):
+    # prometheus scrape target, only answered with the bearer token of METRICS_TOKEN
+    if not scrape_allowed(request):
+        raise Http404
+    # this worker's latest counts, the others are at most METRICS_FLUSH_INTERVAL old
+    process_metrics.flush()
+    return HttpResponse(render_metrics(collect(), email_queue_depth()), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 def home(request):
     return render(request, 'portal/home.html', {'user': request.user})
 
@@ -63,7 +98,7 @@ def recharge_make(request, package_id):
         package = get_object_or_404(Package, id=package_id, user_type='Candidate')
         # payment process
         # payment process
-        recharge = Recharge.objects.create(user=request.user, package=package)
+        recharge = make_recharge(request.user, package)
         messages.success(request, 'Recharge of {} rupees has been successful. Your validity is till {}'.format(
             recharge.package.price, request.user.candidate.recharge_validity
         ))
@@ -77,6 +112,23 @@ def profile(request):
         return render(request, 'portal/profile.html', {'candidate': request.user.candidate})
 
 
+@login_required
+def resume_download(request, candidate_id):
+    # a candidate downloads their own resume, a subscribed recruiter any resume, nobody else sees one
+    candidate = get_object_or_404(Candidate.objects.only('id', 'user_id', 'full_name', 'resume'), id=candidate_id)
+    if candidate.user_id != request.user.id:
+        if request.profile.role != 'recruiter':
+            raise Http404
+        if not request.profile.has_subscription('recruiter'):
+            messages.error(request, no_subscription_message)
+            return redirect('recruiter:account')
+    if not candidate.resume:
+        raise Http404
+    extension = os.path.splitext(candidate.resume.name)[1]
+    filename = '{}-resume{}'.format(slugify(candidate.full_name) or 'candidate-{}'.format(candidate.id), extension)
+    return protected_file_response(request, candidate.resume.storage, candidate.resume.name, filename)
+
+
 @login_required
 def update_profile(request):
     candidate = request.user.candidate
@@ -96,7 +148,10 @@ def update_profile(request):
 
 @login_required
 def dashboard(request):
-    return render(request, 'portal/dashboard.html', {'candidate': request.user.candidate})
+    candidate = request.user.candidate
+    recommendations = list(candidate.jobrecommendation_set.select_related('job'))
+    attach_reference_data([recommendation.job for recommendation in recommendations], 'city')
+    return render(request, 'portal/dashboard.html', {'candidate': candidate, 'recommendations': recommendations})
 
 
 def register(request):
@@ -116,7 +171,7 @@ def register(request):
             email_message = "Email Verification from Shadab Manpowers\n" \
                             "Activate your account for {0} \n\n" \
                             "{1}".format(domain, activation_link)
-            send_mail(from_email=settings.EMAIL_HOST_USER, recipient_list=[user.email], subject=subject, message=email_message)
+            queue_mail(subject, email_message, [user.email], from_email=settings.EMAIL_HOST_USER)
             return redirect('portal:account_activation_sent')
     else:
         form = SignUpForm()
@@ -162,7 +217,13 @@ from django.contrib.auth.forms import PasswordChangeForm
 def job_search(request):
     jobs = Job.objects.all()
     j_filter = JobFilter(request.GET, queryset=jobs)
-    return render(request, 'portal/job_search.html', {'filter': j_filter})
+    j_filter.add_facet_counts()
+    job_ids = job_search_cache.get_ids(j_filter)
+    page_obj = paginate_sequence(job_ids, request.GET.get(CURSOR_PARAM), SEARCH_PAGINATE_BY)
+    page_obj.object_list = attach_reference_data(fetch_in_order(Job.objects.all(), page_obj.object_list), 'city')
+    return render(request, 'portal/job_search.html', {'filter': j_filter, 'jobs': page_obj.object_list,
+                                                      'page_obj': page_obj, 'is_paginated': page_obj.has_other_pages(),
+                                                      'querystring': querystring_without_cursor(request)})
 
 
 # JOB DETAIL VIEW
@@ -175,6 +236,9 @@ class JobDetailView(LoginRequiredMixin, SubscriptionRequiredMixin, DetailView):
         context['have_proposal'] = self.request.user.candidate.check_job_proposal_exist(context['object'].id)
         return context
 
+    def get_object(self, queryset=None):
+        return attach_reference_data([super().get_object(queryset)], 'role', 'industry', 'city')[0]
+
     template_name = 'portal/job_details.html'
 
 
@@ -207,9 +271,12 @@ class ProposalDetailView(LoginRequiredMixin, DetailView):
 
     model = Proposal
 
+    def get_queryset(self):
+        return Proposal.objects.select_related('job')
+
     def get_object(self, queryset=None):
         proposal = super().get_object(queryset=queryset)
-        if proposal.posted_by != self.request.user.candidate:
+        if proposal.posted_by_id != self.request.user.candidate.id:
             raise Http404()
         else:
             return proposal
@@ -223,14 +290,14 @@ class ProposalDetailView(LoginRequiredMixin, DetailView):
 
 
 # PROPOSAL LIST VIEW
-class ProposalListView(LoginRequiredMixin, ListView):
+class ProposalListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     template_name = 'portal/proposal_list.html'
     context_object_name = 'proposals'
     paginate_by = 10
-    ordering = ['-created']
+    cursor_ordering = ('-on', '-id')
 
     def get_queryset(self):
-        return self.request.user.candidate.proposal_set.all()
+        return self.request.user.candidate.proposal_set.select_related('job')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
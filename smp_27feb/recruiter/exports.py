@@ -0,0 +1,89 @@
+import csv
+import json
+from portal.models import Candidate
+
+
+# stays below the 999 parameters sqlite allows in the IN (...) of the m2m lookup
+EXPORT_CHUNK_SIZE = 500
+
+# column -> (related fields to select, value getter)
+EXPORT_COLUMNS = {
+    'id': ((), lambda candidate, related: candidate.id),
+    'full_name': ((), lambda candidate, related: candidate.full_name),
+    'first_name': ((), lambda candidate, related: candidate.first_name),
+    'last_name': ((), lambda candidate, related: candidate.last_name),
+    'email': ((), lambda candidate, related: candidate.email or ''),
+    'phone': ((), lambda candidate, related: candidate.phone),
+    'experience': ((), lambda candidate, related: candidate.experience),
+    'qualification': (('qualification',), lambda candidate, related: str(candidate.qualification or '')),
+    'industry': (('industry',), lambda candidate, related: str(candidate.industry or '')),
+    'city': (('city',), lambda candidate, related: str(candidate.city or '')),
+    'roles': ((), lambda candidate, related: related['roles'].get(candidate.id, [])),
+    'skills': ((), lambda candidate, related: related['skills'].get(candidate.id, [])),
+    'resume': ((), lambda candidate, related: candidate.resume.name if candidate.resume else ''),
+}
+DEFAULT_EXPORT_COLUMNS = ('id', 'full_name', 'email', 'phone', 'qualification', 'experience', 'city', 'skills')
+M2M_COLUMNS = {'roles': (Candidate.roles.through, 'role'), 'skills': (Candidate.skills.through, 'skill')}
+
+
+def parse_columns(value):
+    columns = [column.strip() for column in (value or '').split(',') if column.strip()]
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError('unknown columns: {}'.format(', '.join(unknown)))
+    return columns or list(DEFAULT_EXPORT_COLUMNS)
+
+
+def _related_names(candidate_ids, columns):
+    # names of the m2m values of one chunk of candidates, one query per m2m column
+    related = {'roles': {}, 'skills': {}}
+    for column in columns:
+        if column in M2M_COLUMNS:
+            through, field = M2M_COLUMNS[column]
+            pairs = through.objects.filter(candidate_id__in=candidate_ids).order_by(field + '__name') \
+                .values_list('candidate_id', field + '__name')
+            for candidate_id, name in pairs:
+                related[column].setdefault(candidate_id, []).append(name)
+    return related
+
+
+def iter_export_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    # rows as lists of values, holding only one chunk of candidates in memory at a time
+    select = sorted(set(field for column in columns for field in EXPORT_COLUMNS[column][0]))
+    queryset = queryset.select_related(*select).order_by('id')
+    chunk = []
+    for candidate in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(candidate)
+        if len(chunk) >= chunk_size:
+            yield from _chunk_rows(chunk, columns)
+            chunk = []
+    if chunk:
+        yield from _chunk_rows(chunk, columns)
+
+
+def _chunk_rows(chunk, columns):
+    related = _related_names([candidate.id for candidate in chunk], columns)
+    for candidate in chunk:
+        yield [EXPORT_COLUMNS[column][1](candidate, related) for column in columns]
+
+
+class Echo(object):
+    # file-like object for csv.writer that hands every line back instead of storing it
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([', '.join(value) if isinstance(value, list) else value for value in row])
+
+
+def jsonl_lines(rows, columns):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+EXPORT_FORMATS = {'csv': (csv_lines, 'text/csv'), 'jsonl': (jsonl_lines, 'application/x-ndjson')}
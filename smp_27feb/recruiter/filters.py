@@ -1,10 +1,27 @@
 import django_filters
-from portal.models import Candidate
+from portal.models import Candidate, Skill
+from portal.reference_data import CachedModelMultipleChoiceFilter, REFERENCE_FILTER_OVERRIDES
+from portal.search import search_candidate_resumes
 
 
 class CandidateFilter(django_filters.FilterSet):
     paginate_by = 1
+    # candidates whose experience range overlaps [experience_from, experience_upto]
+    experience_from = django_filters.NumberFilter(label='experience from (years)', field_name='experience_max',
+                                                  lookup_expr='gte')
+    experience_upto = django_filters.NumberFilter(label='experience upto (years)', field_name='experience_min',
+                                                  lookup_expr='lte')
+    # skills are AND-ed, roles stay OR-ed like the default filter
+    skills = CachedModelMultipleChoiceFilter(label='skills (all of)', queryset=Skill.objects.all(), conjoined=True)
+    without_skills = CachedModelMultipleChoiceFilter(label='without skills', field_name='skills',
+                                                     queryset=Skill.objects.all(), exclude=True)
+    # words of the resume text extracted by portal.resume_text
+    q = django_filters.CharFilter(label='resume keywords', method='filter_resume_keywords')
 
     class Meta:
         model = Candidate
         fields = ['qualification', 'industry', 'experience', 'roles', 'city', 'skills']
+        filter_overrides = REFERENCE_FILTER_OVERRIDES
+
+    def filter_resume_keywords(self, queryset, name, value):
+        return search_candidate_resumes(queryset, value)
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from portal.reference_data import REFERENCE_FIELD_CLASSES
 from .models import Recruiter, Job
 
 
@@ -34,6 +35,7 @@ class JobPostForm(forms.ModelForm):
     class Meta:
         model = Job
         exclude = ('posted_by', 'posted_on')
+        field_classes = REFERENCE_FIELD_CLASSES
 
 
 class JobUpdateForm(forms.ModelForm):
@@ -59,5 +61,6 @@ class JobUpdateForm(forms.ModelForm):
     class Meta:
         model = Job
         exclude = ('posted_by', 'posted_on')
+        field_classes = REFERENCE_FIELD_CLASSES
 
 
@@ -1,16 +1,24 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
-from portal.models import EXPERIENCE_CHOICES
-from django.db.models.signals import post_save
+from portal.models import EXPERIENCE_CHOICES, set_experience_range, ManagedFieldsMixin, extend_recharge_validity
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate, m2m_changed
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
-from portal.models import Proposal
+from portal.models import Candidate, Proposal
+from portal.search import index_job, unindex_job, create_job_index_after_migrate
+from portal.search_cache import invalidate_job_search
+from portal.middleware import invalidate_new_profile
 
 
 RECRUITER_TYPES = (('Individual', 'Individual'), ('Company', 'Company'))
 
 
-class Recruiter(models.Model):
+class Recruiter(ManagedFieldsMixin, models.Model):
+    # the counters are kept by the signals below, the recharge fields by extend_recharge_validity
+    managed_fields = ('jobs_posted_count', 'candidates_liked_count', 'proposals_received_count', 'last_recharge',
+                      'recharge_validity')
+
     user = models.OneToOneField(User, on_delete=models.PROTECT)
     full_name = models.CharField(max_length=200, blank=True, verbose_name="full name",
                                  help_text='as appears in documents')
@@ -25,6 +33,10 @@ class Recruiter(models.Model):
     last_recharge = models.DateTimeField(blank=True, null=True)
     recharge_validity = models.DateTimeField(blank=True, null=True)
 
+    jobs_posted_count = models.PositiveIntegerField(default=0, editable=False)
+    candidates_liked_count = models.PositiveIntegerField(default=0, editable=False)
+    proposals_received_count = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return self.full_name
 
@@ -43,27 +55,29 @@ class Recruiter(models.Model):
             return False
 
     def add_recharge(self, package_validity_days):
-        validity_days = timezone.timedelta(days=package_validity_days)
-        self.last_recharge = timezone.now()
-        if not self.recharge_validity or self.recharge_validity < timezone.now():
-            self.recharge_validity = (timezone.now() + validity_days)
-        elif self.recharge_validity > timezone.now():
-            self.recharge_validity += validity_days
-        self.save()
+        self.last_recharge, self.recharge_validity = extend_recharge_validity(
+            type(self), self.user_id, package_validity_days)
 
     def has_subscription(self):
         return self.recharge_validity is not None and self.recharge_validity > timezone.now()
 
     @property
     def get_proposal_count(self):
-        return Proposal.objects.filter(job__posted_by=self).count()
+        return self.proposals_received_count
+
+
+post_save.connect(invalidate_new_profile, sender=Recruiter)
+post_delete.connect(invalidate_new_profile, sender=Recruiter)
 
 
 JOB_TYPE_CHOICES = (('Full Time', 'Full Time'), ('Part Time', "Part Time"),
                     ('Home Based', 'Home Base'), ('Contract', 'Contract'), ('Other', 'Other'))
 
 
-class Job(models.Model):
+class Job(ManagedFieldsMixin, models.Model):
+    # proposal_count is kept by the proposal signals, alerts_matched_on is set by portal.alerts
+    managed_fields = ('proposal_count', 'alerts_matched_on')
+
     role = models.ForeignKey('portal.Role', on_delete=models.PROTECT, blank=True, null=True,
                              verbose_name='job role')
     headline = models.CharField(max_length=200, blank=True, help_text='ex.(required teacher for 5th standard)')
@@ -71,6 +85,8 @@ class Job(models.Model):
                                  help_text='industry type of job')
     experience = models.CharField(max_length=100, choices=EXPERIENCE_CHOICES, blank=True,
                                   help_text='required experience')
+    experience_min = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    experience_max = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
     job_type = models.CharField(max_length=50, choices=JOB_TYPE_CHOICES, default='Full Time')
     qualifications = models.ManyToManyField('portal.Qualification', blank=True, help_text='exact qualification required')
     skills = models.ManyToManyField('portal.Skill', blank=True, help_text='key skills')
@@ -88,6 +104,21 @@ class Job(models.Model):
     requirements = models.TextField(blank=True, help_text='requirements for job applicant')
     posted_by = models.ForeignKey(Recruiter, on_delete=models.CASCADE)
     posted_on = models.DateTimeField(auto_now_add=True)
+    proposal_count = models.PositiveIntegerField(default=0, editable=False)
+    alerts_matched_on = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        # one index per common JobFilter combination, see portal.tests
+        indexes = [models.Index(fields=['experience_min', 'experience_max'], name='job_experience_idx'),
+                   models.Index(fields=['city', 'role', 'salary_from'], name='job_city_role_salary_idx'),
+                   models.Index(fields=['role', 'salary_from'], name='job_role_salary_idx'),
+                   models.Index(fields=['industry', 'experience'], name='job_industry_exp_idx'),
+                   models.Index(fields=['experience', 'salary_from'], name='job_exp_salary_idx'),
+                   models.Index(fields=['salary_from', 'salary_upto'], name='job_salary_idx'),
+                   # keyset pages of JobListView, see portal.pagination
+                   models.Index(fields=['posted_by', 'posted_on'], name='job_posted_by_on_idx'),
+                   # jobs waiting for portal.alerts
+                   models.Index(fields=['alerts_matched_on'], name='job_alerts_matched_idx')]
 
     def __str__(self):
         return str(self.headline)
@@ -103,7 +134,15 @@ def default_headline(instance, sender, *args, **kwargs):
         instance.save()
 
 
+pre_save.connect(set_experience_range, sender=Job)
 post_save.connect(default_headline, sender=Job)
+post_save.connect(index_job, sender=Job)
+post_delete.connect(unindex_job, sender=Job)
+post_migrate.connect(create_job_index_after_migrate)
+post_save.connect(invalidate_job_search, sender=Job)
+post_delete.connect(invalidate_job_search, sender=Job)
+m2m_changed.connect(invalidate_job_search, sender=Job.skills.through)
+m2m_changed.connect(invalidate_job_search, sender=Job.qualifications.through)
 
 
 class CandidateLike(models.Model):
@@ -116,3 +155,60 @@ class CandidateLike(models.Model):
 
     class Meta:
         unique_together = ['candidate', 'recruiter']
+        indexes = [models.Index(fields=['recruiter', 'on'], name='candidatelike_recruiter_on_idx')]
+
+
+def change_counter(model, pk_filter, field, delta):
+    model.objects.filter(**pk_filter).update(**{field: F(field) + delta})
+
+
+def count_job(instance, created, *args, **kwargs):
+    if created:
+        change_counter(Recruiter, {'id': instance.posted_by_id}, 'jobs_posted_count', 1)
+
+
+def uncount_job(instance, *args, **kwargs):
+    change_counter(Recruiter, {'id': instance.posted_by_id}, 'jobs_posted_count', -1)
+
+
+def count_candidate_like(instance, created, *args, **kwargs):
+    if created:
+        change_counter(Recruiter, {'id': instance.recruiter_id}, 'candidates_liked_count', 1)
+
+
+def uncount_candidate_like(instance, *args, **kwargs):
+    change_counter(Recruiter, {'id': instance.recruiter_id}, 'candidates_liked_count', -1)
+
+
+def change_proposal_counters(proposal, delta):
+    # when a job is deleted its proposals go first, the job row is still there to find the recruiter
+    change_counter(Candidate, {'id': proposal.posted_by_id}, 'proposals_sent_count', delta)
+    change_counter(Job, {'id': proposal.job_id}, 'proposal_count', delta)
+    change_counter(Recruiter, {'job__id': proposal.job_id}, 'proposals_received_count', delta)
+
+
+def count_proposal(instance, created, *args, **kwargs):
+    if created:
+        change_proposal_counters(instance, 1)
+
+
+def uncount_proposal(instance, *args, **kwargs):
+    change_proposal_counters(instance, -1)
+
+
+post_save.connect(count_job, sender=Job)
+post_delete.connect(uncount_job, sender=Job)
+post_save.connect(count_candidate_like, sender=CandidateLike)
+post_delete.connect(uncount_candidate_like, sender=CandidateLike)
+post_save.connect(count_proposal, sender=Proposal)
+post_delete.connect(uncount_proposal, sender=Proposal)
+
+
+# (model, counter field, counted model, lookup from the counted model to the model), see reconcile_counters
+COUNTERS = (
+    (Recruiter, 'jobs_posted_count', Job, 'posted_by'),
+    (Recruiter, 'candidates_liked_count', CandidateLike, 'recruiter'),
+    (Recruiter, 'proposals_received_count', Proposal, 'job__posted_by'),
+    (Candidate, 'proposals_sent_count', Proposal, 'posted_by'),
+    (Job, 'proposal_count', Proposal, 'job'),
+)
@@ -1,3 +1,203 @@
+import json
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from unittest import skipUnless
 
-# Create your tests here.
+from portal.models import Candidate, Proposal, City, Skill
+from django.utils import timezone
+from portal.pagination import NEXT, decode_cursor, encode_cursor, keyset_filter
+from portal.tests import QueryPlanTestMixin, CursorPagesTestMixin, create_lookup_rows
+from .exports import DEFAULT_EXPORT_COLUMNS, iter_export_rows, parse_columns
+from .filters import CandidateFilter
+from .models import Recruiter, Job, CandidateLike
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is sqlite specific')
+class CandidateFilterQueryPlanTests(QueryPlanTestMixin, TestCase):
+
+    common_filters = [
+        {'city': '1'},
+        {'qualification': '1'},
+        {'industry': '1'},
+        {'experience': '2-4'},
+        {'city': '1', 'qualification': '1'},
+        {'industry': '1', 'experience': '2-4'},
+        {'qualification': '1', 'experience': '2-4'},
+        {'experience': '2-4', 'city': '1'},
+        {'skills': ['1']},
+        {'roles': ['1']},
+        {'skills': ['1'], 'city': '1'},
+        {'experience_from': '3'},
+        {'experience_from': '3', 'experience_upto': '6'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        # model choice filters only validate against existing rows
+        create_lookup_rows()
+
+    def test_common_filters_use_an_index(self):
+        for data in self.common_filters:
+            with self.subTest(filters=data):
+                candidate_filter = CandidateFilter(data, queryset=Candidate.objects.all())
+                self.assertNoTableScan(candidate_filter.qs, Candidate._meta.db_table)
+
+
+class ProposalListQueryTests(CursorPagesTestMixin, TestCase):
+    # session, recruiter, page, and the per job aggregate when grouped, the user comes from the cache
+    queries_per_page = 3
+    queries_per_grouped_page = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='recruiter')
+        recruiter = Recruiter.objects.create(user=cls.user, full_name='Recruiter')
+        jobs = [Job.objects.create(headline='job {}'.format(i), posted_by=recruiter) for i in range(3)]
+        for i in range(12):
+            candidate = Candidate.objects.create(user=User.objects.create(username='candidate{}'.format(i)),
+                                                 full_name='Candidate {}'.format(i))
+            Proposal.objects.create(job=jobs[i % 3], posted_by=candidate)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_page_queries_do_not_grow_with_proposals(self):
+        pages = self.walk_cursor_pages(reverse('recruiter:proposal_list'), {}, 'proposals', self.queries_per_page)
+        self.assertEqual(sorted(sum(pages, [])), sorted(Proposal.objects.values_list('id', flat=True)))
+
+    def test_grouped_pages_keep_jobs_together(self):
+        pages = self.walk_cursor_pages(reverse('recruiter:proposal_list'), {'group': 'job'}, 'proposals',
+                                       self.queries_per_grouped_page)
+        jobs = [Proposal.objects.get(id=pk).job_id for pk in sum(pages, [])]
+        self.assertEqual(jobs, sorted(jobs, reverse=True))
+
+    def test_grouped_page_counts_come_from_one_aggregate(self):
+        response = self.client.get(reverse('recruiter:proposal_list'), {'group': 'job'})
+        counts = [(job.total_proposals, job.unread_proposals) for job, proposals in response.context['job_groups']]
+        self.assertEqual(counts, [(4, 4)] * 3)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is sqlite specific')
+class KeysetQueryPlanTests(QueryPlanTestMixin, TestCase):
+
+    def test_job_list_pages_use_an_index(self):
+        cursor = encode_cursor(NEXT, [timezone.now(), 10])
+        jobs = Job.objects.filter(posted_by_id=1)
+        page_queryset = jobs.filter(keyset_filter(('-posted_on', '-id'), decode_cursor(cursor)[1])) \
+            .order_by('-posted_on', '-id')
+        self.assertNoTableScan(page_queryset, Job._meta.db_table)
+
+
+class CandidateExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='recruiter')
+        Recruiter.objects.create(user=cls.user, full_name='Recruiter',
+                                 recharge_validity=timezone.now() + timezone.timedelta(days=30))
+        cls.pune, delhi = City.objects.create(name='Pune'), City.objects.create(name='Delhi')
+        python, django = Skill.objects.create(name='python'), Skill.objects.create(name='django')
+        cls.candidates = []
+        for number in range(5):
+            candidate = Candidate.objects.create(user=User.objects.create(username='candidate{}'.format(number)),
+                                                 full_name='Candidate {}'.format(number),
+                                                 city=cls.pune if number % 2 else delhi)
+            candidate.skills.set([python, django] if number % 2 else [python])
+            cls.candidates.append(candidate)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('recruiter:candidate_search_export'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_columns_are_validated(self):
+        self.assertEqual(parse_columns(None), list(DEFAULT_EXPORT_COLUMNS))
+        self.assertEqual(parse_columns(' id, city ,,skills'), ['id', 'city', 'skills'])
+        with self.assertRaisesMessage(ValueError, 'unknown columns: password, user'):
+            parse_columns('id,password,user')
+
+    def test_rows_are_read_in_chunks(self):
+        # the candidates, then one skills query per chunk of two
+        with self.assertNumQueries(4):
+            rows = list(iter_export_rows(Candidate.objects.all(), ['id', 'skills'], chunk_size=2))
+        self.assertEqual(rows, [[candidate.id, ['django', 'python'] if number % 2 else ['python']]
+                                for number, candidate in enumerate(self.candidates)])
+
+    def test_csv_export_streams_the_filtered_candidates(self):
+        response, content = self.export(columns='id,full_name,city,skills', city=self.pune.pk)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="candidates.csv"')
+        self.assertEqual(content.splitlines(), [
+            'id,full_name,city,skills',
+            '{},Candidate 1,Pune,"django, python"'.format(self.candidates[1].id),
+            '{},Candidate 3,Pune,"django, python"'.format(self.candidates[3].id)])
+
+    def test_jsonl_export_keeps_lists(self):
+        response, content = self.export(format='jsonl', columns='id,skills')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[1], {'id': self.candidates[1].id, 'skills': ['django', 'python']})
+
+    def test_bad_requests_are_refused(self):
+        url = reverse('recruiter:candidate_search_export')
+        response = self.client.get(url, {'columns': 'id,password'})
+        self.assertEqual((response.status_code, response.content), (400, b'unknown columns: password'))
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+
+
+class ActivityCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recruiter = Recruiter.objects.create(user=User.objects.create(username='recruiter'), full_name='Recruiter')
+        cls.candidate = Candidate.objects.create(user=User.objects.create(username='candidate'), full_name='Candidate')
+        cls.job = Job.objects.create(headline='python developer', posted_by=cls.recruiter)
+
+    def assertCounters(self, jobs_posted, candidates_liked, proposals_received, proposals_sent, proposal_count):
+        self.assertEqual(Recruiter.objects.values_list(
+            'jobs_posted_count', 'candidates_liked_count', 'proposals_received_count').get(pk=self.recruiter.pk),
+            (jobs_posted, candidates_liked, proposals_received))
+        self.assertEqual(Candidate.objects.get(pk=self.candidate.pk).proposals_sent_count, proposals_sent)
+        self.assertEqual(Job.objects.get(pk=self.job.pk).proposal_count, proposal_count)
+
+    def test_signals_keep_the_counters(self):
+        self.assertCounters(1, 0, 0, 0, 0)
+        like = CandidateLike.objects.create(candidate=self.candidate, recruiter=self.recruiter)
+        proposal = Proposal.objects.create(job=self.job, posted_by=self.candidate)
+        self.assertCounters(1, 1, 1, 1, 1)
+        like.delete()
+        proposal.delete()
+        self.assertCounters(1, 0, 0, 0, 0)
+
+    def test_stale_save_keeps_the_increments(self):
+        recruiter = Recruiter.objects.get(pk=self.recruiter.pk)
+        candidate = Candidate.objects.get(pk=self.candidate.pk)
+        job = Job.objects.get(pk=self.job.pk)
+        Proposal.objects.create(job=self.job, posted_by=self.candidate)
+        recruiter.full_name, candidate.full_name, job.headline = 'Renamed', 'Renamed', 'django developer'
+        for instance in (recruiter, candidate, job):
+            instance.save()
+        self.assertCounters(1, 0, 1, 1, 1)
+        self.assertEqual(Job.objects.get(pk=self.job.pk).headline, 'django developer')
+
+    def test_reconcile_counters_repairs_drift(self):
+        Proposal.objects.create(job=self.job, posted_by=self.candidate)
+        Recruiter.objects.update(jobs_posted_count=7, proposals_received_count=0)
+        Candidate.objects.update(proposals_sent_count=3)
+        Job.objects.update(proposal_count=0)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertCounters(1, 0, 1, 1, 1)
+        self.assertIn('Fixed 1 recruiter.jobs_posted_count', out.getvalue())
+        self.assertIn('Fixed 0 recruiter.candidates_liked_count', out.getvalue())
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertNotIn('Fixed 1', out.getvalue())
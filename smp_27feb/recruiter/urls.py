@@ -31,6 +31,7 @@ urlpatterns = [
     url(r'^proposal/details/(?P<pk>[0-9]+)/$', views.ProposalDetailView.as_view(), name='proposal_details'),
 
     url(r'^candidate/search/$', views.candidate_search, name='candidate_search'),
+    url(r'^candidate/search/export/$', views.candidate_search_export, name='candidate_search_export'),
     url(r'^candidate/details/(?P<pk>[0-9]+)/$', views.CandidateDetailView.as_view(), name='candidate_details'),
 
     url(r'^candidate/like/(?P<candidate_id>[0-9]+)/$', views.candidate_like, name='candidate_like'),
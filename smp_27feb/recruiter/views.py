@@ -6,18 +6,29 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.shortcuts import render, redirect, reverse, get_list_or_404, get_object_or_404
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django.core.mail import send_mail
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from functools import wraps
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
 
 from .tokens import account_activation_token
 from .forms import SignUpForm, UpdateProfileForm, JobPostForm, JobUpdateForm
 from django.conf import settings
 from .models import Recruiter, Job, CandidateLike
-from portal.models import Candidate, Proposal, Package, Recharge
+from portal.models import Candidate, Proposal, Package
 from .filters import CandidateFilter
+from .exports import EXPORT_FORMATS, parse_columns, iter_export_rows
 from portal.my_messages import no_subscription_message
+from portal.recharge import make_recharge
+from portal.mail import queue_mail
+from portal.search_cache import candidate_search_cache, fetch_in_order
+from portal.bitmap_index import candidate_bitmap_index
+from portal.matching import best_matches
+from portal.reference_data import attach_reference_data
+from portal.views import SEARCH_PAGINATE_BY
+from portal.pagination import CURSOR_PARAM, CursorPaginationMixin, paginate_sequence, querystring_without_cursor
 
 recruiter_login_url = '/recruiter/login/'
 
@@ -25,8 +36,7 @@ recruiter_login_url = '/recruiter/login/'
 def subscription_required(function):
     @wraps(function)
     def wrap(request, *args, **kwargs):
-        recruiter = request.user.recruiter
-        if recruiter.has_subscription():
+        if request.profile.has_subscription('recruiter'):
             return function(request, *args, **kwargs)
         else:
             messages.error(request, no_subscription_message)
@@ -37,7 +47,7 @@ def subscription_required(function):
 class SubscriptionRequiredMixin(object):
 
     def dispatch(self, request, *args, **kwargs):
-        if request.user.recruiter.has_subscription():
+        if request.profile.has_subscription('recruiter'):
             return super().dispatch(request, *args, **kwargs)
         else:
             messages.warning(request, no_subscription_message)
@@ -57,7 +67,7 @@ def recharge_make(request, package_id):
         package = get_object_or_404(Package, id=package_id, user_type='Recruiter')
         # payment process
         # payment process
-        recharge = Recharge.objects.create(user=request.user, package=package)
+        recharge = make_recharge(request.user, package)
         messages.success(request, 'Recharge of {} rupees has been successful. Your validity is till {}'.format(
             recharge.package.price, request.user.recruiter.recharge_validity
         ))
@@ -114,7 +124,7 @@ def register(request):
             activation_link = '{0}/recruiter/activate/{1}/{2}'.format(domain, uid, token)
             email_message = "\t Activate your account for {0} \n" \
                             "{1}".format(domain,     activation_link)
-            send_mail(from_email=settings.EMAIL_HOST_USER, recipient_list=[user.email], subject=subject, message=email_message)
+            queue_mail(subject, email_message, [user.email], from_email=settings.EMAIL_HOST_USER)
             print(activation_link)
             return redirect('recruiter:account_activation_sent')
         else:
@@ -165,7 +175,10 @@ def job_post(request):
         if form.is_valid():
             temp_form = form.save(commit=False)
             temp_form.posted_by = request.user.recruiter
-            temp_form.save()
+            # job alerts are matched by the send_job_alerts worker, which must see the job with its skills
+            with transaction.atomic():
+                temp_form.save()
+                form.save_m2m()
             messages.success(request, 'succesfully posted a job')
             return redirect("recruiter:home")
         else:
@@ -175,18 +188,19 @@ def job_post(request):
     return render(request, 'recruiter/job_post.html', {'form': form})
 
 
-class JobListView(LoginRequiredMixin, ListView):
+class JobListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     login_url = recruiter_login_url
     template_name = 'recruiter/job_list.html'
     context_object_name = 'jobs'
     paginate_by = 10
-    # ordering = ['-id']
+    cursor_ordering = ('-posted_on', '-id')
 
     def get_queryset(self):
-        return self.request.user.recruiter.job_set.all().order_by('-id')
+        return self.request.user.recruiter.job_set.all()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        attach_reference_data(context['jobs'], 'city')
         context.update({'recruiter': self.request.user.recruiter})
         return context
 
@@ -195,9 +209,11 @@ class JobDetailView(LoginRequiredMixin, DetailView):
     login_url = recruiter_login_url
 
     model = Job
+    best_matches_count = 10
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context.update({'best_matches': best_matches(context['object'], k=self.best_matches_count)})
         return context
 
     def get_object(self, queryset=None):
@@ -205,7 +221,7 @@ class JobDetailView(LoginRequiredMixin, DetailView):
         if job.posted_by != self.request.user.recruiter:
             raise Http404
         else:
-            return job
+            return attach_reference_data([job], 'role', 'industry', 'city')[0]
 
 
 @login_required(login_url=recruiter_login_url)
@@ -243,18 +259,42 @@ def job_delete(request, job_id):
         return HttpResponse("you dont have such job")
 
 
-class ProposalListView(LoginRequiredMixin, ListView):
+class ProposalListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     login_url = recruiter_login_url
     template_name = 'recruiter/proposal_list.html'
     context_object_name = 'proposals'
     paginate_by = 10
+    cursor_ordering = ('-on', '-id')
+
+    def group_by_job(self):
+        return self.request.GET.get('group') == 'job'
+
+    def get_cursor_ordering(self):
+        if self.group_by_job():
+            return ('-job__posted_on', '-job_id', '-on', '-id')
+        return self.cursor_ordering
 
     def get_queryset(self):
-        return Proposal.objects.filter(job__posted_by=self.request.user.recruiter)
+        proposals = Proposal.objects.filter(job__posted_by=self.request.user.recruiter) \
+            .select_related('job', 'posted_by')
+        if self.request.GET.get('job', '').isdigit():
+            proposals = proposals.filter(job_id=self.request.GET['job'])
+        return proposals
+
+    def get_job_groups(self, proposals):
+        # [(job, proposals of the page)], every job annotated with its total and unread proposals
+        job_ids = list(dict.fromkeys(proposal.job_id for proposal in proposals))
+        jobs = Job.objects.filter(id__in=job_ids).annotate(
+            total_proposals=Count('proposal'),
+            unread_proposals=Count('proposal', filter=Q(proposal__read_on__isnull=True))).in_bulk()
+        return [(jobs[job_id], [proposal for proposal in proposals if proposal.job_id == job_id])
+                for job_id in job_ids]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({'recruiter': self.request.user.recruiter})
+        context.update({'recruiter': self.request.user.recruiter, 'group_by_job': self.group_by_job()})
+        if self.group_by_job():
+            context['job_groups'] = self.get_job_groups(context['proposals'])
         return context
 
 
@@ -268,11 +308,17 @@ class ProposalDetailView(LoginRequiredMixin, SubscriptionRequiredMixin, DetailVi
         context = super().get_context_data(**kwargs)
         return context
 
+    def get_queryset(self):
+        return Proposal.objects.select_related('job', 'posted_by')
+
     def get_object(self, queryset=None):
         proposal = super().get_object(queryset=queryset)
-        if proposal.job.posted_by != self.request.user.recruiter:
+        if proposal.job.posted_by_id != self.request.user.recruiter.id:
             raise Http404
         else:
+            if proposal.read_on is None:
+                proposal.read_on = timezone.now()
+                Proposal.objects.filter(id=proposal.id).update(read_on=proposal.read_on)
             return proposal
 
 
@@ -281,7 +327,32 @@ class ProposalDetailView(LoginRequiredMixin, SubscriptionRequiredMixin, DetailVi
 def candidate_search(request):
     candidates = Candidate.objects.all()
     ca_filter = CandidateFilter(request.GET, queryset=candidates)
-    return render(request, 'recruiter/candidate_search.html', {'filter': ca_filter})
+    candidate_ids = candidate_search_cache.get_ids(ca_filter, compute=candidate_bitmap_index.match_filterset)
+    page_obj = paginate_sequence(candidate_ids, request.GET.get(CURSOR_PARAM), SEARCH_PAGINATE_BY)
+    page_obj.object_list = attach_reference_data(
+        fetch_in_order(Candidate.objects.prefetch_related('skills'), page_obj.object_list), 'qualification', 'city')
+    return render(request, 'recruiter/candidate_search.html', {'filter': ca_filter, 'candidates': page_obj.object_list,
+                                                               'page_obj': page_obj,
+                                                               'is_paginated': page_obj.has_other_pages(),
+                                                               'querystring': querystring_without_cursor(request)})
+
+
+@login_required(login_url=recruiter_login_url)
+@subscription_required
+def candidate_search_export(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    try:
+        columns = parse_columns(request.GET.get('columns'))
+    except ValueError as error:
+        return HttpResponse(str(error), status=400)
+    ca_filter = CandidateFilter(request.GET, queryset=Candidate.objects.all())
+    lines, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(lines(iter_export_rows(ca_filter.qs, columns), columns),
+                                     content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="candidates.{}"'.format(export_format)
+    return response
 
 
 class CandidateDetailView(LoginRequiredMixin, SubscriptionRequiredMixin, DetailView):
@@ -295,6 +366,9 @@ class CandidateDetailView(LoginRequiredMixin, SubscriptionRequiredMixin, DetailV
         context.update({'candidate_liked': self.request.user.recruiter.check_candidate_liked(context['object'].id)})
         return context
 
+    def get_object(self, queryset=None):
+        return attach_reference_data([super().get_object(queryset)], 'qualification', 'industry', 'city')[0]
+
 
 @login_required(login_url=recruiter_login_url)
 @subscription_required
@@ -318,20 +392,21 @@ def candidate_unlike(request, candidate_id):
         raise Http404
 
 
-class CandidateLikeListView(LoginRequiredMixin, ListView):
+class CandidateLikeListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
 
     login_url = recruiter_login_url
     template_name = 'recruiter/candidate_like_list.html'
     context_object_name = 'candidate_likes'
-    paginate_by = 1
-    ordering = ['-created']
+    paginate_by = 10
+    cursor_ordering = ('-on', '-id')
 
     def get_queryset(self):
-        candidates = [cdlike.candidate for cdlike in self.request.user.recruiter.candidatelike_set.all()]
-        return candidates
+        return self.request.user.recruiter.candidatelike_set.select_related('candidate') \
+            .prefetch_related('candidate__skills')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        attach_reference_data([like.candidate for like in context['candidate_likes']], 'qualification', 'city')
         context.update({'recruiter': self.request.user.recruiter})
         return context
 
@@ -46,11 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'portal.middleware.MetricsMiddleware',
+    'portal.middleware.QueryProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'portal.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -130,6 +133,62 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# resumes are only served by portal.views.resume_download, MEDIA_ROOT must not be exposed by the web server.
+# 'x-accel-redirect' (nginx, with an internal location at SENDFILE_URL aliased to MEDIA_ROOT) or
+# 'x-sendfile' (apache mod_xsendfile) hand the transfer to the server, None streams it from django
+SENDFILE_BACKEND = None
+SENDFILE_URL = '/protected-media/'
+
+# uploads above FILE_UPLOAD_MAX_MEMORY_SIZE are streamed to disk and hashed once, see portal.storage
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.MemoryFileUploadHandler',
+                        'portal.storage.HashingTemporaryFileUploadHandler']
+
+# the search, reference data and profile caches of every worker are invalidated through generations kept in
+# the 'shared' cache, see portal.search_cache. the database table is created by "manage.py createcachetable",
+# memcached or redis do as well. 'default' stays local to each process
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'portal_shared_cache',
+               'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 1000000}},
+}
+GENERATION_CACHE = 'shared'
+
+# memory mapped candidate bitmap index shared by all workers, see portal.bitmap_index
+BITMAP_INDEX_DIR = os.path.join(BASE_DIR, 'bitmap_index')
+
+# gives the test run its own BITMAP_INDEX_DIR, see portal.test_runner
+TEST_RUNNER = 'portal.test_runner.PortalTestRunner'
+
+# after a candidate change the recruiters keep getting best matches from the previous candidate
+# snapshot while a thread builds the new one, see portal.matching. False builds it on the request
+MATCHING_REBUILD_IN_BACKGROUND = True
+
+# job alert digests, see portal.alerts
+JOB_ALERT_SITE_URL = 'http://localhost:8000'
+JOB_ALERT_INTERVAL_HOURS = 24
+
+# per request query counts logged to portal.query_profiler and kept for /query/profile/,
+# see portal.query_profiler. statements repeated more than the threshold in one request are flagged as N+1
+QUERY_PROFILER_ENABLED = False
+QUERY_PROFILER_N_PLUS_ONE_THRESHOLD = 10
+QUERY_PROFILER_BUFFER_SIZE = 1000
+
+# every worker writes its request, latency and cache counters here, /metrics adds them up and merges
+# the snapshots of workers that are gone into one. None disables the counters
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+# /metrics answers requests from these addresses and networks that carry no X-Forwarded-For, X-Real-IP
+# or Forwarded header, behind nginx every request comes from 127.0.0.1 so the proxy must set one of them
+INTERNAL_IPS = ['127.0.0.1', '::1']
+# and requests with "Authorization: Bearer <METRICS_TOKEN>" from anywhere, None only allows INTERNAL_IPS
+METRICS_TOKEN = None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'portal.query_profiler': {'handlers': ['console'], 'level': 'INFO', 'propagate': False}},
+}
+
 LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = '/login/'
 
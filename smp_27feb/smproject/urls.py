@@ -16,11 +16,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.conf.urls import url, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     url('', include('portal.urls', namespace='portal'), name='portal'),
     url(r'^recruiter/', include('recruiter.urls'), name='recruiter'),
-]+static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]